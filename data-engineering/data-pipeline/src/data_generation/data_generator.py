@@ -0,0 +1,73 @@
+"""
+Generate synthetic e-commerce data into data/synthetic for load-testing the pipeline.
+
+The committed sample files in data/raw are left alone; upload the generated
+files with PIPELINE_DATA_FOLDER=data/synthetic python src/data_ingestion/s3_uploader.py.
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# Make the shared helpers in src/ importable when this file is run directly
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from prefect import flow, task, get_run_logger
+
+from pipeline_utils.config import load_config
+from pipeline_utils.synthetic import write_raw_datasets
+
+
+# data-engineering/data/synthetic, untracked so the sample files in data/raw are never overwritten
+SYNTHETIC_DATA_FOLDER = Path(__file__).resolve().parents[3] / "data" / "synthetic"
+
+FLOW_CONFIG = load_config("prefect_config.yaml").get('flows', {}).get('data_generation', {})
+
+
+@task(name="generate_raw_datasets",cache_policy=None)
+def generate_raw_datasets(order_count,output_folder,chunk_orders=None,max_workers=None,seed=0):
+
+    logger = get_run_logger()
+
+    # Chunks of orders are generated and written by a process pool, then joined per dataset
+    started = time.perf_counter()
+    totals = write_raw_datasets(order_count, Path(output_folder), chunk_orders, max_workers, seed, log=logger.info)
+
+    elapsed = time.perf_counter() - started
+    total_bytes = sum(written['bytes'] for written in totals.values())
+    logger.info(f"Generated {total_bytes / 1024 ** 2:.1f} MB in {elapsed:.1f}s "
+                f"({total_bytes / 1024 ** 2 / elapsed:.1f} MB/s)")
+
+    return totals
+
+
+@flow(name=FLOW_CONFIG.get('name', "ecommerce_data_generation_flow"),
+      description=FLOW_CONFIG.get('description'),
+      retries=FLOW_CONFIG.get('retries', 0),
+      retry_delay_seconds=FLOW_CONFIG.get('retry_delay_seconds', 0))
+def generate_ecommerce_data(order_count=100_000,output_folder=None,chunk_orders=None,max_workers=None,seed=0):
+    """Generate customers, products, orders, order items and reviews as raw CSV files"""
+
+    logger = get_run_logger()
+
+    output_folder = Path(output_folder or SYNTHETIC_DATA_FOLDER)
+    logger.info(f"Generating {order_count:,} orders into {output_folder}")
+
+    return generate_raw_datasets(order_count, output_folder, chunk_orders, max_workers, seed)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Generate synthetic e-commerce data")
+    parser.add_argument("--orders", type=int, default=100_000, help="Number of orders to generate")
+    parser.add_argument("--output", type=Path, help="Output folder (default: data/synthetic)")
+    parser.add_argument("--chunk-orders", type=int, help="Orders per generated chunk")
+    parser.add_argument("--workers", type=int, help="Generator processes")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    generate_ecommerce_data(args.orders, args.output, args.chunk_orders, args.workers, args.seed)
+
+    print(f"\nNext step: upload the files with "
+          f"PIPELINE_DATA_FOLDER={args.output or SYNTHETIC_DATA_FOLDER} python src/data_ingestion/s3_uploader.py")
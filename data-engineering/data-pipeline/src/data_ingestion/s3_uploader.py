@@ -1,9 +1,30 @@
 
 import os
-import boto3
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
+# Make the shared helpers in src/ importable when this file is run directly
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from pipeline_utils.clients import s3_client
+from pipeline_utils.transfers import list_objects, load_upload_manifest, save_upload_manifest, upload_files, verify_objects
+
+
+def find_data_folder():
+    """PIPELINE_DATA_FOLDER (e.g. data/synthetic), else data/raw relative to the repo root or to this folder"""
+
+    if os.getenv('PIPELINE_DATA_FOLDER'):
+        return Path(os.getenv('PIPELINE_DATA_FOLDER'))
+
+    data_folder = Path("data/raw")
+
+    if not data_folder.exists():
+        data_folder = Path("../../data/raw")
+
+    return data_folder
+
+
 def upload_data_to_s3():
     """Upload data from data/raw/ to S3 bucket"""
     
@@ -24,8 +45,8 @@ def upload_data_to_s3():
     print(f"Region: {region}")
     
     try:
-        # Create S3 client
-        s3 = boto3.client('s3', region_name=region)
+        # Shared S3 client with a connection pool sized for the concurrent uploads
+        s3 = s3_client(region)
         
         # Create bucket if it doesn't exist
         try:
@@ -45,10 +66,7 @@ def upload_data_to_s3():
         
         # Find CSV files in data/raw/
 
-        data_folder = Path("data/raw")
-
-        if not data_folder.exists():
-            data_folder = Path("../../data/raw")
+        data_folder = find_data_folder()
 
         if not data_folder.exists():
             print("ERROR: Data folder not found!")
@@ -65,22 +83,13 @@ def upload_data_to_s3():
         
         print(f"Found {len(csv_files)} files to upload ...")
 
-        # Upload each file
-
-        uploaded_count = 0
-        for csv_file in csv_files:
-
-            s3_key = f"raw-data/{csv_file.name}"
-
-            print(f"Uploading {csv_file.name}...")
+        # Upload the files concurrently, large ones in parallel parts
 
-            try:
-                s3.upload_file(str(csv_file),bucket_name,s3_key)
-                print(f"SUCCESS: Uploaded to s3://{bucket_name}/{s3_key}")
-                uploaded_count += 1
+        uploaded = upload_files(s3, csv_files, bucket_name, "raw-data/")
+        uploaded_count = len(uploaded)
 
-            except Exception as upload_error:
-                print(f"ERROR: Failed to upload {csv_file.name}: {upload_error}")
+        # Sizes and checksums of what was uploaded, for verify_upload
+        save_upload_manifest(bucket_name, uploaded)
 
         
         if uploaded_count == len(csv_files):
@@ -106,16 +115,16 @@ def verify_upload():
     region = os.getenv('AWS_DEFAULT_REGION', 'us-east-1')
 
     try:
-        # Create S3 client
-        s3 = boto3.client('s3', region_name=region)
+        # Shared S3 client with a connection pool sized for the concurrent uploads
+        s3 = s3_client(region)
 
-        response = s3.list_objects_v2(Bucket = bucket_name, Prefix = "raw-data/")
+        # Paginated listing, with sub-prefixes listed in parallel
+        files = list(list_objects(s3, bucket_name, "raw-data/").values())
 
-        if "Contents" not in response:
+        if not files:
             print("ERROR: No files found in bucket")
             return False
 
-        files = response["Contents"]
         print(f"Found {len(files)} files in S3:")
 
         total_size_mb = 0
@@ -126,6 +135,17 @@ def verify_upload():
             print(f" {file["Key"]} ({size_mb:.2f} MB)")
 
         print(f"Total data size: {total_size_mb: .2f} MB")
+
+        # Compare sizes and checksums with what was uploaded, without downloading anything
+        manifest = {key: entry for key, entry in load_upload_manifest(bucket_name).items()
+                    if key.startswith("raw-data/")}
+
+        if not manifest:
+            print("No upload manifest found, skipping checksum verification")
+        elif verify_objects(s3, bucket_name, manifest, "raw-data/"):
+            print("ERROR: Some uploaded files are missing or corrupted")
+            return False
+
         print("Upload verification complete!")
         return True
     
@@ -4,15 +4,40 @@ Download data from S3, clean it, transform it, and upload results back to S3.
 """
 
 import os
-import boto3
-import pandas as pd
+import sys
+import asyncio
 from pathlib import Path
-from dotenv import load_dotenv
 from datetime import datetime
-import tempfile
+from dotenv import load_dotenv
 
-def process_ecommerce_data():
-    """Download, process, and upload e-commerce data"""
+# Make the shared helpers in src/ importable when this file is run directly
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from pipeline_utils.aggregates import (CUSTOMER_AGGREGATES, MONTHLY_AGGREGATES, PRODUCT_AGGREGATES,
+                                       customer_lifetime_value, fold_order_aggregates, partial_aggregate)
+from pipeline_utils.artifacts import load_dataset
+from pipeline_utils.checkpoints import (checkpoints_enabled, complete_stage, delete_checkpoints, last_completed_stage,
+                                        load_checkpoint, load_run_state, requested_resume, save_checkpoint,
+                                        split_aggregates, stage_completed, start_run, with_aggregates)
+from pipeline_utils.chunked import (CHUNKED_DATASETS, chunked_mode, clean_in_chunks, is_chunked_output,
+                                    make_chunk_dir, remove_chunk_dir, upload_chunked_output)
+from pipeline_utils.cleaning import CLEANERS
+from pipeline_utils.clients import s3_client
+from pipeline_utils.compaction import compact_dataset, persisted_frame
+from pipeline_utils.formats import processed_format
+from pipeline_utils.manifest import (OUTPUT_INPUTS, full_refresh_requested, load_manifest, missing_datasets,
+                                     plan_incremental_run, save_manifest, snapshot_raw_objects)
+from pipeline_utils.partitioning import partition_dates, upload_partitioned
+from pipeline_utils.instrumentation import instrumented, reset_step_metrics, step_metrics, write_step_metrics
+from pipeline_utils.profiling import profile_reports, profiled, reset_profiles
+from pipeline_utils.s3_io import RAW_DATA_FILES, download_datasets, download_worker_count, upload_dataframe
+
+# Items waiting between stages, and workers per cleaning and upload stage
+STAGE_QUEUE_SIZE = int(os.getenv('PIPELINE_STAGE_QUEUE_SIZE', 2))
+STAGE_WORKERS = int(os.getenv('PIPELINE_STAGE_WORKERS', 2))
+
+def process_ecommerce_data(resume_run_id=None):
+    """Download, process, and upload e-commerce data, or resume a failed run from its checkpoints"""
     
     print("Starting data processing...")
     
@@ -26,197 +51,306 @@ def process_ecommerce_data():
         return False
     
     print(f"Processing data from bucket: {bucket_name}")
+
+    # Measurements of this run's steps go to reports/<run id>.json, profiles to reports/profiles/<run id>/
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    reset_step_metrics()
+    reset_profiles(run_id)
+
+    # Cleaned chunks go to a directory of this run's own, removed when it ends
+    chunk_dir = make_chunk_dir(run_id)
+
+    # Stages write checkpoints under the run id; a resumed run keeps the id of the run it resumes
+    checkpoint_id = requested_resume(resume_run_id)
+    resume_stage = None
     
     try:
-        # Create S3 client
-        s3 = boto3.client('s3',region_name=region)
-        
-        # Step 1: Download data from S3
-        print("\nStep 1: Downloading data from S3...")
-        datasets = download_data_from_s3(s3, bucket_name)
-        
-        # Step 2: Clean and transform data
-        print("\nStep 2: Cleaning and transforming data...")
-        processed_datasets = transform_data(datasets)
-        
-        # Step 3: Create business metrics
-        print("\nStep 3: Creating business metrics...")
-        business_metrics = create_business_metrics(processed_datasets)
-        
-        # Step 4: Upload processed data back to S3
-        print("\nStep 4: Uploading processed data to S3...")
-        upload_success = upload_processed_data(s3, bucket_name, processed_datasets, business_metrics)
+        # Shared S3 client with a pooled, keepalive connection set for the parallel I/O
+        s3 = s3_client(region)
+
+        if checkpoint_id:
+            # Rebuild what the failed run planned, from the raw objects it saw
+            state = load_run_state(checkpoint_id)
+            plan, snapshot = state['plan'], state['snapshot']
+            resume_stage = last_completed_stage(state)
+            print(f"\nResuming run {checkpoint_id} after its {resume_stage or 'first'} stage, "
+                  f"rebuilding: {sorted(plan['outputs'])}")
+        else:
+            # Only rebuild outputs whose raw inputs changed since the last successful run
+            print("\nChecking raw data for changes...")
+            snapshot = snapshot_raw_objects(s3, bucket_name)
+            plan = plan_incremental_run(load_manifest(s3, bucket_name), snapshot)
+
+            if not plan['outputs']:
+                print("\nSUCCESS: No raw data changed since the last run, nothing to rebuild")
+                return True
+
+            print(f"Changed inputs: {plan['changed']}, rebuilding: {sorted(plan['outputs'])}")
+            checkpoint_id = run_id
+            start_run(checkpoint_id, plan, snapshot)
+
+        if staged_mode() and resume_stage is None:
+            # Download, clean, build metrics and upload as overlapping stages
+            print("\nRunning download, cleaning, metrics and upload as overlapping stages...")
+            upload_success = asyncio.run(run_staged_pipeline(s3, bucket_name, plan, checkpoint_id))
+        else:
+            upload_success = run_pipeline_steps(s3, bucket_name, plan, checkpoint_id, chunk_dir, resume_stage)
         
         if upload_success:
+            save_manifest(s3, bucket_name, snapshot)
+            delete_checkpoints(checkpoint_id)
             print("\nSUCCESS: Data processing pipeline completed!")
             return True
         else:
             print("\nERROR: Failed to upload processed data")
+            if checkpoints_enabled():
+                print(f"Resume from the last completed stage with PIPELINE_RESUME_RUN_ID={checkpoint_id}")
             return False
             
     except Exception as e:
         print(f"ERROR: Data processing failed: {e}")
+        if checkpoint_id and checkpoints_enabled():
+            print(f"Resume from the last completed stage with PIPELINE_RESUME_RUN_ID={checkpoint_id}")
         return False
 
-def download_data_from_s3(s3,bucket_name):
-
-    datasets ={}
+    finally:
+        remove_chunk_dir(chunk_dir)
 
-    data_files = ['customers.csv','products.csv','orders.csv','order_items.csv','reviews.csv']
+        records = step_metrics()
+        if records:
+            print(f"Step metrics written to {write_step_metrics(run_id, records)}")
+        for report in profile_reports():
+            print(f"Profile of {report['call']} written to {report['flame_graph']}")
 
-    for file_name in data_files:
-        try:
-            print(f'Downloading {file_name}...')
-
-            s3_key = f"raw-data/{file_name}"
-            local_path = os.path.join(tempfile.gettempdir(),file_name)
+def run_pipeline_steps(s3,bucket_name,plan,run_id,chunk_dir,resume_stage=None):
+    """Run the four steps one after another, skipping those a resumed run already completed"""
 
-            s3.download_file(bucket_name,s3_key,local_path)
+    # Step 1: Download data from S3
+    if not stage_completed('download', resume_stage):
+        print("\nStep 1: Downloading data from S3...")
+        # In chunked mode orders and order_items are streamed in Step 2 instead
+        data_files = [f"{name}.csv" for name in plan['inputs']
+                      if not (chunked_mode() and name in CHUNKED_DATASETS)]
+        datasets = download_data_from_s3(s3, bucket_name, data_files)
+
+        # Every planned output needs its inputs, so a missing one fails the run before anything is built
+        missing = missing_datasets([name.replace(".csv", "") for name in data_files], datasets)
+        if missing:
+            print(f"ERROR: Could not download {missing}")
+            return False
 
-            df = pd.read_csv(local_path)
-            dataset_name = file_name.replace(".csv","")
+        save_checkpoint(run_id, 'download', datasets)
+    elif not stage_completed('clean', resume_stage):
+        print("\nStep 1: Loading the downloaded data from the checkpoint...")
+        datasets = load_checkpointed_datasets(run_id, 'download', chunk_dir)
+    
+    # Step 2: Clean and transform data
+    if not stage_completed('clean', resume_stage):
+        print("\nStep 2: Cleaning and transforming data...")
+        processed_datasets = transform_data(datasets)
 
-            datasets[dataset_name] = df
+        order_aggregates = None
+        if chunked_mode():
+            # Clean the large datasets chunk by chunk, folding their aggregates as they stream
+            chunked_outputs, order_aggregates = clean_in_chunks(s3, bucket_name, plan['inputs'], plan['outputs'],
+                                                                chunk_dir, full_refresh_requested())
+            processed_datasets.update(chunked_outputs)
 
-            print(f'Loaded {dataset_name}: {len(df)} records')
+        save_checkpoint(run_id, 'clean', with_aggregates(processed_datasets, order_aggregates))
+    else:
+        print("\nStep 2: Loading the cleaned data from the checkpoint...")
+        processed_datasets, order_aggregates = split_aggregates(load_checkpointed_datasets(run_id, 'clean', chunk_dir))
+    
+    # Step 3: Create business metrics
+    if not stage_completed('metrics', resume_stage):
+        print("\nStep 3: Creating business metrics...")
+        if order_aggregates is None and 'orders_clean' in processed_datasets and {'customer_metrics', 'monthly_sales'} & plan['outputs']:
+            # Fold only the new orders into the stored customer and monthly partials
+            order_aggregates = fold_order_aggregates(s3, bucket_name, processed_datasets['orders_clean'], full_refresh_requested())
 
-            os.remove(local_path)
-        
-        except Exception as e:
-            print(f"Failed to download {file_name}: {e}")
+        business_metrics = create_business_metrics(processed_datasets, plan['outputs'], order_aggregates)
+        save_checkpoint(run_id, 'metrics', business_metrics)
+    else:
+        print("\nStep 3: Loading the business metrics from the checkpoint...")
+        business_metrics = load_checkpointed_datasets(run_id, 'metrics', chunk_dir)
+    
+    # Step 4: Upload processed data back to S3
+    print("\nStep 4: Uploading processed data to S3...")
+    upload_success = upload_processed_data(s3, bucket_name, processed_datasets, business_metrics, plan['outputs'])
+
+    return upload_success
+
+
+def load_checkpointed_datasets(run_id,stage,chunk_dir):
+    """Load a stage's checkpoint; directories of cleaned chunks stay on disk as in chunked runs"""
+
+    return {name: handle if is_chunked_output(handle) else load_dataset(handle)
+            for name, handle in load_checkpoint(run_id, stage, chunk_dir).items()}
+
+
+def staged_mode():
+    """PIPELINE_STAGED=false runs the four steps one after another (chunked mode always does)"""
+
+    return os.getenv('PIPELINE_STAGED', 'true').lower() not in ('0', 'false', 'no') and not chunked_mode()
+
+
+async def run_staged_pipeline(s3,bucket_name,plan,run_id):
+    """Download, clean, build metrics and upload at the same time, linked by bounded queues
+
+    A dataset is cleaned as soon as it is downloaded, a metric is built as soon as
+    the datasets it needs are clean, and every output is uploaded as soon as it
+    exists, so the run takes about as long as its slowest path. Every dataset is
+    checkpointed as it comes out of its stage.
+    """
+
+    parsed = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+    uploads = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+
+    cleaned = {}
+    uploaded_outputs = set()
+    ready = {f"{name}_clean": asyncio.Event() for name in plan['inputs'] if name in CLEANERS}
+    download_slots = asyncio.Semaphore(download_worker_count(len(plan['inputs'])))
+
+    async def download(dataset_name):
+        async with download_slots:
+            datasets = await asyncio.to_thread(download_data_from_s3, s3, bucket_name, [f"{dataset_name}.csv"])
+        if dataset_name not in datasets:
+            raise RuntimeError(f"Could not download {dataset_name}.csv")
+        await asyncio.to_thread(save_checkpoint, run_id, 'download', datasets, False)
+        await parsed.put((dataset_name, datasets[dataset_name]))
+
+    async def clean():
+        while (item := await parsed.get()) is not None:
+            dataset_name, df = item
+            processed = await asyncio.to_thread(transform_data, {dataset_name: df})
+            await asyncio.to_thread(save_checkpoint, run_id, 'clean', processed, False)
+            cleaned.update(processed)
+            ready[f"{dataset_name}_clean"].set()
+
+    async def datasets_ready(names):
+        names = [name for name in names if name in ready]
+        await asyncio.gather(*(ready[name].wait() for name in names))
+        return {name: cleaned[name] for name in names}
+
+    async def queue_cleaned_upload(dataset_name):
+        # order_items partitions take their date from orders_clean
+        await datasets_ready([dataset_name, 'orders_clean'] if dataset_name == 'order_items_clean' else [dataset_name])
+        await uploads.put((dataset_name, None))
+
+    async def fold_orders():
+        orders = await datasets_ready(['orders_clean'])
+        return await asyncio.to_thread(fold_order_aggregates, s3, bucket_name, orders['orders_clean'],
+                                       full_refresh_requested())
+
+    async def build_metric(metric_name, order_aggregates):
+        inputs = await datasets_ready([f"{name}_clean" for name in OUTPUT_INPUTS[metric_name]])
+        if order_aggregates is not None:
+            order_aggregates = await order_aggregates
+        metrics = await asyncio.to_thread(create_business_metrics, inputs, {metric_name}, order_aggregates)
+        await asyncio.to_thread(save_checkpoint, run_id, 'metrics', metrics, False)
+        for name, df in metrics.items():
+            await uploads.put((name, df))
+
+    async def upload():
+        success = True
+        while (item := await uploads.get()) is not None:
+            name, metric = item
+            if metric is None:
+                # A copy, since the cleaning workers keep adding to cleaned meanwhile
+                uploaded = await asyncio.to_thread(upload_processed_data, s3, bucket_name, dict(cleaned), {}, {name})
+            else:
+                uploaded = await asyncio.to_thread(upload_processed_data, s3, bucket_name, {}, {name: metric}, {name})
+            if uploaded:
+                uploaded_outputs.add(name)
+            success = success and uploaded
+        return success
+
+    async with asyncio.TaskGroup() as group:
+        cleaners = [group.create_task(clean()) for _ in range(STAGE_WORKERS)]
+        uploaders = [group.create_task(upload()) for _ in range(STAGE_WORKERS)]
+
+        # The order aggregates are folded once and shared by the customer and monthly metrics
+        order_aggregates = None
+        if 'orders_clean' in ready and {'customer_metrics', 'monthly_sales'} & plan['outputs']:
+            order_aggregates = group.create_task(fold_orders())
+
+        producers = [group.create_task(queue_cleaned_upload(name)) for name in ready if name in plan['outputs']]
+        producers += [group.create_task(build_metric(name, order_aggregates if name != 'product_metrics' else None))
+                      for name in ['customer_metrics', 'product_metrics', 'monthly_sales'] if name in plan['outputs']]
+
+        await asyncio.gather(*(group.create_task(download(name)) for name in plan['inputs']))
+        await asyncio.to_thread(complete_stage, run_id, 'download')
+        for _ in cleaners:
+            await parsed.put(None)
+
+        await asyncio.gather(*cleaners)
+        await asyncio.to_thread(complete_stage, run_id, 'clean')
+
+        await asyncio.gather(*producers)
+        await asyncio.to_thread(complete_stage, run_id, 'metrics')
+        for _ in uploaders:
+            await uploads.put(None)
+
+    # A metric whose inputs never arrived is never queued, so check every planned output landed
+    missing = missing_datasets(plan['outputs'], uploaded_outputs)
+    if missing:
+        print(f"ERROR: Planned outputs were not uploaded: {missing}")
+
+    return all(uploader.result() for uploader in uploaders) and not missing
+
+
+@instrumented
+@profiled
+def download_data_from_s3(s3,bucket_name,data_files=RAW_DATA_FILES):
+
+    # Fetch and parse all raw files at the same time
+    datasets, _ = download_datasets(s3, bucket_name, data_files)
 
     return datasets
 
 
+@instrumented
+@profiled
 def transform_data(datasets):
 
     processed = {}
 
-    # Process customer data
-    if 'customers' in datasets:
-        customers = datasets['customers'].copy()
-
-        # Clean email addresses
-        customers['email'] = customers['email'].str.lower().str.strip()
-
-        # Convert dates
-        customers['date_of_birth'] = pd.to_datetime(customers['date_of_birth'])
-        customers['registration_date'] = pd.to_datetime(customers['registration_date'])
-
-        # Calculate age
-
-        customers['age'] = (datetime.now() - customers['date_of_birth']).dt.days // 365
-
-        # Create age groups
-
-        customers['age_group'] = pd.cut(customers['age'], bins = [0, 25, 35, 50, 65, 100],
-                                        labels = ['18-25','26-35','36-50','51-65','65+'])
-
-        processed['customers_clean'] = customers
-
-        print(f'Processed customers: {len(customers)} records')
-
-
-            # Process products data
-    if 'products' in datasets:
-        products = datasets['products'].copy()
-
-        # Clean product name
-        products['product_name'] = products['product_name'].str.strip()
-
-        # Convert price to numeric
-        products['price'] = pd.to_numeric(products['price'], errors = 'coerce')
+    # Clean each dataset with its own rules
+    for dataset_name, df in datasets.items():
+        if dataset_name in CLEANERS:
+            # Compact dtypes so metrics and merges run on smaller frames
+            cleaned = CLEANERS[dataset_name](df)
+            processed[f'{dataset_name}_clean'] = compact_dataset(f'{dataset_name}_clean', cleaned)
 
-        # Create age groups
-
-        products['price_category'] = pd.cut(products['price'], bins = [0, 50, 150, 500, float('inf')],
-                                        labels = ['Budget','Mid-range','Premium','Luxury'])
-
-        processed['products_clean'] = products
-
-        print(f'Processed products: {len(products)} records')
-
-            # Process orders data
-    if 'orders' in datasets:
-        orders = datasets['orders'].copy()
-
-        # Convert date
-        orders['order_date'] = pd.to_datetime(orders['order_date'])
-
-        # Convert total amount to numeric
-        orders['total_amount'] = pd.to_numeric(orders['total_amount'], errors = 'coerce')
-
-        # Extract month and year for seasonal analysis
-
-        orders['order_month'] = orders['order_date'].dt.month
-        orders['order_year'] = orders['order_date'].dt.year
-
-        processed['orders_clean'] = orders
-
-        print(f'Processed orders: {len(orders)} records')
-
-
-            # Process order items data
-    if 'order_items' in datasets:
-        order_items = datasets['order_items'].copy()
-
-        # Convert numeric columns
-        order_items['quantity'] = pd.to_numeric(order_items['quantity'], errors = 'coerce')
-        order_items['unit_price'] = pd.to_numeric(order_items['unit_price'], errors = 'coerce')
-
-        # Calculate total price per item
-
-        order_items['total_price'] = order_items['quantity']*order_items['unit_price']
-
-        processed['order_items_clean'] = order_items
-
-        print(f'Processed order_items: {len(order_items)} records')
-
-
-
-            # Process review data
-    if 'reviews' in datasets:
-        reviews = datasets['reviews'].copy()
-
-        # Convert date
-        reviews['review_date'] = pd.to_datetime(reviews['review_date'])
-
-        # Convert rating to numeric
-        reviews['rating'] = pd.to_numeric(reviews['rating'], errors = 'coerce')
-
-        # Create rating categories
-
-        reviews['rating_category'] = reviews['rating'].apply(
-            lambda x: 'Excellent' if x >=4.5 else
-                        'Good' if x>=3.5 else
-                        'Average' if x >=2.5 else 'Poor'
-        )
-
-        processed['reviews_clean'] = reviews
-
-        print(f'Processed reviews: {len(reviews)} records')
+            print(f'Processed {dataset_name}: {len(df)} records')
     
     return processed
 
-def create_business_metrics(processed_datasets):
+@instrumented
+@profiled
+def create_business_metrics(processed_datasets,outputs=None,order_aggregates=None):
 
     metrics = {}
 
-    # Customer metric
+    # Build every metric unless the incremental plan asks for a subset
+    if outputs is None:
+        outputs = OUTPUT_INPUTS.keys()
 
-    if 'customers_clean' in processed_datasets and 'orders_clean' in processed_datasets:
-        customers = processed_datasets['customers_clean']
+    # Without stored partials, aggregate the full order history in this run
+    if order_aggregates is None and 'orders_clean' in processed_datasets:
         orders = processed_datasets['orders_clean']
+        order_aggregates = {
+            'customer': partial_aggregate(orders, 'customer_id', CUSTOMER_AGGREGATES),
+            'monthly': partial_aggregate(orders, ['order_year', 'order_month'], MONTHLY_AGGREGATES),
+        }
 
-        # Customer lifetime value
-        customer_metrics = orders.groupby('customer_id').agg({
-            'total_amount':['sum','count','mean'],
-            'order_date':['min','max']
-        }).round(2)
+    # Customer metric
 
-        customer_metrics.columns = ['total_spent','order_count','ave_order_value','first_order','last_order']
+    if 'customer_metrics' in outputs and 'customers_clean' in processed_datasets and 'orders_clean' in processed_datasets:
+        customers = processed_datasets['customers_clean']
 
-        customer_metrics = customer_metrics.reset_index()
+        # Customer lifetime value, with the average derived from the partial aggregates
+        customer_metrics = customer_lifetime_value(order_aggregates['customer'])
 
         # Merge with customer data
 
@@ -228,19 +362,15 @@ def create_business_metrics(processed_datasets):
 
     # Product performance metrics
 
-    if 'products_clean' in processed_datasets and 'order_items_clean' in processed_datasets:
+    if 'product_metrics' in outputs and 'products_clean' in processed_datasets and 'order_items_clean' in processed_datasets:
         products = processed_datasets['products_clean']
-        order_items = processed_datasets['order_items_clean']
-        
-        # Product sales metrics
-        product_metrics = order_items.groupby('product_id').agg({
-            'quantity': 'sum',
-            'total_price': 'sum',
-            'order_id': 'count'
-        }).round(2)
         
-        product_metrics.columns = ['total_quantity_sold', 'total_revenue', 'number_of_orders']
-        product_metrics = product_metrics.reset_index()
+        # Product sales metrics, already folded chunk by chunk in chunked mode
+        product_partials = (order_aggregates or {}).get('product')
+        if product_partials is None:
+            product_partials = partial_aggregate(processed_datasets['order_items_clean'], 'product_id', PRODUCT_AGGREGATES)
+
+        product_metrics = product_partials.round(2)
         
         # Merge with product data
         product_metrics = product_metrics.merge(products[['product_id', 'product_name', 'category', 'price']], on='product_id')
@@ -250,64 +380,84 @@ def create_business_metrics(processed_datasets):
 
     # Monthly sales trends
 
-    if 'orders_clean' in processed_datasets:
-        orders = processed_datasets['orders_clean']
-        
-        monthly_sales = orders.groupby(['order_year', 'order_month']).agg({
-            'total_amount': 'sum',
-            'order_id': 'count'
-        }).round(2)
-        
-        monthly_sales.columns = ['total_revenue', 'order_count']
-        monthly_sales = monthly_sales.reset_index()
+    if 'monthly_sales' in outputs and 'orders_clean' in processed_datasets:
+        monthly_sales = order_aggregates['monthly'].round(2)
         
         metrics['monthly_sales'] = monthly_sales
         print(f"Created monthly sales trends: {len(monthly_sales)} months")
     
     return metrics
 
-def upload_processed_data(s3,bucket_name,processed,metrics):
+@instrumented
+@profiled
+def upload_processed_data(s3,bucket_name,processed,metrics,outputs=None):
+
+    # Skip outputs that the incremental plan did not rebuild
+    all_processed = processed
+    if outputs is not None:
+        processed = {name: df for name, df in processed.items() if name in outputs}
+        metrics = {name: df for name, df in metrics.items() if name in outputs}
+
+    # A planned output that was never built fails the upload, so the manifest is not saved
+    missing = missing_datasets(outputs or [], processed, metrics)
+    for name in missing:
+        print(f"Failed to upload {name}: it was not built")
 
     upload_count = 0
-    total_files = len(processed) + len(metrics)
+    total_files = len(processed) + len(metrics) + len(missing)
+
+    # Output format comes from file_formats.processed in aws_config.yaml
+    file_format = processed_format()
 
     # Upload processed datasets
     for dataset_name, df in processed.items():
         try:
-            # Save a temporary csv file
-            local_path = os.path.join(tempfile.gettempdir(), f"{dataset_name}.csv")
-            df.to_csv(local_path, index=False)
-
-            # Upload to S3
-            s3_key = f"processed/{dataset_name}.csv"
-            s3.upload_file(local_path,bucket_name,s3_key)
+            if is_chunked_output(df):
+                # Cleaned chunks on disk are uploaded a partition at a time
+                upload_chunked_output(s3, df, bucket_name, f"processed/{dataset_name}", file_format)
+                print(f"Uploaded {dataset_name}: {df.rows} records")
+                upload_count += 1
+                continue
+
+            # Written with the schema types, whatever dtypes compaction picked in memory
+            df = persisted_frame(dataset_name, df)
+
+            # Date-partitioned datasets only rewrite the partitions that changed
+            dates = partition_dates(dataset_name, df, all_processed)
+
+            if dates is not None:
+                prefix = f"processed/{dataset_name}"
+                upload_partitioned(s3, df, dates, bucket_name, prefix, file_format)
+            else:
+                # Serialize in memory and upload to S3, unless the stored object is identical
+                s3_key = f"processed/{dataset_name}.{file_format}"
+                if not upload_dataframe(s3, df, bucket_name, s3_key, file_format):
+                    print(f"Skipped {dataset_name}: unchanged since the last upload")
+                    upload_count += 1
+                    continue
 
             print(f"Uploaded {dataset_name}: {len(df)} records")
             upload_count += 1
 
-            # Clean up
-            os.remove(local_path)
-
         except Exception as e:
             print(f"Failed to upload {dataset_name}: {e}")
 
         # Upload business metrics
     for metric_name, df in metrics.items():
         try:
-            # Save a temporary csv file
-            local_path = os.path.join(tempfile.gettempdir(), f"{metric_name}.csv")
-            df.to_csv(local_path, index=False)
+            # Written with the metric's declared types, whatever dtypes it was built from
+            df = persisted_frame(metric_name, df)
 
-            # Upload to S3
-            s3_key = f"processed/metrics/{metric_name}.csv"
-            s3.upload_file(local_path,bucket_name,s3_key)
+            # Serialize in memory and upload to S3, unless the stored object is identical
+            s3_key = f"processed/metrics/{metric_name}.{file_format}"
+            if not upload_dataframe(s3, df, bucket_name, s3_key, file_format):
+                print(f"Skipped {metric_name}: unchanged since the last upload")
+                upload_count += 1
+                continue
 
             print(f"Uploaded {metric_name}: {len(df)} records")
             upload_count += 1
 
-            # Clean up
-            os.remove(local_path)
-
         except Exception as e:
             print(f"Failed to upload {metric_name}: {e}")
 
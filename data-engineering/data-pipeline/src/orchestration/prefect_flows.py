@@ -4,183 +4,150 @@ Download data from S3, clean it, transform it, and upload results back to S3.
 """
 
 import os
-import boto3
-import pandas as pd
 from pathlib import Path
 from dotenv import load_dotenv
-from datetime import datetime
-import tempfile
+import sys
 
-from prefect import flow, task, get_run_logger
-
-
-@task(name="download_data_from_s3",retries=2,retry_delay_seconds=30,cache_policy=None)
-def download_data_from_s3(s3,bucket_name):
-
-    logger = get_run_logger()
-    logger.info("Starting data download from s3")
+# Make the shared helpers in src/ importable when this file is run directly
+sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-    datasets ={}
-
-    data_files = ['customers.csv','products.csv','orders.csv','order_items.csv','reviews.csv']
-
-    for file_name in data_files:
+from prefect import flow, task, get_run_logger
+from prefect.artifacts import create_markdown_artifact, create_table_artifact
+from prefect.runtime import flow_run
+from prefect.task_runners import ThreadPoolTaskRunner
+
+from pipeline_utils.aggregates import (CUSTOMER_AGGREGATES, MONTHLY_AGGREGATES, PRODUCT_AGGREGATES,
+                                       customer_lifetime_value, fold_order_aggregates, partial_aggregate)
+from pipeline_utils.artifacts import load_datasets, resolve_dataset, save_dataset, save_datasets
+from pipeline_utils.cache import CACHE_DIR, CONTENT_CACHE, evict_lru, lease_cache, release_cache
+from pipeline_utils.checkpoints import (checkpoints_enabled, delete_checkpoints, last_completed_stage, load_checkpoint,
+                                        load_run_state, requested_resume, save_checkpoint, split_aggregates,
+                                        stage_completed, start_run, with_aggregates)
+from pipeline_utils.chunked import (CHUNKED_DATASETS, chunked_mode, clean_in_chunks, is_chunked_output,
+                                    make_chunk_dir, remove_chunk_dir, upload_chunked_output)
+from pipeline_utils.cleaning import CLEANERS
+from pipeline_utils.clients import s3_client
+from pipeline_utils.compaction import compact_dataset, persisted_frame
+from pipeline_utils.formats import processed_format
+from pipeline_utils.instrumentation import instrumented, reset_step_metrics, step_metrics, write_step_metrics
+from pipeline_utils.manifest import (OUTPUT_INPUTS, full_refresh_requested, load_manifest, missing_datasets,
+                                     plan_incremental_run, save_manifest, snapshot_raw_objects)
+from pipeline_utils.partitioning import partition_dates, upload_partitioned
+from pipeline_utils.profiling import profile_reports, profiled, reset_profiles
+from pipeline_utils.s3_io import RAW_DATA_FILES, download_datasets, upload_dataframe
+
+def build_task_runner():
+    """Task runner for the flow: PIPELINE_TASK_RUNNER=thread (default) or process"""
+
+    runner_type = os.getenv('PIPELINE_TASK_RUNNER', 'thread').lower()
+    max_workers = int(os.getenv('PIPELINE_MAX_WORKERS', 5))
+
+    if runner_type == 'process':
         try:
-            print(f'Downloading {file_name}...')
+            # Only available in newer Prefect 3.x releases
+            from prefect.task_runners import ProcessPoolTaskRunner
+            return ProcessPoolTaskRunner(max_workers=max_workers)
+        except ImportError:
+            print("ProcessPoolTaskRunner is not available in this Prefect version, using threads")
 
-            s3_key = f"raw-data/{file_name}"
-            local_path = os.path.join(tempfile.gettempdir(),file_name)
+    return ThreadPoolTaskRunner(max_workers=max_workers)
 
-            s3.download_file(bucket_name,s3_key,local_path)
 
-            df = pd.read_csv(local_path)
-            dataset_name = file_name.replace(".csv","")
-
-            datasets[dataset_name] = df
-
-            logger.info(f'Loaded {dataset_name}: {len(df)} records')
-
-            os.remove(local_path)
-        
-        except Exception as e:
-            logger.error(f"Failed to download {file_name}: {e}")
-
-    return datasets
-
-@task(name="transform_data",retries=1)
-def transform_data(datasets):
+@task(name="download_data_from_s3",retries=2,retry_delay_seconds=30,cache_policy=CONTENT_CACHE,result_storage=CACHE_DIR)
+@instrumented
+@profiled
+def download_data_from_s3(s3,bucket_name,data_files=RAW_DATA_FILES,raw_objects=None):
 
     logger = get_run_logger()
-    
-    processed = {}
-
-    # Process customer data
-    if 'customers' in datasets:
-        customers = datasets['customers'].copy()
-
-        # Clean email addresses
-        customers['email'] = customers['email'].str.lower().str.strip()
-
-        # Convert dates
-        customers['date_of_birth'] = pd.to_datetime(customers['date_of_birth'])
-        customers['registration_date'] = pd.to_datetime(customers['registration_date'])
-
-        # Calculate age
-
-        customers['age'] = (datetime.now() - customers['date_of_birth']).dt.days // 365
-
-        # Create age groups
-
-        customers['age_group'] = pd.cut(customers['age'], bins = [0, 25, 35, 50, 65, 100],
-                                        labels = ['18-25','26-35','36-50','51-65','65+'])
-
-        processed['customers_clean'] = customers
-        logger.info(f'Processed customers: {len(customers)} records')
-
-
-
-            # Process products data
-    if 'products' in datasets:
-        products = datasets['products'].copy()
-
-        # Clean product name
-        products['product_name'] = products['product_name'].str.strip()
-
-        # Convert price to numeric
-        products['price'] = pd.to_numeric(products['price'], errors = 'coerce')
-
-        # Create age groups
-
-        products['price_category'] = pd.cut(products['price'], bins = [0, 50, 150, 500, float('inf')],
-                                        labels = ['Budget','Mid-range','Premium','Luxury'])
-
-        processed['products_clean'] = products
-
-        logger.info(f'Processed products: {len(products)} records')
-
-            # Process orders data
-    if 'orders' in datasets:
-        orders = datasets['orders'].copy()
-
-        # Convert date
-        orders['order_date'] = pd.to_datetime(orders['order_date'])
-
-        # Convert total amount to numeric
-        orders['total_amount'] = pd.to_numeric(orders['total_amount'], errors = 'coerce')
-
-        # Extract month and year for seasonal analysis
-
-        orders['order_month'] = orders['order_date'].dt.month
-        orders['order_year'] = orders['order_date'].dt.year
-
-        processed['orders_clean'] = orders
-
-        logger.info(f'Processed orders: {len(orders)} records')
+    logger.info("Starting data download from s3")
 
+    # Fetch and parse all raw files at the same time
+    datasets, _ = download_datasets(s3, bucket_name, data_files, log=logger.info, log_error=logger.error)
 
-            # Process order items data
-    if 'order_items' in datasets:
-        order_items = datasets['order_items'].copy()
+    # Fail (and retry) rather than hand on, and cache, a download with planned inputs missing
+    missing = missing_datasets([file_name.replace(".csv", "") for file_name in data_files], datasets)
+    if missing:
+        raise RuntimeError(f"Could not download {missing}")
 
-        # Convert numeric columns
-        order_items['quantity'] = pd.to_numeric(order_items['quantity'], errors = 'coerce')
-        order_items['unit_price'] = pd.to_numeric(order_items['unit_price'], errors = 'coerce')
+    # Hand downstream tasks pointers to Parquet artifacts rather than the frames
+    return save_datasets(datasets)
 
-        # Calculate total price per item
+@task(name="clean_dataset",task_run_name="clean_{dataset_name}",retries=1,cache_policy=CONTENT_CACHE,result_storage=CACHE_DIR)
+@instrumented
+@profiled
+def clean_dataset(dataset_name,dataset):
 
-        order_items['total_price'] = order_items['quantity']*order_items['unit_price']
+    logger = get_run_logger()
 
-        processed['order_items_clean'] = order_items
+    # Each dataset is cleaned by its own task so they can run side by side
+    cleaned = CLEANERS[dataset_name](resolve_dataset(dataset))
+    logger.info(f'Processed {dataset_name}: {len(cleaned)} records')
 
-        logger.info(f'Processed order_items: {len(order_items)} records')
+    # Compact dtypes so metrics and merges run on smaller frames
+    cleaned = compact_dataset(f'{dataset_name}_clean', cleaned, log=logger.info)
 
+    return save_dataset(f'{dataset_name}_clean', cleaned)
 
+@task(name="clean_chunked_datasets",retries=1,cache_policy=None)
+@instrumented
+@profiled
+def clean_chunked_datasets(s3,bucket_name,inputs,outputs,chunk_dir):
 
-            # Process review data
-    if 'reviews' in datasets:
-        reviews = datasets['reviews'].copy()
+    logger = get_run_logger()
 
-        # Convert date
-        reviews['review_date'] = pd.to_datetime(reviews['review_date'])
+    # Orders and order items are streamed from S3 and never held in memory whole
+    cleaned, aggregates = clean_in_chunks(s3, bucket_name, inputs, outputs, chunk_dir,
+                                          full_refresh_requested(), log=logger.info)
 
-        # Convert rating to numeric
-        reviews['rating'] = pd.to_numeric(reviews['rating'], errors = 'coerce')
+    return cleaned, {name: save_dataset(f'{name}_aggregates', df) for name, df in aggregates.items()}
 
-        # Create rating categories
+@task(name="update_order_aggregates",retries=1,cache_policy=None)
+@instrumented
+@profiled
+def update_order_aggregates(s3,bucket_name,orders):
 
-        reviews['rating_category'] = reviews['rating'].apply(
-            lambda x: 'Excellent' if x >=4.5 else
-                        'Good' if x>=3.5 else
-                        'Average' if x >=2.5 else 'Poor'
-        )
+    logger = get_run_logger()
 
-        processed['reviews_clean'] = reviews
+    # Fold only orders created since the last run into the stored partials
+    order_aggregates = fold_order_aggregates(s3, bucket_name, resolve_dataset(orders),
+                                             full_refresh_requested(), log=logger.info)
 
-        logger.info(f'Processed reviews: {len(reviews)} records')
-    
-    return processed
+    return {name: save_dataset(f'{name}_aggregates', df) for name, df in order_aggregates.items()}
 
-@task(name="create_business_metrics",retries=1)
-def create_business_metrics(processed_datasets):
+@task(name="create_business_metrics",retries=1,cache_policy=CONTENT_CACHE,result_storage=CACHE_DIR)
+@instrumented
+@profiled
+def create_business_metrics(processed_datasets,outputs=None,order_aggregates=None):
 
     logger = get_run_logger()
     metrics = {}
 
-    # Customer metric
+    # Load only the datasets this metric was handed; chunked outputs stay on disk
+    # because their metrics come from the aggregates folded while they streamed
+    processed_datasets = {name: dataset if is_chunked_output(dataset) else resolve_dataset(dataset)
+                          for name, dataset in processed_datasets.items()}
+    if order_aggregates is not None:
+        order_aggregates = load_datasets(order_aggregates)
 
-    if 'customers_clean' in processed_datasets and 'orders_clean' in processed_datasets:
-        customers = processed_datasets['customers_clean']
+    # Build every metric unless the incremental plan asks for a subset
+    if outputs is None:
+        outputs = OUTPUT_INPUTS.keys()
+
+    # Without stored partials, aggregate the full order history in this run
+    if order_aggregates is None and 'orders_clean' in processed_datasets:
         orders = processed_datasets['orders_clean']
+        order_aggregates = {
+            'customer': partial_aggregate(orders, 'customer_id', CUSTOMER_AGGREGATES),
+            'monthly': partial_aggregate(orders, ['order_year', 'order_month'], MONTHLY_AGGREGATES),
+        }
 
-        # Customer lifetime value
-        customer_metrics = orders.groupby('customer_id').agg({
-            'total_amount':['sum','count','mean'],
-            'order_date':['min','max']
-        }).round(2)
+    # Customer metric
 
-        customer_metrics.columns = ['total_spent','order_count','ave_order_value','first_order','last_order']
+    if 'customer_metrics' in outputs and 'customers_clean' in processed_datasets and 'orders_clean' in processed_datasets:
+        customers = processed_datasets['customers_clean']
 
-        customer_metrics = customer_metrics.reset_index()
+        # Customer lifetime value, with the average derived from the partial aggregates
+        customer_metrics = customer_lifetime_value(order_aggregates['customer'])
 
         # Merge with customer data
 
@@ -192,19 +159,15 @@ def create_business_metrics(processed_datasets):
 
     # Product performance metrics
 
-    if 'products_clean' in processed_datasets and 'order_items_clean' in processed_datasets:
+    if 'product_metrics' in outputs and 'products_clean' in processed_datasets and 'order_items_clean' in processed_datasets:
         products = processed_datasets['products_clean']
-        order_items = processed_datasets['order_items_clean']
         
-        # Product sales metrics
-        product_metrics = order_items.groupby('product_id').agg({
-            'quantity': 'sum',
-            'total_price': 'sum',
-            'order_id': 'count'
-        }).round(2)
-        
-        product_metrics.columns = ['total_quantity_sold', 'total_revenue', 'number_of_orders']
-        product_metrics = product_metrics.reset_index()
+        # Product sales metrics, already folded chunk by chunk in chunked mode
+        product_partials = (order_aggregates or {}).get('product')
+        if product_partials is None:
+            product_partials = partial_aggregate(processed_datasets['order_items_clean'], 'product_id', PRODUCT_AGGREGATES)
+
+        product_metrics = product_partials.round(2)
         
         # Merge with product data
         product_metrics = product_metrics.merge(products[['product_id', 'product_name', 'category', 'price']], on='product_id')
@@ -214,75 +177,132 @@ def create_business_metrics(processed_datasets):
 
     # Monthly sales trends
 
-    if 'orders_clean' in processed_datasets:
-        orders = processed_datasets['orders_clean']
-        
-        monthly_sales = orders.groupby(['order_year', 'order_month']).agg({
-            'total_amount': 'sum',
-            'order_id': 'count'
-        }).round(2)
-        
-        monthly_sales.columns = ['total_revenue', 'order_count']
-        monthly_sales = monthly_sales.reset_index()
+    if 'monthly_sales' in outputs and 'orders_clean' in processed_datasets:
+        monthly_sales = order_aggregates['monthly'].round(2)
         
         metrics['monthly_sales'] = monthly_sales
         logger.info(f"Created monthly sales trends: {len(monthly_sales)} months")
     
-    return metrics
+    return save_datasets(metrics)
 
 @task(name="upload_processed_data",retries=2,retry_delay_seconds=45,cache_policy=None)
-def upload_processed_data(s3,bucket_name,processed,metrics):
+@instrumented
+@profiled
+def upload_processed_data(s3,bucket_name,processed,metrics,outputs=None):
 
     logger = get_run_logger()
+
+    # Skip outputs that the incremental plan did not rebuild
+    all_processed = processed
+    if outputs is not None:
+        processed = {name: df for name, df in processed.items() if name in outputs}
+        metrics = {name: df for name, df in metrics.items() if name in outputs}
+
+    # A planned output that was never built fails the upload, so the manifest is not saved
+    missing = missing_datasets(outputs or [], processed, metrics)
+    for name in missing:
+        logger.error(f"Failed to upload {name}: it was not built")
+
     upload_count = 0
-    total_files = len(processed) + len(metrics)
+    total_files = len(processed) + len(metrics) + len(missing)
+
+    # Output format comes from file_formats.processed in aws_config.yaml
+    file_format = processed_format()
 
     # Upload processed datasets
     for dataset_name, df in processed.items():
         try:
-            # Save a temporary csv file
-            local_path = os.path.join(tempfile.gettempdir(), f"{dataset_name}.csv")
-            df.to_csv(local_path, index=False)
-
-            # Upload to S3
-            s3_key = f"processed/{dataset_name}.csv"
-            s3.upload_file(local_path,bucket_name,s3_key)
+            if is_chunked_output(df):
+                # Cleaned chunks on disk are uploaded a partition at a time
+                upload_chunked_output(s3, df, bucket_name, f"processed/{dataset_name}", file_format, log=logger.info)
+                logger.info(f"Uploaded {dataset_name}: {df.rows} records")
+                upload_count += 1
+                continue
+
+            # Load one dataset at a time to keep memory flat, written with the schema types
+            df = persisted_frame(dataset_name, resolve_dataset(df))
+
+            # Date-partitioned datasets only rewrite the partitions that changed
+            dates = partition_dates(dataset_name, df, all_processed)
+
+            if dates is not None:
+                prefix = f"processed/{dataset_name}"
+                upload_partitioned(s3, df, dates, bucket_name, prefix, file_format, log=logger.info)
+            else:
+                # Serialize in memory and upload to S3, unless the stored object is identical
+                s3_key = f"processed/{dataset_name}.{file_format}"
+                if not upload_dataframe(s3, df, bucket_name, s3_key, file_format):
+                    logger.info(f"Skipped {dataset_name}: unchanged since the last upload")
+                    upload_count += 1
+                    continue
 
             logger.info(f"Uploaded {dataset_name}: {len(df)} records")
             upload_count += 1
 
-            # Clean up
-            os.remove(local_path)
-
         except Exception as e:
             logger.error(f"Failed to upload {dataset_name}: {e}")
 
         # Upload business metrics
     for metric_name, df in metrics.items():
         try:
-            # Save a temporary csv file
-            local_path = os.path.join(tempfile.gettempdir(), f"{metric_name}.csv")
-            df.to_csv(local_path, index=False)
+            # Written with the metric's declared types, whatever dtypes it was built from
+            df = persisted_frame(metric_name, resolve_dataset(df))
 
-            # Upload to S3
-            s3_key = f"processed/metrics/{metric_name}.csv"
-            s3.upload_file(local_path,bucket_name,s3_key)
+            # Serialize in memory and upload to S3, unless the stored object is identical
+            s3_key = f"processed/metrics/{metric_name}.{file_format}"
+            if not upload_dataframe(s3, df, bucket_name, s3_key, file_format):
+                logger.info(f"Skipped {metric_name}: unchanged since the last upload")
+                upload_count += 1
+                continue
 
             logger.info(f"Uploaded {metric_name}: {len(df)} records")
             upload_count += 1
 
-            # Clean up
-            os.remove(local_path)
-
         except Exception as e:
             logger.error(f"Failed to upload {metric_name}: {e}")
 
     return upload_count == total_files
 
 
-@flow(name="ecommerce_etl_pipeline")
-def process_ecommerce_data():
-    """Download, process, and upload e-commerce data"""
+def submit_metric(metric_name,cleaned,order_aggregates=None):
+    """Submit one metric task that waits only for the cleaned datasets it is built from"""
+
+    inputs = {f"{name}_clean": cleaned[f"{name}_clean"] for name in OUTPUT_INPUTS[metric_name]
+              if f"{name}_clean" in cleaned}
+
+    return create_business_metrics.submit(inputs, {metric_name}, order_aggregates)
+
+
+def publish_step_metrics(logger):
+    """Publish this run's task measurements as a table artifact and a JSON file"""
+
+    records = step_metrics()
+    if not records:
+        return
+
+    path = write_step_metrics(flow_run.id, records)
+    create_table_artifact(table=records, key="pipeline-step-metrics",
+                          description=f"Wall time, CPU time, peak memory, rows and S3 bytes per task of {flow_run.name}")
+    logger.info(f"Step metrics written to {path}")
+
+
+def publish_profiles(logger):
+    """Publish the flame graph and top allocations of every task profiled in this run"""
+
+    for report in profile_reports():
+        create_markdown_artifact(
+            markdown=(f"# Profile of {report['call']}\n\n"
+                      f"{report['seconds']:.2f}s, peak traced memory {report['peak_traced_mb']:.1f} MB\n\n"
+                      f"Flame graph: `{report['flame_graph']}`\n\n"
+                      f"## Hottest functions\n\n```\n{report['functions']}\n```\n\n"
+                      f"## Top allocations\n\n```\n{report['allocations']}\n```\n"),
+            description=f"Profile of {report['call']} in {flow_run.name}")
+        logger.info(f"Profile of {report['call']} written to {report['flame_graph']}")
+
+
+@flow(name="ecommerce_etl_pipeline",task_runner=build_task_runner())
+def process_ecommerce_data(resume_run_id=None):
+    """Download, process, and upload e-commerce data, or resume a failed run from its checkpoints"""
     
     logger=get_run_logger()
     
@@ -298,38 +318,147 @@ def process_ecommerce_data():
         return False
     
     logger.info(f"Processing data from bucket: {bucket_name}")
+
+    # Each task records its own measurements; they are published when the run ends
+    reset_step_metrics()
+    reset_profiles(flow_run.id)
+
+    # Other runs do not evict cached artifacts while this one may still be handed them
+    cache_lease = lease_cache()
+
+    # Cleaned chunks go to a directory of this run's own, removed when it ends
+    chunk_dir = make_chunk_dir(flow_run.id)
+
+    # Stages write checkpoints under the run id; a resumed run keeps the id of the run it resumes
+    checkpoint_id = requested_resume(resume_run_id)
+    resume_stage = None
     
     try:
-        # Create S3 client
-        s3 = boto3.client('s3',region_name=region)
-        
+        # Shared S3 client with a pooled, keepalive connection set for the parallel tasks
+        s3 = s3_client(region)
+
+        if checkpoint_id:
+            # Rebuild what the failed run planned, from the raw objects it saw
+            state = load_run_state(checkpoint_id)
+            plan, snapshot = state['plan'], state['snapshot']
+            resume_stage = last_completed_stage(state)
+            logger.info(f"Resuming run {checkpoint_id} after its {resume_stage or 'first'} stage, "
+                        f"rebuilding: {sorted(plan['outputs'])}")
+        else:
+            # Only rebuild outputs whose raw inputs changed since the last successful run
+            logger.info("Checking raw data for changes...")
+            snapshot = snapshot_raw_objects(s3, bucket_name)
+            plan = plan_incremental_run(load_manifest(s3, bucket_name), snapshot)
+
+            if not plan['outputs']:
+                logger.info("SUCCESS: No raw data changed since the last run, nothing to rebuild")
+                return True
+
+            logger.info(f"Changed inputs: {plan['changed']}, rebuilding: {sorted(plan['outputs'])}")
+            checkpoint_id = str(flow_run.id)
+            start_run(checkpoint_id, plan, snapshot)
+
         # Step 1: Download data from S3
-        logger.info("Step 1: Downloading data from S3...")
-        datasets = download_data_from_s3(s3, bucket_name)
+        if not stage_completed('download', resume_stage):
+            logger.info("Step 1: Downloading data from S3...")
+            # The raw ETags make the download cacheable: unchanged objects are not fetched again
+            # In chunked mode orders and order_items are streamed in Step 2 instead
+            inputs = [name for name in plan['inputs'] if not (chunked_mode() and name in CHUNKED_DATASETS)]
+            data_files = [f"{name}.csv" for name in inputs]
+            raw_objects = {name: snapshot[name] for name in inputs}
+            datasets = download_data_from_s3(s3, bucket_name, data_files, raw_objects)
+            save_checkpoint(checkpoint_id, 'download', datasets)
+        elif not stage_completed('clean', resume_stage):
+            logger.info("Step 1: Loading the downloaded data from the checkpoint...")
+            datasets = load_checkpoint(checkpoint_id, 'download', chunk_dir)
         
         # Step 2: Clean and transform data
-        logger.info("Step 2: Cleaning and transforming data...")
-        processed_datasets = transform_data(datasets)
+        clean_pending = not stage_completed('clean', resume_stage)
+        if clean_pending:
+            logger.info("Step 2: Cleaning and transforming data...")
+            cleaned = {f"{name}_clean": clean_dataset.submit(name, df)
+                       for name, df in datasets.items() if name in CLEANERS}
+
+            chunked_outputs = {}
+            order_aggregates = None
+            if chunked_mode():
+                # Runs in the flow thread alongside the submitted cleaners (the S3 client is not picklable)
+                chunked_outputs, order_aggregates = clean_chunked_datasets(s3, bucket_name, plan['inputs'], plan['outputs'],
+                                                                            chunk_dir)
+            chunked_aggregates = order_aggregates
+        else:
+            logger.info("Step 2: Loading the cleaned data from the checkpoint...")
+            cleaned, order_aggregates = split_aggregates(load_checkpoint(checkpoint_id, 'clean', chunk_dir))
+            chunked_outputs = {}
         
         # Step 3: Create business metrics
-        logger.info("Step 3: Creating business metrics...")
-        business_metrics = create_business_metrics(processed_datasets)
+        metrics_pending = not stage_completed('metrics', resume_stage)
+        metric_futures = []
+        if metrics_pending:
+            logger.info("Step 3: Creating business metrics...")
+            metric_inputs = {**cleaned, **chunked_outputs}
+
+            # Product metrics do not need the order aggregates, so they start right away
+            if 'product_metrics' in plan['outputs']:
+                metric_futures.append(submit_metric('product_metrics', metric_inputs, order_aggregates))
+
+            if order_aggregates is None and 'orders_clean' in cleaned and {'customer_metrics', 'monthly_sales'} & plan['outputs']:
+                # Fold only the new orders into the stored customer and monthly partials
+                order_aggregates = update_order_aggregates(s3, bucket_name, cleaned['orders_clean'])
+
+            for metric_name in ['customer_metrics', 'monthly_sales']:
+                if metric_name in plan['outputs']:
+                    metric_futures.append(submit_metric(metric_name, metric_inputs, order_aggregates))
+
+        if clean_pending:
+            processed_datasets = {name: future.result() for name, future in cleaned.items()}
+            processed_datasets.update(chunked_outputs)
+            save_checkpoint(checkpoint_id, 'clean', with_aggregates(processed_datasets, chunked_aggregates))
+        else:
+            processed_datasets = cleaned
+
+        if metrics_pending:
+            business_metrics = {}
+            for future in metric_futures:
+                business_metrics.update(future.result())
+            save_checkpoint(checkpoint_id, 'metrics', business_metrics)
+        else:
+            logger.info("Step 3: Loading the business metrics from the checkpoint...")
+            business_metrics = load_checkpoint(checkpoint_id, 'metrics', chunk_dir)
         
         # Step 4: Upload processed data back to S3
         logger.info("Step 4: Uploading processed data to S3...")
-        upload_success = upload_processed_data(s3, bucket_name, processed_datasets, business_metrics)
+        upload_success = upload_processed_data(s3, bucket_name, processed_datasets, business_metrics, plan['outputs'])
         
         if upload_success:
+            save_manifest(s3, bucket_name, snapshot)
+            delete_checkpoints(checkpoint_id)
             logger.info("SUCCESS: Data processing pipeline completed!")
             return True
         else:
             logger.error("ERROR: Failed to upload processed data")
+            if checkpoints_enabled():
+                logger.error(f"Resume from the last completed stage with PIPELINE_RESUME_RUN_ID={checkpoint_id}")
             return False
             
     except Exception as e:
         logger.error(f"ERROR: Data processing failed: {e}")
+        if checkpoint_id and checkpoints_enabled():
+            logger.error(f"Resume from the last completed stage with PIPELINE_RESUME_RUN_ID={checkpoint_id}")
         return False
 
+    finally:
+        remove_chunk_dir(chunk_dir)
+
+        publish_step_metrics(logger)
+        publish_profiles(logger)
+
+        # Keep the local artifact cache within PIPELINE_CACHE_MAX_MB, sparing what this run used
+        release_cache(cache_lease)
+        evicted = evict_lru(used_since=cache_lease[1])
+        if evicted:
+            logger.info(f"Evicted {evicted} least recently used cached artifacts")
+
 
 if __name__ == "__main__":
 
@@ -0,0 +1,296 @@
+"""
+Mergeable partial aggregates for the business metrics.
+
+Metrics are kept as partial sums, counts, minimums and maximums, which can be
+combined across order batches. Averages are derived from them when the metric
+is read, so new orders only need to be folded into the stored state instead of
+regrouping the full order history.
+
+The stored state also records, per created_at day, how many orders it holds,
+their amount in cents and their summed order dates. Checking the orders up to
+the watermark against it costs a cheap numeric groupby rather than hashing
+every order; when a day no longer matches (an order was deleted, amended or
+backfilled), every order is folded again from scratch. An order moved to
+another customer with the same amount and date is not noticed: run with
+PIPELINE_FULL_REFRESH=true after such edits.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from pipeline_utils.formats import read_frame
+from pipeline_utils.s3_io import open_s3_object, upload_dataframe
+
+
+STATE_PREFIX = "processed/state"
+
+# Partials with more keys than this are spilled to disk in hash buckets
+AGG_MAX_KEYS = int(os.getenv('PIPELINE_AGG_MAX_KEYS', 1_000_000))
+SPILL_DIR = os.getenv('PIPELINE_SPILL_DIR', tempfile.gettempdir())
+SPILL_BUCKETS = 16
+
+# Output column -> (source column, partial aggregation)
+CUSTOMER_AGGREGATES = {
+    'total_spent': ('total_amount', 'sum'),
+    'order_count': ('total_amount', 'count'),
+    'first_order': ('order_date', 'min'),
+    'last_order': ('order_date', 'max'),
+}
+
+MONTHLY_AGGREGATES = {
+    'total_revenue': ('total_amount', 'sum'),
+    'order_count': ('order_id', 'count'),
+}
+
+PRODUCT_AGGREGATES = {
+    'total_quantity_sold': ('quantity', 'sum'),
+    'total_revenue': ('total_price', 'sum'),
+    'number_of_orders': ('order_id', 'count'),
+}
+
+# Columns of the per-day digest that tells whether the orders up to the watermark changed
+PARTITION_COLUMNS = ['order_count', 'amount_cents', 'order_days']
+
+# How two partial results of each aggregation combine
+MERGE_FUNCTIONS = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+
+def partial_aggregate(df, keys, spec):
+    """Aggregate one batch of rows into mergeable partials"""
+
+    # observed=True: categorical keys must not produce groups for values absent from the batch
+    return df.groupby(keys, observed=True).agg(**spec).reset_index()
+
+
+def merge_partials(partials, keys, spec):
+    """Combine partial aggregates from several batches into one"""
+
+    partials = [partial for partial in partials if partial is not None and len(partial)]
+    if not partials:
+        return pd.DataFrame(columns=[*keys, *spec])
+
+    merge_spec = {name: (name, MERGE_FUNCTIONS[func]) for name, (column, func) in spec.items()}
+    return pd.concat(partials, ignore_index=True).groupby(keys, observed=True).agg(**merge_spec).reset_index()
+
+
+class SpillingAggregator:
+    """Fold partial aggregates chunk by chunk, spilling to disk when there are too many keys"""
+
+    def __init__(self, keys, spec, max_keys=AGG_MAX_KEYS):
+        self.keys = [keys] if isinstance(keys, str) else list(keys)
+        self.spec = spec
+        self.max_keys = max_keys
+        self.partial = None
+        self.spill_dir = None
+        self.spill_count = 0
+
+    def add(self, partial):
+        """Merge one more partial into the running result"""
+
+        if self.partial is None:
+            self.partial = partial
+        else:
+            self.partial = merge_partials([self.partial, partial], self.keys, self.spec)
+
+        if len(self.partial) > self.max_keys:
+            self.spill()
+
+    def spill(self):
+        """Write the running result to disk, split into buckets by key hash"""
+
+        if self.partial is None or not len(self.partial):
+            return
+
+        if self.spill_dir is None:
+            self.spill_dir = Path(tempfile.mkdtemp(prefix="aggregate-spill-", dir=SPILL_DIR))
+
+        buckets = pd.util.hash_pandas_object(self.partial[self.keys], index=False) % SPILL_BUCKETS
+        for bucket, part in self.partial.groupby(buckets.values):
+            bucket_dir = self.spill_dir / f"bucket={bucket}"
+            bucket_dir.mkdir(exist_ok=True)
+            part.to_parquet(bucket_dir / f"spill-{self.spill_count:05d}.parquet", index=False)
+
+        self.partial = None
+        self.spill_count += 1
+
+    def result(self):
+        """Final merged partials; spilled buckets are merged one at a time"""
+
+        if self.spill_dir is None:
+            return merge_partials([self.partial], self.keys, self.spec) if self.partial is None else self.partial
+
+        self.spill()
+        try:
+            merged = [merge_partials([pd.read_parquet(path) for path in sorted(bucket_dir.glob("*.parquet"))],
+                                     self.keys, self.spec)
+                      for bucket_dir in sorted(self.spill_dir.iterdir())]
+            return pd.concat(merged, ignore_index=True)
+        finally:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+
+def customer_lifetime_value(customer_partials):
+    """Customer metrics from partials, deriving the average order value at read time"""
+
+    customer_metrics = customer_partials.copy()
+    customer_metrics.insert(
+        customer_metrics.columns.get_loc('order_count') + 1, 'ave_order_value',
+        customer_metrics['total_spent'] / customer_metrics['order_count'])
+
+    return customer_metrics.round(2)
+
+
+def partition_digest(orders):
+    """Per created_at day: the orders, their amount in cents and their summed order dates"""
+
+    # Integers only, so digests of chunks add up exactly however the orders were chunked or sorted
+    amount = pd.to_numeric(orders['total_amount']).astype(float).fillna(0)
+    order_days = pd.to_datetime(orders['order_date']).to_numpy().astype('datetime64[D]')
+    rows = pd.DataFrame({
+        'created_day': pd.to_datetime(orders['created_at']).dt.normalize().to_numpy(),
+        'order_count': 1,
+        'amount_cents': (amount * 100).round().astype('int64').to_numpy(),
+        'order_days': np.where(np.isnat(order_days), 0, order_days.astype('int64')),
+    })
+
+    return rows.groupby('created_day').sum()
+
+
+def combine_digests(first, second):
+    """Digest of two disjoint sets of orders"""
+
+    return first.add(second, fill_value=0).astype('int64')
+
+
+def empty_digest():
+    """Digest of no orders"""
+
+    return pd.DataFrame({column: pd.Series(dtype='int64') for column in PARTITION_COLUMNS},
+                        index=pd.DatetimeIndex([], name='created_day'))
+
+
+def digests_match(stored, found):
+    """Whether the stored digest still describes the orders found up to the watermark"""
+
+    if stored is None:
+        return False
+
+    found = found[found['order_count'] > 0].sort_index()
+    return found.index.equals(stored.index) and (found.to_numpy() == stored.to_numpy()).all()
+
+
+def load_aggregate_state(s3, bucket_name):
+    """Stored partials, the created_at watermark of the newest order folded into them and their digest"""
+
+    try:
+        body = s3.get_object(Bucket=bucket_name, Key=f"{STATE_PREFIX}/watermark.json")['Body']
+        watermark = json.loads(body.read())
+    except s3.exceptions.NoSuchKey:
+        return None
+
+    # State written before per-day digests were stored never matches, so it is folded again once
+    state = {'watermark': pd.Timestamp(watermark['created_at']), 'digest': None}
+    if 'partitions' in watermark:
+        digest = pd.DataFrame.from_dict(watermark['partitions'], orient='index', columns=PARTITION_COLUMNS)
+        digest.index = pd.to_datetime(digest.index).rename('created_day')
+        state['digest'] = digest.astype('int64').sort_index()
+
+    for name in ('customer', 'monthly'):
+        with open_s3_object(s3, bucket_name, f"{STATE_PREFIX}/{name}_aggregates.parquet") as stream:
+            state[name] = read_frame(stream, "parquet")
+
+    return state
+
+
+def save_aggregate_state(s3, bucket_name, state):
+    """Persist the partials before the watermark, so a crash never double counts orders"""
+
+    for name in ('customer', 'monthly'):
+        upload_dataframe(s3, state[name], bucket_name, f"{STATE_PREFIX}/{name}_aggregates.parquet", "parquet")
+
+    digest = state['digest'][state['digest']['order_count'] > 0].sort_index()
+    body = json.dumps({'created_at': state['watermark'].isoformat(),
+                       'order_count': int(digest['order_count'].sum()),
+                       'partitions': {day.strftime('%Y-%m-%d'): [int(value) for value in values]
+                                      for day, values in zip(digest.index, digest.to_numpy())}}).encode("utf-8")
+    s3.put_object(Bucket=bucket_name, Key=f"{STATE_PREFIX}/watermark.json", Body=body)
+
+
+def fold_orders(chunks, state=None):
+    """Fold the orders created after state's watermark (all of them without state) into its partials
+
+    Returns the partials, the digests of the orders at or before the watermark
+    and of those after it, and the newest created_at seen.
+    """
+
+    watermark = state['watermark'] if state else None
+
+    customer = SpillingAggregator('customer_id', CUSTOMER_AGGREGATES)
+    monthly = SpillingAggregator(['order_year', 'order_month'], MONTHLY_AGGREGATES)
+
+    if state is not None:
+        customer.add(state['customer'])
+        monthly.add(state['monthly'])
+
+    folded = new = empty_digest()
+    newest = watermark
+    for chunk in chunks:
+        created_at = pd.to_datetime(chunk['created_at'])
+
+        if len(chunk):
+            newest = created_at.max() if newest is None else max(newest, created_at.max())
+
+        # The watermark is inclusive: orders created at it were folded last time and are only checked
+        if watermark is not None:
+            folded = combine_digests(folded, partition_digest(chunk[created_at <= watermark]))
+            chunk = chunk[created_at > watermark]
+
+        if len(chunk):
+            # Digested as read, so the stored digest matches the raw orders on the next run
+            new = combine_digests(new, partition_digest(chunk))
+            # A replayed order is counted once
+            chunk = chunk.drop_duplicates('order_id', keep='last')
+            customer.add(partial_aggregate(chunk, 'customer_id', CUSTOMER_AGGREGATES))
+            monthly.add(partial_aggregate(chunk, ['order_year', 'order_month'], MONTHLY_AGGREGATES))
+
+    return {'customer': customer.result(), 'monthly': monthly.result()}, folded, new, newest
+
+
+def fold_order_aggregates(s3, bucket_name, orders, full_refresh=False, log=print, reread=None):
+    """Fold orders created since the last run into the stored customer and monthly partials
+
+    orders is either a cleaned DataFrame or an iterable of cleaned chunks. When
+    the stored partials no longer match the orders up to their watermark, every
+    order is folded again from reread(), which returns the chunks once more
+    (the DataFrame or list of chunks itself by default).
+    """
+
+    chunks = [orders] if isinstance(orders, pd.DataFrame) else orders
+    if reread is None and isinstance(chunks, list):
+        reread = lambda: chunks
+
+    state = None if full_refresh else load_aggregate_state(s3, bucket_name)
+    result, folded, new, newest = fold_orders(chunks, state)
+
+    if state is not None and not digests_match(state['digest'], folded):
+        stored = 0 if state['digest'] is None else state['digest']['order_count'].sum()
+        log(f"Stored aggregates hold {stored} orders up to {state['watermark']}, "
+            f"found {folded['order_count'].sum()} or changed ones: folding every order again")
+        if reread is None:
+            raise ValueError("Stored aggregates are out of date and the orders cannot be read again")
+
+        state = None
+        result, folded, new, newest = fold_orders(reread())
+
+    log(f"Folding {new['order_count'].sum()} new orders into stored aggregates")
+
+    if newest is not None and (len(new) or state is None):
+        save_aggregate_state(s3, bucket_name, {**result, 'watermark': newest, 'digest': combine_digests(folded, new)})
+
+    return result
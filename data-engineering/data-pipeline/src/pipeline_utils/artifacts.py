@@ -0,0 +1,120 @@
+"""
+Dataset handles passed between Prefect tasks instead of DataFrames.
+
+A task saves its output as a Parquet artifact in a local directory or an S3
+prefix (PIPELINE_ARTIFACT_URI) and returns a small DatasetHandle pointing at
+it. Downstream tasks load the artifact themselves, so large frames are never
+pickled through the orchestrator or its result storage.
+"""
+
+import os
+import pandas as pd
+from pathlib import Path
+from dataclasses import dataclass
+from botocore.exceptions import ClientError
+
+from pipeline_utils.clients import s3_client
+from pipeline_utils.formats import frame_fingerprint, write_parquet
+from pipeline_utils.s3_io import open_s3_object, upload_dataframe
+
+
+# Local directory (default, next to the Prefect storage) or s3://bucket/prefix
+ARTIFACT_URI = os.getenv('PIPELINE_ARTIFACT_URI', "prefect-storage/artifacts")
+
+
+@dataclass(frozen=True)
+class DatasetHandle:
+    """Pointer to a Parquet artifact holding one dataset"""
+
+    name: str
+    uri: str
+    rows: int
+    fingerprint: str
+
+
+def split_s3_uri(uri):
+    """s3://bucket/key -> (bucket, key)"""
+
+    bucket_name, _, key = uri[len("s3://"):].partition("/")
+    return bucket_name, key
+
+
+def save_dataset(name, df, base_uri=None):
+    """Store a DataFrame as a content-addressed Parquet artifact and return its handle"""
+
+    base_uri = (base_uri or ARTIFACT_URI).rstrip("/")
+    fingerprint = frame_fingerprint(df)
+    uri = f"{base_uri}/{name}/{fingerprint}.parquet"
+
+    if uri.startswith("s3://"):
+        bucket_name, key = split_s3_uri(uri)
+        upload_dataframe(s3_client(), df, bucket_name, key, "parquet")
+        return DatasetHandle(name, uri, len(df), fingerprint)
+
+    path = Path(uri)
+    if not path.exists():
+        # Same content is stored once; write to a temp name first so readers never see partial files
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "wb") as f:
+            write_parquet(df, f)
+        os.replace(temp_path, path)
+
+    return DatasetHandle(name, str(path), len(df), fingerprint)
+
+
+def artifact_exists(handle):
+    """Whether the artifact a handle points at is still stored"""
+
+    if handle.uri.startswith("s3://"):
+        bucket_name, key = split_s3_uri(handle.uri)
+        try:
+            s3_client().head_object(Bucket=bucket_name, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    return Path(handle.uri).exists()
+
+
+def touch_artifact(handle):
+    """Mark a local artifact as recently used for LRU eviction"""
+
+    if not handle.uri.startswith("s3://"):
+        Path(handle.uri).touch(exist_ok=True)
+
+
+def load_dataset(handle):
+    """Load the DataFrame a handle points at"""
+
+    if handle.uri.startswith("s3://"):
+        bucket_name, key = split_s3_uri(handle.uri)
+        with open_s3_object(s3_client(), bucket_name, key) as stream:
+            return pd.read_parquet(stream)
+
+    touch_artifact(handle)
+    if Path(handle.uri).is_dir():
+        # Directory of chunk files written in chunked mode
+        files = sorted(Path(handle.uri).rglob("*.parquet"))
+        return pd.concat([pd.read_parquet(path) for path in files], ignore_index=True)
+    return pd.read_parquet(handle.uri)
+
+
+def resolve_dataset(dataset):
+    """Accept either a DataFrame or a DatasetHandle and return the DataFrame"""
+
+    if isinstance(dataset, DatasetHandle):
+        return load_dataset(dataset)
+    return dataset
+
+
+def save_datasets(datasets, base_uri=None):
+    """Save every DataFrame in a dict and return a dict of handles"""
+
+    return {name: save_dataset(name, df, base_uri) for name, df in datasets.items()}
+
+
+def load_datasets(datasets):
+    """Resolve every handle in a dict to its DataFrame"""
+
+    return {name: resolve_dataset(dataset) for name, dataset in datasets.items()}
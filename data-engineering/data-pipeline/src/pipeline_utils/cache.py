@@ -0,0 +1,185 @@
+"""
+Content-addressed cache policy for the Prefect tasks.
+
+A task's cache key is built from the content of its inputs (dataset handle
+fingerprints, raw object ETags and plain parameters) plus a version of the
+pipeline code. Prefect stores the results under CACHE_DIR and, on a hit,
+returns the stored dataset handles without running the task, as long as the
+artifacts they point at still exist. Local artifacts are evicted
+least-recently-used once they exceed PIPELINE_CACHE_MAX_MB. Every run holds a shared lease on the cache, and
+nothing is evicted while another run holds one, so a task is never handed an
+artifact that is deleted before it reads it.
+"""
+
+import os
+import time
+import hashlib
+import inspect
+import logging
+import functools
+from pathlib import Path
+from dataclasses import dataclass
+from prefect import get_run_logger
+from prefect.cache_policies import CachePolicy
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks on Windows: eviction does not wait for other runs there
+    fcntl = None
+
+from pipeline_utils.artifacts import ARTIFACT_URI, DatasetHandle, artifact_exists, touch_artifact
+
+
+CACHE_DIR = Path(os.getenv('PIPELINE_CACHE_DIR', "prefect-storage/cache"))
+CACHE_MAX_BYTES = int(os.getenv('PIPELINE_CACHE_MAX_MB', 2048)) * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def run_logger():
+    """Prefect's run logger inside a task or flow, else this module's logger"""
+
+    try:
+        return get_run_logger()
+    except Exception:
+        return logger
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    """PIPELINE_CODE_VERSION, or a hash of the shared pipeline code"""
+
+    if os.getenv('PIPELINE_CODE_VERSION'):
+        return os.getenv('PIPELINE_CODE_VERSION')
+
+    digest = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob("*.py")):
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def content_token(value):
+    """Stable text for a task input; datasets are represented by their fingerprint"""
+
+    if isinstance(value, DatasetHandle):
+        return f"dataset:{value.name}:{value.fingerprint}"
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{key}={content_token(value[key])}" for key in sorted(value)) + "}"
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = sorted(value) if isinstance(value, (set, frozenset)) else value
+        return "[" + ",".join(content_token(item) for item in items) + "]"
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return repr(value)
+
+    # Clients and other live objects do not affect the result
+    return type(value).__name__
+
+
+def cache_key(fn, inputs):
+    """Key for one call: function source, pipeline code version and input content"""
+
+    digest = hashlib.sha256()
+    digest.update(inspect.getsource(fn).encode("utf-8"))
+    digest.update(code_version().encode("utf-8"))
+    digest.update(content_token(inputs).encode("utf-8"))
+    return f"{fn.__name__}-{digest.hexdigest()}"
+
+
+def result_handles(result):
+    """Dataset handles contained in a task result"""
+
+    if isinstance(result, DatasetHandle):
+        return [result]
+    if isinstance(result, dict):
+        return [handle for value in result.values() for handle in result_handles(value)]
+    return []
+
+
+@dataclass
+class ContentCachePolicy(CachePolicy):
+    """Reuse a task's stored result when its inputs and code are unchanged and its artifacts still exist"""
+
+    def compute_key(self, task_ctx, inputs, flow_parameters, **kwargs):
+        if os.getenv('PIPELINE_CACHE', 'true').lower() in ('0', 'false', 'no'):
+            return None
+
+        key = cache_key(task_ctx.task.fn, inputs)
+
+        store = task_ctx.result_store
+        if store.exists(key):
+            # Only a hit if every artifact is still there (it may have been evicted)
+            handles = result_handles(store.read(key).result)
+            if all(artifact_exists(handle) for handle in handles):
+                for handle in handles:
+                    touch_artifact(handle)
+                run_logger().info(f"Cache hit for {task_ctx.task.name}")
+            else:
+                # Drop the stale record so the task runs again and stores fresh artifacts
+                (CACHE_DIR / key).unlink(missing_ok=True)
+
+        return key
+
+
+# For tasks declared with result_storage=CACHE_DIR, where their records are looked up
+CONTENT_CACHE = ContentCachePolicy()
+
+
+def lease_cache():
+    """Take a shared lease on the local cache for a run; returns it, with the time the run started"""
+
+    lease = None
+    if fcntl is not None:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        lease = open(CACHE_DIR / ".lock", "a")
+        fcntl.flock(lease, fcntl.LOCK_SH)
+
+    return lease, time.time()
+
+
+def release_cache(lease):
+    """Give back a run's lease on the cache"""
+
+    lock, _ = lease
+    if lock is not None:
+        lock.close()
+
+
+def evict_lru(max_bytes=CACHE_MAX_BYTES, artifact_dir=ARTIFACT_URI, used_since=None):
+    """Delete the least recently used local artifacts until they fit in max_bytes
+
+    Nothing is evicted while another run holds a lease on the cache, and
+    artifacts used at or after used_since (when this run started) are kept.
+    """
+
+    if artifact_dir.startswith("s3://") or not Path(artifact_dir).exists():
+        return 0
+
+    lock = None
+    if fcntl is not None:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        lock = open(CACHE_DIR / ".lock", "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another run is still using the cache; the last one to finish evicts
+            lock.close()
+            return 0
+
+    try:
+        artifacts = [(path.stat().st_mtime, path.stat().st_size, path)
+                     for path in Path(artifact_dir).rglob("*.parquet")]
+        total_bytes = sum(size for _, size, _ in artifacts)
+
+        evicted = 0
+        for used_at, size, path in sorted(artifacts):
+            if total_bytes <= max_bytes or (used_since is not None and used_at >= used_since):
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+            evicted += 1
+
+        return evicted
+    finally:
+        if lock is not None:
+            lock.close()
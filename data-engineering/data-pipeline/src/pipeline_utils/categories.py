@@ -0,0 +1,36 @@
+"""
+Derived category columns, binned from numeric columns by the rules in the
+derived_categories section of config/data_schemas.yaml.
+"""
+
+import pandas as pd
+
+from pipeline_utils.config import load_config
+
+
+def category_rules(dataset_name):
+    """Derived column -> binning rule for one raw dataset"""
+
+    return load_config("data_schemas.yaml").get('derived_categories', {}).get(dataset_name, {})
+
+
+def bin_values(values, rule):
+    """Label every value with the range it falls in; nulls get the rule's missing_label"""
+
+    binned = pd.cut(values, bins=[float(edge) for edge in rule['bins']], labels=rule['labels'],
+                    right=rule.get('right', True))
+
+    if 'missing_label' in rule:
+        binned = binned.cat.add_categories([rule['missing_label']])
+        binned = binned.where(values.notna(), rule['missing_label'])
+
+    return binned
+
+
+def derive_categories(dataset_name, df):
+    """Add every derived category column configured for a dataset"""
+
+    for column, rule in category_rules(dataset_name).items():
+        df[column] = bin_values(df[rule['source']], rule)
+
+    return df
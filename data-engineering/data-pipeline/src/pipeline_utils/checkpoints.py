@@ -0,0 +1,275 @@
+"""
+Durable per-stage checkpoints, so a failed run can be resumed.
+
+Each stage of a run (download, clean, metrics) writes its datasets as Parquet
+under <checkpoint URI>/<run id>/<stage>/. They are recorded in
+<run id>/run.json together with the incremental plan and raw snapshot the run
+started from. A run resumed with PIPELINE_RESUME_RUN_ID=<run id> loads the
+output of the last completed stage and carries on from the next one, so a
+failed upload does not download and clean everything again. A run's
+checkpoints are deleted once it succeeds.
+
+Checkpoints go to s3://<AWS_S3_BUCKET_NAME>/checkpoints/ unless
+PIPELINE_CHECKPOINT_URI names another s3:// prefix or opts in to a local
+directory, so workers with small disks do not keep extra copies of every stage.
+Artifacts already in S3 are recorded where they are, and local artifacts are
+hard-linked into a local checkpoint rather than copied.
+"""
+
+import os
+import json
+import shutil
+import threading
+from pathlib import Path
+from dataclasses import asdict
+from boto3.s3.transfer import create_transfer_manager
+from botocore.exceptions import ClientError
+
+from pipeline_utils.artifacts import DatasetHandle, save_dataset, split_s3_uri
+from pipeline_utils.chunked import chunked_handle, is_chunked_output
+from pipeline_utils.clients import s3_client
+from pipeline_utils.transfers import transfer_config
+
+
+STAGES = ['download', 'clean', 'metrics']
+
+# Order aggregates are stored next to the cleaned datasets under this suffix
+AGGREGATES_SUFFIX = "_aggregates"
+
+_state_lock = threading.Lock()
+
+
+def checkpoints_enabled():
+    """PIPELINE_CHECKPOINTS=false stops runs from writing checkpoints"""
+
+    return os.getenv('PIPELINE_CHECKPOINTS', 'true').lower() not in ('0', 'false', 'no')
+
+
+def checkpoint_uri():
+    """PIPELINE_CHECKPOINT_URI (s3://bucket/prefix or a local directory), else checkpoints/ in the pipeline bucket"""
+
+    return os.getenv('PIPELINE_CHECKPOINT_URI') or f"s3://{os.getenv('AWS_S3_BUCKET_NAME')}/checkpoints"
+
+
+def requested_resume(run_id=None):
+    """Run id to resume: the one passed in, else PIPELINE_RESUME_RUN_ID"""
+
+    return run_id or os.getenv('PIPELINE_RESUME_RUN_ID') or None
+
+
+def run_uri(run_id):
+    """Where a run's checkpoints and run.json live"""
+
+    return f"{checkpoint_uri().rstrip('/')}/{run_id}"
+
+
+def read_text(uri):
+    """Read a small text file from a local path or an s3:// URI"""
+
+    if uri.startswith("s3://"):
+        bucket_name, key = split_s3_uri(uri)
+        return s3_client().get_object(Bucket=bucket_name, Key=key)['Body'].read().decode("utf-8")
+    return Path(uri).read_text()
+
+
+def write_text(uri, text):
+    """Write a small text file to a local path or an s3:// URI"""
+
+    if uri.startswith("s3://"):
+        bucket_name, key = split_s3_uri(uri)
+        s3_client().put_object(Bucket=bucket_name, Key=key, Body=text.encode("utf-8"))
+        return
+
+    # Write to a temp name first so a crash never leaves a truncated run.json
+    path = Path(uri)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    temp_path.write_text(text)
+    os.replace(temp_path, path)
+
+
+def load_run_state(run_id):
+    """The plan, raw snapshot and checkpointed stages of a run"""
+
+    try:
+        state = json.loads(read_text(f"{run_uri(run_id)}/run.json"))
+    except (FileNotFoundError, ClientError):
+        raise ValueError(f"No checkpoints found for run {run_id} under {checkpoint_uri()}")
+
+    state['plan']['outputs'] = set(state['plan']['outputs'])
+    return state
+
+
+def save_run_state(state):
+    """Write run.json; the planned outputs are stored as a sorted list"""
+
+    plan = {**state['plan'], 'outputs': sorted(state['plan']['outputs'])}
+    write_text(f"{run_uri(state['run_id'])}/run.json", json.dumps({**state, 'plan': plan}, indent=2))
+
+
+def start_run(run_id, plan, snapshot):
+    """Record what a new run is built from, before any of its stages runs"""
+
+    if not checkpoints_enabled():
+        return
+
+    with _state_lock:
+        save_run_state({'run_id': str(run_id), 'plan': plan, 'snapshot': snapshot, 'stages': {}})
+
+
+def link_or_copy(source, target):
+    """Hard-link a local file into a local checkpoint, copying only across filesystems"""
+
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def checkpoint_dataset(name, dataset, base_uri):
+    """Store a DataFrame, a Parquet artifact or a directory of chunks under base_uri; returns its handle"""
+
+    if is_chunked_output(dataset):
+        target = f"{base_uri}/{name}/{dataset.fingerprint}"
+        files = sorted(Path(dataset.uri).rglob("*.parquet"))
+
+        if target.startswith("s3://"):
+            # Through one transfer manager, so the chunk files upload S3_UPLOAD_WORKERS at a time
+            bucket_name, prefix = split_s3_uri(target)
+            with create_transfer_manager(s3_client(), transfer_config()) as manager:
+                uploads = [manager.upload(str(path), bucket_name,
+                                          f"{prefix}/{path.relative_to(dataset.uri).as_posix()}")
+                           for path in files]
+                for upload in uploads:
+                    upload.result()
+        else:
+            # Linked, so the chunks outlive the run's chunk directory without taking more disk
+            shutil.copytree(dataset.uri, target, dirs_exist_ok=True, copy_function=link_or_copy)
+
+        return DatasetHandle(name, target, dataset.rows, dataset.fingerprint)
+
+    if isinstance(dataset, DatasetHandle) and dataset.uri.startswith("s3://"):
+        # Content-addressed artifacts in S3 are durable already: record where they are
+        return dataset
+
+    if isinstance(dataset, DatasetHandle) and not base_uri.startswith("s3://"):
+        # Local artifact to a local checkpoint: link it, so evicting the artifact cache does not lose it
+        path = Path(base_uri) / name / f"{dataset.fingerprint}.parquet"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.unlink(missing_ok=True)
+        link_or_copy(dataset.uri, path)
+        return DatasetHandle(name, str(path), dataset.rows, dataset.fingerprint)
+
+    if isinstance(dataset, DatasetHandle):
+        # Local artifact to an S3 checkpoint: upload the file as it is
+        uri = f"{base_uri}/{name}/{dataset.fingerprint}.parquet"
+        bucket_name, key = split_s3_uri(uri)
+        s3_client().upload_file(dataset.uri, bucket_name, key)
+        return DatasetHandle(name, uri, dataset.rows, dataset.fingerprint)
+
+    return save_dataset(name, dataset, base_uri)
+
+
+def save_checkpoint(run_id, stage, datasets, completed=True):
+    """Write a stage's datasets; completed=False adds them without marking the stage done"""
+
+    if not checkpoints_enabled():
+        return
+
+    base_uri = f"{run_uri(run_id)}/{stage}"
+    handles = {name: asdict(checkpoint_dataset(name, dataset, base_uri)) for name, dataset in datasets.items()}
+
+    with _state_lock:
+        state = load_run_state(run_id)
+        checkpoint = state['stages'].setdefault(stage, {'completed': False, 'datasets': {}})
+        checkpoint['datasets'].update(handles)
+        checkpoint['completed'] = checkpoint['completed'] or completed
+        save_run_state(state)
+
+
+def complete_stage(run_id, stage):
+    """Mark a stage whose datasets were checkpointed one at a time as done"""
+
+    save_checkpoint(run_id, stage, {})
+
+
+def last_completed_stage(state):
+    """The latest stage a run finished, or None to start from the beginning"""
+
+    completed = [stage for stage in STAGES if state['stages'].get(stage, {}).get('completed')]
+    return completed[-1] if completed else None
+
+
+def stage_completed(stage, resume_stage):
+    """Whether a resumed run can skip stage, given the last stage it completed"""
+
+    return resume_stage is not None and STAGES.index(stage) <= STAGES.index(resume_stage)
+
+
+def load_checkpoint(run_id, stage, chunk_dir):
+    """Handles to the datasets a stage checkpointed; chunk directories in S3 are downloaded into chunk_dir"""
+
+    state = load_run_state(run_id)
+    handles = {}
+
+    for name, fields in state['stages'][stage]['datasets'].items():
+        handle = DatasetHandle(**fields)
+
+        # Parquet artifacts end in .parquet; anything else is a directory of chunks
+        if handle.uri.startswith("s3://") and not handle.uri.endswith(".parquet"):
+            # Chunk directories are read from local disk, as in the run that wrote them
+            bucket_name, prefix = split_s3_uri(handle.uri)
+            output_dir = Path(chunk_dir) / name
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+            paginator = s3_client().get_paginator('list_objects_v2')
+            with create_transfer_manager(s3_client(), transfer_config()) as manager:
+                downloads = []
+                for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}/"):
+                    for obj in page.get('Contents', []):
+                        path = output_dir / obj['Key'][len(prefix) + 1:]
+                        path.parent.mkdir(parents=True, exist_ok=True)
+                        downloads.append(manager.download(bucket_name, obj['Key'], str(path)))
+                for download in downloads:
+                    download.result()
+
+            handle = chunked_handle(name, output_dir, handle.rows)
+
+        handles[name] = handle
+
+    return handles
+
+
+def with_aggregates(datasets, aggregates):
+    """Cleaned datasets plus the order aggregates folded while cleaning, to checkpoint together"""
+
+    return {**datasets, **{f"{name}{AGGREGATES_SUFFIX}": df for name, df in (aggregates or {}).items()}}
+
+
+def split_aggregates(datasets):
+    """Undo with_aggregates: (cleaned datasets, order aggregates or None)"""
+
+    aggregates = {name[:-len(AGGREGATES_SUFFIX)]: dataset for name, dataset in datasets.items()
+                  if name.endswith(AGGREGATES_SUFFIX)}
+    cleaned = {name: dataset for name, dataset in datasets.items() if not name.endswith(AGGREGATES_SUFFIX)}
+
+    return cleaned, aggregates or None
+
+
+def delete_checkpoints(run_id):
+    """Remove a run's checkpoints once it has succeeded"""
+
+    if not checkpoints_enabled():
+        return
+
+    uri = run_uri(run_id)
+    if not uri.startswith("s3://"):
+        shutil.rmtree(uri, ignore_errors=True)
+        return
+
+    bucket_name, prefix = split_s3_uri(uri)
+    paginator = s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{prefix}/"):
+        keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            s3_client().delete_objects(Bucket=bucket_name, Delete={'Objects': keys})
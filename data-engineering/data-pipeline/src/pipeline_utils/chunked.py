@@ -0,0 +1,171 @@
+"""
+Out-of-core execution for the large order datasets.
+
+With PIPELINE_CHUNK_ROWS set, orders.csv and order_items.csv are streamed
+from S3 in chunks of that many rows and run through the regular cleaners one
+chunk at a time. Cleaned chunks go straight to local Parquet files, already
+split into date partitions, and the metric aggregates are folded chunk by
+chunk, so neither dataset is ever held in memory whole.
+
+Each run writes its chunks to a directory of its own under PIPELINE_CHUNK_DIR,
+removed when the run ends, so concurrent and resumed runs never overwrite each
+other's chunks.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import pandas as pd
+from pathlib import Path
+
+from pipeline_utils.aggregates import PRODUCT_AGGREGATES, SpillingAggregator, fold_order_aggregates, partial_aggregate
+from pipeline_utils.artifacts import DatasetHandle
+from pipeline_utils.cleaning import CLEANERS
+from pipeline_utils.compaction import persisted_frame
+from pipeline_utils.partitioning import partition_dates, split_partitions, upload_partitions
+from pipeline_utils.s3_io import open_s3_object, upload_dataframe
+from pipeline_utils.schemas import iter_csv_typed
+
+
+CHUNK_ROWS = int(os.getenv('PIPELINE_CHUNK_ROWS', 0))
+CHUNKED_DATASETS = ['orders', 'order_items']
+CHUNK_DIR = Path(os.getenv('PIPELINE_CHUNK_DIR', "prefect-storage/chunks"))
+
+
+def chunked_mode():
+    """Whether the order datasets are processed in chunks (PIPELINE_CHUNK_ROWS > 0)"""
+
+    return CHUNK_ROWS > 0
+
+
+def make_chunk_dir(run_id):
+    """A fresh directory under CHUNK_DIR for one run's cleaned chunks"""
+
+    CHUNK_DIR.mkdir(parents=True, exist_ok=True)
+    return Path(tempfile.mkdtemp(prefix=f"{run_id}-", dir=CHUNK_DIR))
+
+
+def remove_chunk_dir(chunk_dir):
+    """Delete a run's chunk directory once its chunks are uploaded or checkpointed"""
+
+    shutil.rmtree(chunk_dir, ignore_errors=True)
+
+
+def is_chunked_output(dataset):
+    """Whether a dataset is a directory of cleaned chunk files"""
+
+    return isinstance(dataset, DatasetHandle) and Path(dataset.uri).is_dir()
+
+
+def stream_cleaned_chunks(s3, bucket_name, dataset_name, output_dir, order_dates=None, chunk_rows=None, log=print):
+    """Yield cleaned chunks of a raw CSV, writing each one to disk as it goes"""
+
+    # Start from an empty directory so chunks of an earlier run never leak in
+    output_dir = Path(output_dir)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    output_dir.mkdir(parents=True)
+
+    processed = {} if order_dates is None else {'orders_clean': order_dates}
+    stream = open_s3_object(s3, bucket_name, f"raw-data/{dataset_name}.csv")
+
+    with stream:
+        for number, chunk in enumerate(iter_csv_typed(stream, dataset_name, chunk_rows or CHUNK_ROWS, log)):
+            cleaned = CLEANERS[dataset_name](chunk)
+            dates = partition_dates(f"{dataset_name}_clean", cleaned, processed)
+
+            if dates is None:
+                parts = [(".", cleaned)]
+            else:
+                parts = split_partitions(cleaned, dates)
+
+            for path, part in parts:
+                part_dir = output_dir / path
+                part_dir.mkdir(parents=True, exist_ok=True)
+                part.to_parquet(part_dir / f"part-{number:05d}.parquet", index=False)
+
+            yield cleaned
+
+
+def chunked_handle(name, output_dir, rows):
+    """Handle for a directory of chunk files, fingerprinted from the file contents"""
+
+    digest = hashlib.sha256()
+    for path in sorted(Path(output_dir).rglob("*.parquet")):
+        digest.update(str(path.relative_to(output_dir)).encode("utf-8"))
+        digest.update(path.read_bytes())
+
+    return DatasetHandle(name, str(output_dir), rows, digest.hexdigest())
+
+
+def clean_in_chunks(s3, bucket_name, inputs, outputs, chunk_dir, full_refresh=False, log=print):
+    """Clean orders and order_items chunk by chunk into chunk_dir and fold their aggregates on the way"""
+
+    handles = {}
+    aggregates = {}
+    order_dates = None
+
+    if 'orders' in inputs:
+        output_dir = Path(chunk_dir) / "orders_clean"
+        rows = 0
+
+        def orders_chunks():
+            nonlocal rows, order_dates
+            date_frames = []
+            for chunk in stream_cleaned_chunks(s3, bucket_name, 'orders', output_dir, log=log):
+                rows += len(chunk)
+                date_frames.append(chunk[['order_id', 'order_date']])
+                yield chunk
+            order_dates = pd.concat(date_frames, ignore_index=True) if date_frames else None
+
+        def cleaned_chunks():
+            # The cleaned chunks written by the stream, if the stored aggregates need a full refold
+            return (pd.read_parquet(path) for path in sorted(output_dir.rglob("*.parquet")))
+
+        if {'customer_metrics', 'monthly_sales'} & set(outputs):
+            aggregates.update(fold_order_aggregates(s3, bucket_name, orders_chunks(), full_refresh, log=log,
+                                                    reread=cleaned_chunks))
+        else:
+            for _ in orders_chunks():
+                pass
+
+        handles['orders_clean'] = chunked_handle('orders_clean', output_dir, rows)
+        log(f'Processed orders in chunks: {rows} records')
+
+    if 'order_items' in inputs:
+        output_dir = Path(chunk_dir) / "order_items_clean"
+        products = SpillingAggregator('product_id', PRODUCT_AGGREGATES)
+        rows = 0
+
+        for chunk in stream_cleaned_chunks(s3, bucket_name, 'order_items', output_dir, order_dates, log=log):
+            products.add(partial_aggregate(chunk, 'product_id', PRODUCT_AGGREGATES))
+            rows += len(chunk)
+
+        aggregates['product'] = products.result()
+        handles['order_items_clean'] = chunked_handle('order_items_clean', output_dir, rows)
+        log(f'Processed order_items in chunks: {rows} records')
+
+    return handles, aggregates
+
+
+def upload_chunked_output(s3, handle, bucket_name, prefix, file_format="csv", log=print):
+    """Upload a directory of cleaned chunks one partition (or one chunk) at a time"""
+
+    output_dir = Path(handle.uri)
+    part_dirs = sorted({path.parent for path in output_dir.rglob("*.parquet")})
+
+    if part_dirs == [output_dir]:
+        # Not partitioned: each chunk becomes one part file of the dataset
+        for path in sorted(output_dir.glob("*.parquet")):
+            upload_dataframe(s3, persisted_frame(handle.name, pd.read_parquet(path)), bucket_name,
+                             f"{prefix}/{path.stem}.{file_format}", file_format)
+        return
+
+    def partitions():
+        for part_dir in part_dirs:
+            files = sorted(part_dir.glob("*.parquet"))
+            # Same schema types as the partitions written from memory
+            yield (str(part_dir.relative_to(output_dir)).replace(os.sep, "/"),
+                   persisted_frame(handle.name, pd.concat([pd.read_parquet(path) for path in files], ignore_index=True)))
+
+    upload_partitions(s3, partitions(), bucket_name, prefix, file_format, log)
@@ -0,0 +1,111 @@
+"""
+Cleaning rules for each raw dataset, shared by the scripts and the Prefect flow.
+
+Every cleaner takes one raw DataFrame and returns its cleaned copy, so the
+datasets can be cleaned independently and in parallel.
+"""
+
+import pandas as pd
+from datetime import datetime
+
+from pipeline_utils.categories import derive_categories
+from pipeline_utils.dates import date_parts, parse_dates
+
+
+def clean_customers(customers):
+    """Normalize emails, parse dates and derive age and age group"""
+
+    customers = customers.copy()
+
+    # Clean email addresses
+    customers['email'] = customers['email'].str.lower().str.strip()
+
+    # Convert dates, parsing each distinct value once
+    customers['date_of_birth'] = parse_dates(customers['date_of_birth'])
+    customers['registration_date'] = parse_dates(customers['registration_date'])
+
+    # Calculate age
+    customers['age'] = (datetime.now() - customers['date_of_birth']).dt.days // 365
+
+    # Create age groups
+    customers = derive_categories('customers', customers)
+
+    return customers
+
+
+def clean_products(products):
+    """Trim product names, convert prices and derive the price category"""
+
+    products = products.copy()
+
+    # Clean product name
+    products['product_name'] = products['product_name'].str.strip()
+
+    # Convert price to numeric
+    products['price'] = pd.to_numeric(products['price'], errors='coerce')
+
+    # Create price categories
+    products = derive_categories('products', products)
+
+    return products
+
+
+def clean_orders(orders):
+    """Parse order dates and amounts and extract month and year"""
+
+    orders = orders.copy()
+
+    # Convert date, parsing each distinct value once
+    orders['order_date'] = parse_dates(orders['order_date'])
+
+    # Convert total amount to numeric
+    orders['total_amount'] = pd.to_numeric(orders['total_amount'], errors='coerce')
+
+    # Extract month and year for seasonal analysis, once per distinct day
+    order_year, order_month = date_parts(orders['order_date'])
+    orders['order_month'] = order_month
+    orders['order_year'] = order_year
+
+    return orders
+
+
+def clean_order_items(order_items):
+    """Convert quantities and prices and calculate the line total"""
+
+    order_items = order_items.copy()
+
+    # Convert numeric columns
+    order_items['quantity'] = pd.to_numeric(order_items['quantity'], errors='coerce')
+    order_items['unit_price'] = pd.to_numeric(order_items['unit_price'], errors='coerce')
+
+    # Calculate total price per item
+    order_items['total_price'] = order_items['quantity'] * order_items['unit_price']
+
+    return order_items
+
+
+def clean_reviews(reviews):
+    """Parse review dates and ratings and derive the rating category"""
+
+    reviews = reviews.copy()
+
+    # Convert date, parsing each distinct value once
+    reviews['review_date'] = parse_dates(reviews['review_date'])
+
+    # Convert rating to numeric
+    reviews['rating'] = pd.to_numeric(reviews['rating'], errors='coerce')
+
+    # Create rating categories; reviews without a rating are 'Unrated'
+    reviews = derive_categories('reviews', reviews)
+
+    return reviews
+
+
+# Raw dataset name -> cleaner; cleaned outputs are named "<dataset>_clean"
+CLEANERS = {
+    'customers': clean_customers,
+    'products': clean_products,
+    'orders': clean_orders,
+    'order_items': clean_order_items,
+    'reviews': clean_reviews,
+}
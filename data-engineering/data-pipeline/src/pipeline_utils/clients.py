@@ -0,0 +1,51 @@
+"""
+Shared, tuned boto3 S3 client.
+
+boto3 clients are thread-safe, so one client per region is created per process
+and reused by every thread and task. Its connection pool is sized for the
+parallel downloads, uploads and partition writes (S3_MAX_POOL_CONNECTIONS),
+retries use the standard or adaptive mode (S3_RETRY_MODE, S3_MAX_ATTEMPTS),
+and TCP keepalive keeps idle pooled connections from being dropped. Every
+client reports the bytes it moves to the step instrumentation.
+"""
+
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+from pipeline_utils.instrumentation import s3_bytes
+
+
+MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 64))
+RETRY_MODE = os.getenv('S3_RETRY_MODE', 'adaptive')
+MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', 10))
+TCP_KEEPALIVE = os.getenv('S3_TCP_KEEPALIVE', 'true').lower() not in ('0', 'false', 'no')
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def client_config():
+    """botocore settings for the shared client"""
+
+    return Config(max_pool_connections=MAX_POOL_CONNECTIONS,
+                  retries={'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS},
+                  tcp_keepalive=TCP_KEEPALIVE)
+
+
+def s3_client(region_name=None):
+    """The S3 client shared by this process for a region"""
+
+    region_name = region_name or os.getenv('AWS_DEFAULT_REGION', 'us-east-1')
+
+    # Keyed by process too: a forked worker must not reuse its parent's sockets
+    key = (os.getpid(), region_name)
+
+    with _clients_lock:
+        if key not in _clients:
+            # Sessions are not thread-safe, so each client gets its own
+            session = boto3.session.Session()
+            _clients[key] = session.client('s3', region_name=region_name, config=client_config())
+            s3_bytes.register(_clients[key])
+        return _clients[key]
@@ -0,0 +1,125 @@
+"""
+Memory-compact dtypes for cleaned datasets.
+
+Text columns with many repeated values become categoricals, the remaining
+text columns move to Arrow-backed strings, and integer columns are downcast to
+the smallest type that holds them. Float columns keep float64 so amounts and
+their sums are unchanged.
+
+Which dtypes compaction picks depends on each run's data, so compaction is
+only for processing in memory: cleaned datasets and business metrics are
+written with the types in config/data_schemas.yaml, so every run, partition and
+mode (in memory or chunked) writes the same schema.
+"""
+
+import os
+import pandas as pd
+
+from pipeline_utils.categories import category_rules
+from pipeline_utils.config import load_config
+from pipeline_utils.schemas import load_schema
+
+
+# Text columns with fewer distinct values than this share of rows become categoricals
+CATEGORY_MAX_RATIO = float(os.getenv('PIPELINE_CATEGORY_MAX_RATIO', 0.5))
+
+# Schema type -> dtype it is written from; nullable types, so an all-null partition is typed like the rest
+PERSISTED_DTYPES = {
+    'string': 'string',
+    'category': 'category',
+    'int32': 'Int32',
+    'int64': 'Int64',
+    'float64': 'float64',
+    'bool': 'boolean',
+}
+
+
+def compaction_enabled():
+    """PIPELINE_COMPACT=false keeps the dtypes the cleaners produced"""
+
+    return os.getenv('PIPELINE_COMPACT', 'true').lower() not in ('0', 'false', 'no')
+
+
+def compact_frame(df, category_max_ratio=CATEGORY_MAX_RATIO):
+    """Return a copy of df with categorical, Arrow string and downcast integer columns"""
+
+    compacted = {}
+
+    for name, values in df.items():
+        if values.dtype == object or isinstance(values.dtype, pd.StringDtype):
+            # Only convert columns that really hold text (not mixed Python objects)
+            if pd.api.types.infer_dtype(values, skipna=True) != 'string':
+                compacted[name] = values
+            elif values.nunique() < category_max_ratio * len(values):
+                compacted[name] = values.astype('category')
+            else:
+                compacted[name] = values.astype('string[pyarrow]')
+
+        elif pd.api.types.is_integer_dtype(values.dtype) and not pd.api.types.is_extension_array_dtype(values.dtype):
+            compacted[name] = pd.to_numeric(values, downcast='integer')
+
+        else:
+            compacted[name] = values
+
+    return pd.DataFrame(compacted, index=df.index)
+
+
+def compact_dataset(dataset_name, df, log=print):
+    """Compact one cleaned dataset and log how many bytes it saved"""
+
+    if not compaction_enabled():
+        return df
+
+    before = df.memory_usage(deep=True).sum()
+    compacted = compact_frame(df)
+    after = compacted.memory_usage(deep=True).sum()
+
+    log(f"Compacted {dataset_name}: {before / 1024 ** 2:.1f} MB -> {after / 1024 ** 2:.1f} MB "
+        f"({(before - after) / 1024 ** 2:.1f} MB saved)")
+
+    return compacted
+
+
+def persisted_types(dataset_name):
+    """Schema type of each column of an output: a metric's declared columns, or a cleaned dataset's
+    raw columns, derived categories and cleaner columns"""
+
+    schemas = load_config("data_schemas.yaml")
+    if dataset_name in schemas.get('metric_columns', {}):
+        return {name: spec['type'] for name, spec in schemas['metric_columns'][dataset_name].items()}
+
+    raw_name = dataset_name.removesuffix('_clean')
+    cleaned_columns = schemas.get('cleaned_columns', {}).get(raw_name, {})
+
+    types = {name: spec['type'] for name, spec in (load_schema(raw_name) or {}).get('columns', {}).items()}
+    types.update({name: 'category' for name in category_rules(raw_name)})
+    types.update({name: spec['type'] for name, spec in cleaned_columns.items()})
+    return types
+
+
+def persisted_frame(dataset_name, df):
+    """Give every column of a cleaned dataset or metric its schema type before writing, undoing compaction"""
+
+    types = persisted_types(dataset_name)
+    persisted = {}
+
+    for name, values in df.items():
+        kind = types.get(name)
+
+        if kind in PERSISTED_DTYPES:
+            try:
+                persisted[name] = values.astype(PERSISTED_DTYPES[kind])
+            except (TypeError, ValueError):
+                # Bad input coerced to fractional floats in an integer column stays float
+                persisted[name] = values
+
+        elif kind is None and isinstance(values.dtype, (pd.CategoricalDtype, pd.StringDtype)):
+            persisted[name] = values.astype('string')
+
+        elif kind is None and pd.api.types.is_integer_dtype(values.dtype):
+            persisted[name] = values.astype('int64')
+
+        else:
+            persisted[name] = values
+
+    return pd.DataFrame(persisted, index=df.index)
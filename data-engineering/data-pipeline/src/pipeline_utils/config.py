@@ -0,0 +1,20 @@
+"""
+Load the YAML files in data-pipeline/config/ so the pipeline can honor them.
+"""
+
+import os
+import yaml
+from pathlib import Path
+from functools import lru_cache
+
+
+# data-pipeline/config locally, /app/config inside the container
+CONFIG_DIR = Path(os.getenv('PIPELINE_CONFIG_DIR', Path(__file__).resolve().parents[2] / "config"))
+
+
+@lru_cache(maxsize=None)
+def load_config(file_name="aws_config.yaml"):
+    """Read a config file once and return it as a dict"""
+
+    with open(CONFIG_DIR / file_name) as f:
+        return yaml.safe_load(f) or {}
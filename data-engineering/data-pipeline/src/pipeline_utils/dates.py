@@ -0,0 +1,91 @@
+"""
+Memoized date parsing for columns with many repeated values.
+
+Order, review, registration and birth dates repeat heavily, so every distinct
+string is parsed only once and the result is broadcast back onto the rows.
+Parsed values are kept in a cache shared by all datasets and chunks, together
+with their year and month, so the order month/year extraction reuses them too.
+"""
+
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+
+# Distinct strings kept per date format before the cache is cleared
+DATE_CACHE_MAX = int(os.getenv('PIPELINE_DATE_CACHE_MAX', 1_000_000))
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def parse_unique(texts, date_format=None, errors='raise'):
+    """Parsed date, year and month for distinct strings, served from the shared cache"""
+
+    key = (date_format, errors)
+
+    with _cache_lock:
+        cached = _cache.get(key)
+
+    # Only strings never seen with this format are parsed
+    hits = texts.isin(cached.index) if cached is not None else np.zeros(len(texts), dtype=bool)
+    todo = texts[~hits]
+
+    dates = pd.DatetimeIndex(pd.to_datetime(todo, format=date_format, errors=errors))
+    parsed = pd.DataFrame({'date': dates, 'year': dates.year, 'month': dates.month}, index=todo)
+
+    known = parsed if cached is None else pd.concat([cached.reindex(texts[hits]), parsed])
+
+    if len(parsed):
+        with _cache_lock:
+            current = _cache.get(key)
+            if current is None or len(current) + len(parsed) > DATE_CACHE_MAX:
+                _cache[key] = parsed
+            else:
+                # Another thread may have parsed some of the same strings meanwhile
+                _cache[key] = pd.concat([current, parsed[~parsed.index.isin(current.index)]])
+
+    return known.reindex(texts)
+
+
+def broadcast(unique_values, codes):
+    """Map one value per distinct key back onto every row; code -1 marks a missing row"""
+
+    unique_values = pd.Index(unique_values)
+
+    if (codes < 0).any():
+        if not isinstance(unique_values, pd.DatetimeIndex):
+            unique_values = unique_values.astype('float64')
+        fill_value = pd.NaT if isinstance(unique_values, pd.DatetimeIndex) else np.nan
+        return unique_values.take(codes, allow_fill=True, fill_value=fill_value).to_numpy()
+
+    return unique_values.take(codes).to_numpy()
+
+
+def parse_dates(values, date_format=None, errors='raise'):
+    """pd.to_datetime that parses each distinct string once"""
+
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values
+
+    codes, texts = pd.factorize(values)
+    parsed = parse_unique(pd.Index(texts, dtype=object), date_format, errors)
+
+    return pd.Series(broadcast(pd.DatetimeIndex(parsed['date']), codes), index=values.index, name=values.name)
+
+
+def date_parts(values, date_format=None):
+    """Year and month of every row, computed once per distinct date"""
+
+    codes, uniques = pd.factorize(values)
+
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        uniques = pd.DatetimeIndex(uniques)
+        years, months = uniques.year, uniques.month
+    else:
+        parsed = parse_unique(pd.Index(uniques, dtype=object), date_format)
+        years, months = pd.Index(parsed['year']), pd.Index(parsed['month'])
+
+    return (pd.Series(broadcast(years, codes), index=values.index),
+            pd.Series(broadcast(months, codes), index=values.index))
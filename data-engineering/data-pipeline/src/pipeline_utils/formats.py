@@ -0,0 +1,113 @@
+"""
+File format writers for processed outputs (CSV and Parquet).
+"""
+
+import os
+import hashlib
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pipeline_utils.config import load_config
+
+
+ENCODE_CHUNK_ROWS = int(os.getenv('S3_ENCODE_CHUNK_ROWS', 100_000))
+
+
+def processed_format():
+    """Output format for processed data, taken from file_formats in aws_config.yaml"""
+
+    formats = load_config().get('file_formats', {}).get('processed', ['csv'])
+    return formats[0]
+
+
+def parquet_options():
+    """Parquet writer settings from the parquet section of aws_config.yaml"""
+
+    options = load_config().get('parquet', {})
+    compression = options.get('compression', 'zstd')
+
+    return {
+        'compression': None if compression == 'none' else compression,
+        'compression_level': options.get('compression_level'),
+        'row_group_size': options.get('row_group_size', 1_000_000),
+        'dictionary_columns': options.get('dictionary_columns', []),
+    }
+
+
+def write_csv(df, sink, chunk_rows=ENCODE_CHUNK_ROWS):
+    """Write a DataFrame as CSV into a binary sink, chunk by chunk"""
+
+    for start in range(0, max(len(df), 1), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows].to_csv(index=False, header=start == 0)
+        sink.write(chunk.encode("utf-8"))
+
+
+def write_parquet(df, sink, options=None):
+    """Write a DataFrame as Parquet into a binary sink, one row group at a time"""
+
+    options = options or parquet_options()
+    row_group_size = options['row_group_size']
+
+    # Infer the schema from the whole frame so every row group agrees on types
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+
+    # Categoricals get int32 indices whatever width pandas picked for their codes, so files of one dataset agree
+    schema = pa.schema([field.with_type(pa.dictionary(pa.int32(), field.type.value_type, field.type.ordered))
+                        if pa.types.is_dictionary(field.type) else field for field in schema],
+                       metadata=schema.metadata)
+
+    # With configured columns, dictionary-encode those and every categorical; otherwise keep pyarrow's default (all)
+    use_dictionary = True
+    if options['dictionary_columns']:
+        use_dictionary = [col for col in df.columns
+                          if col in options['dictionary_columns'] or isinstance(df[col].dtype, pd.CategoricalDtype)]
+
+    with pq.ParquetWriter(sink, schema,
+                          compression=options['compression'],
+                          compression_level=options['compression_level'],
+                          use_dictionary=use_dictionary) as writer:
+        for start in range(0, max(len(df), 1), row_group_size):
+            chunk = df.iloc[start:start + row_group_size]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def write_frame(df, sink, file_format="csv"):
+    """Write a DataFrame into a binary sink in the requested format"""
+
+    if file_format == "parquet":
+        write_parquet(df, sink)
+    elif file_format == "csv":
+        write_csv(df, sink)
+    else:
+        raise ValueError(f"Unsupported file format: {file_format}")
+
+
+def frame_fingerprint(df):
+    """Content hash of a DataFrame, computed without serializing it"""
+
+    row_hashes = pd.util.hash_pandas_object(df, index=False).values
+    column_names = ",".join(map(str, df.columns)).encode("utf-8")
+    return hashlib.sha256(column_names + row_hashes.tobytes()).hexdigest()
+
+
+def upload_fingerprint(df, file_format="csv"):
+    """Fingerprint of the object a DataFrame would be written as: content, dtypes and writer settings"""
+
+    digest = hashlib.sha256(frame_fingerprint(df).encode("utf-8"))
+    digest.update(",".join(map(str, df.dtypes)).encode("utf-8"))
+    digest.update(file_format.encode("utf-8"))
+    if file_format == "parquet":
+        digest.update(repr(sorted(parquet_options().items())).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_frame(stream, file_format="csv"):
+    """Read a DataFrame from a binary stream in the given format"""
+
+    if file_format == "parquet":
+        return pd.read_parquet(stream)
+    elif file_format == "csv":
+        return pd.read_csv(stream)
+    else:
+        raise ValueError(f"Unsupported file format: {file_format}")
@@ -0,0 +1,269 @@
+"""
+Performance measurements for the pipeline steps.
+
+@instrumented records, for every call of a step: wall time, CPU time, peak RSS,
+rows in and out, and the bytes the shared S3 clients read and wrote while it
+ran. The Prefect flow publishes a run's records as a table artifact and both
+entry points write them to PIPELINE_METRICS_DIR/<run id>.json.
+
+CPU time, peak RSS and S3 bytes are process-wide, so steps that run at the same
+time share them. S3 bytes are only reported for calls no other thread's call
+overlapped (None otherwise), since the transfer threads moving them cannot be
+told apart: in staged mode the run's totals are the figures to go by.
+Records are kept per process: with the process task runner only the tasks run
+in the flow's own process are recorded.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import functools
+import pandas as pd
+from pathlib import Path
+from datetime import datetime, timezone
+
+
+METRICS_DIR = Path(os.getenv('PIPELINE_METRICS_DIR', "reports"))
+
+MB = 1024 * 1024
+
+_records = []
+_records_lock = threading.Lock()
+
+# Calls in flight: key -> [thread id, whether a call on another thread overlapped it]
+_in_flight = {}
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # No /proc (macOS): the peak so far is the best available figure
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler(threading.Thread):
+    """Sample RSS in the background and track the peak of every open window"""
+
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True, name="rss-sampler")
+        self.interval = interval
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = current_rss()
+            with self.lock:
+                for key, peak in self.windows.items():
+                    self.windows[key] = max(peak, rss)
+
+    def open(self):
+        key = object()
+        with self.lock:
+            self.windows[key] = current_rss()
+        return key
+
+    def close(self, key):
+        with self.lock:
+            return max(self.windows.pop(key), current_rss())
+
+
+@functools.lru_cache(maxsize=None)
+def rss_sampler():
+    """The sampler shared by every instrumented call, started on first use"""
+
+    sampler = RssSampler()
+    sampler.start()
+    return sampler
+
+
+class S3ByteCounter:
+    """Bytes sent to and received from S3 by every client registered with it"""
+
+    def __init__(self):
+        self.read = 0
+        self.written = 0
+        self.lock = threading.Lock()
+
+    def register(self, s3):
+        s3.meta.events.register('before-send.s3', self.count_request)
+        s3.meta.events.register('after-call.s3.GetObject', self.count_response)
+
+    def count_request(self, request, **kwargs):
+        # Bodies sent with a trailing checksum declare their payload size separately
+        size = request.headers.get('x-amz-decoded-content-length') or request.headers.get('Content-Length') or 0
+        with self.lock:
+            self.written += int(size)
+
+    def count_response(self, parsed, **kwargs):
+        with self.lock:
+            self.read += parsed.get('ContentLength', 0)
+
+    def snapshot(self):
+        with self.lock:
+            return self.read, self.written
+
+
+s3_bytes = S3ByteCounter()
+
+
+def count_rows(value):
+    """Rows of every DataFrame or dataset handle in a value, looking inside dicts, lists and tuples"""
+
+    if isinstance(value, dict):
+        return sum(count_rows(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(count_rows(item) for item in value)
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+
+    # DatasetHandle and chunked handles carry their row count
+    rows = getattr(value, 'rows', None)
+    return rows if isinstance(rows, int) else 0
+
+
+def call_name(fn):
+    """The Prefect task run name inside a task (e.g. clean_orders), else the function name"""
+
+    # Plain scripts do not pay for importing Prefect
+    if 'prefect' not in sys.modules:
+        return fn.__name__
+
+    try:
+        from prefect.runtime import task_run
+        return task_run.name or fn.__name__
+    except Exception:
+        return fn.__name__
+
+
+def start_call():
+    """Register a call in flight, marking it and the calls of other threads as overlapped"""
+
+    key = object()
+    thread = threading.get_ident()
+    with _records_lock:
+        overlapped = False
+        for other in _in_flight.values():
+            if other[0] != thread:
+                other[1] = overlapped = True
+        _in_flight[key] = [thread, overlapped]
+    return key
+
+
+def finish_call(key):
+    """Unregister a call; returns whether another thread's call overlapped it"""
+
+    with _records_lock:
+        return _in_flight.pop(key)[1]
+
+
+def record_call(fn, args, kwargs):
+    """Run fn, recording its wall time, CPU time, peak RSS, rows and S3 bytes"""
+
+    sampler = rss_sampler()
+    window = sampler.open()
+    key = start_call()
+    read_before, written_before = s3_bytes.snapshot()
+    started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+
+    status = "failed"
+    result = None
+    try:
+        result = fn(*args, **kwargs)
+        status = "completed"
+        return result
+    finally:
+        wall_seconds = time.perf_counter() - started
+        cpu_seconds = time.process_time() - cpu_started
+        peak_rss = sampler.close(window)
+        read_after, written_after = s3_bytes.snapshot()
+        overlapped = finish_call(key)
+        record = {
+            'step': fn.__name__,
+            'call': call_name(fn),
+            'status': status,
+            'started_at': started_at.isoformat(),
+            'wall_seconds': round(wall_seconds, 3),
+            'cpu_seconds': round(cpu_seconds, 3),
+            'peak_rss_mb': round(peak_rss / MB, 1),
+            'rows_in': count_rows(args) + count_rows(kwargs),
+            'rows_out': count_rows(result),
+            's3_bytes_read': None if overlapped else read_after - read_before,
+            's3_bytes_written': None if overlapped else written_after - written_before,
+        }
+        with _records_lock:
+            _records.append(record)
+
+
+def instrumented(fn):
+    """Record the wall time, CPU time, peak RSS, rows and S3 bytes of every call"""
+
+    # The wrapper only refers to record_call, so the process task runner can pickle it without the locks
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return record_call(fn, args, kwargs)
+
+    return wrapper
+
+
+def reset_step_metrics():
+    """Forget the records of earlier runs in this process"""
+
+    with _records_lock:
+        _records.clear()
+
+
+def step_metrics():
+    """Records of every instrumented call since the last reset, in completion order"""
+
+    with _records_lock:
+        return list(_records)
+
+
+def summarize_step_metrics(records):
+    """Totals per step name: calls, times, rows and bytes summed (None if any call's bytes are), peak RSS maximized"""
+
+    summary = {}
+    for record in records:
+        step = summary.setdefault(record['step'], {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                                   'peak_rss_mb': 0.0, 'rows_in': 0, 'rows_out': 0,
+                                                   's3_bytes_read': 0, 's3_bytes_written': 0})
+        step['calls'] += 1
+        step['peak_rss_mb'] = max(step['peak_rss_mb'], record['peak_rss_mb'])
+        for field in ['wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out']:
+            step[field] += record[field]
+
+        # Bytes of an overlapped call are unknown, and so is the step total
+        for field in ['s3_bytes_read', 's3_bytes_written']:
+            step[field] = None if step[field] is None or record[field] is None else step[field] + record[field]
+
+    for step in summary.values():
+        step['wall_seconds'] = round(step['wall_seconds'], 3)
+        step['cpu_seconds'] = round(step['cpu_seconds'], 3)
+
+    return summary
+
+
+def write_step_metrics(run_id, records, metrics_dir=None):
+    """Write a run's records and per-step totals to <metrics_dir>/<run_id>.json and return the path"""
+
+    metrics_dir = Path(metrics_dir or METRICS_DIR)
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+
+    path = metrics_dir / f"{run_id}.json"
+    path.write_text(json.dumps({'run_id': str(run_id),
+                                'steps': summarize_step_metrics(records),
+                                'calls': records}, indent=2))
+
+    return path
@@ -0,0 +1,94 @@
+"""
+Run manifest for incremental processing.
+
+After every successful run the ETag, size and last-modified time of each
+raw-data/ object is stored in processed/_manifest.json. The next run compares
+the current objects against it and only recomputes the outputs whose inputs
+changed.
+"""
+
+import os
+import json
+
+
+MANIFEST_KEY = "processed/_manifest.json"
+
+# Raw datasets each processed output is built from
+OUTPUT_INPUTS = {
+    'customers_clean': ['customers'],
+    'products_clean': ['products'],
+    'orders_clean': ['orders'],
+    'order_items_clean': ['order_items', 'orders'],  # Partitioned on the order date
+    'reviews_clean': ['reviews'],
+    'customer_metrics': ['customers', 'orders'],
+    'product_metrics': ['products', 'order_items'],
+    'monthly_sales': ['orders'],
+}
+
+
+def full_refresh_requested():
+    """PIPELINE_FULL_REFRESH=true ignores the manifest and rebuilds everything"""
+
+    return os.getenv('PIPELINE_FULL_REFRESH', 'false').lower() in ('1', 'true', 'yes')
+
+
+def snapshot_raw_objects(s3, bucket_name, prefix="raw-data/"):
+    """ETag, size and last-modified time of every raw object, keyed by dataset name"""
+
+    snapshot = {}
+    paginator = s3.get_paginator('list_objects_v2')
+
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            file_name = obj['Key'][len(prefix):]
+            if not file_name.endswith(".csv") or "/" in file_name:
+                continue
+
+            snapshot[file_name.replace(".csv", "")] = {
+                'etag': obj['ETag'].strip('"'),
+                'size': obj['Size'],
+                'last_modified': obj['LastModified'].isoformat(),
+            }
+
+    return snapshot
+
+
+def load_manifest(s3, bucket_name):
+    """Manifest written by the last successful run, empty on the first run"""
+
+    try:
+        body = s3.get_object(Bucket=bucket_name, Key=MANIFEST_KEY)['Body']
+        return json.loads(body.read())
+    except s3.exceptions.NoSuchKey:
+        return {}
+
+
+def save_manifest(s3, bucket_name, snapshot):
+    """Record the raw objects this run was built from"""
+
+    body = json.dumps({'raw_objects': snapshot}, indent=2).encode("utf-8")
+    s3.put_object(Bucket=bucket_name, Key=MANIFEST_KEY, Body=body)
+
+
+def plan_incremental_run(previous_manifest, snapshot):
+    """Work out which outputs are stale and which raw files are needed to rebuild them"""
+
+    previous = {} if full_refresh_requested() else previous_manifest.get('raw_objects', {})
+
+    changed = {name for name, state in snapshot.items()
+               if previous.get(name, {}).get('etag') != state['etag']
+               or previous.get(name, {}).get('size') != state['size']}
+
+    outputs = {output for output, inputs in OUTPUT_INPUTS.items()
+               if any(name in changed for name in inputs)
+               and all(name in snapshot for name in inputs)}
+
+    inputs = sorted({name for output in outputs for name in OUTPUT_INPUTS[output]})
+
+    return {'changed': sorted(changed), 'outputs': outputs, 'inputs': inputs}
+
+
+def missing_datasets(expected, *built):
+    """Planned inputs or outputs found in none of the built collections; the manifest is only saved when there are none"""
+
+    return sorted(set(expected).difference(*built))
@@ -0,0 +1,173 @@
+"""
+Hive-style date partitioning for processed datasets (partitioning in aws_config.yaml).
+
+Each partitioned dataset keeps a small _partitions.json index next to its
+partitions, mapping every partition file (e.g. year=2025/month=08/day=02/
+part-00000.parquet) to a content fingerprint. Writers use it to upload only
+the partitions that changed, and readers use it to prune partitions for a date
+range without listing the whole prefix. The file extension is part of the key,
+so changing file_formats.processed rewrites every partition in the new format
+and removes the old files.
+"""
+
+import os
+import re
+import json
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline_utils.artifacts import resolve_dataset
+from pipeline_utils.config import load_config
+from pipeline_utils.formats import frame_fingerprint, read_frame
+from pipeline_utils.s3_io import open_s3_object, upload_dataframe
+
+
+UPLOAD_WORKERS = int(os.getenv('S3_UPLOAD_WORKERS', 8))
+INDEX_FILE = "_partitions.json"
+
+
+def partitioning_config():
+    """The partitioning section of aws_config.yaml"""
+
+    return load_config().get('partitioning', {})
+
+
+def partition_dates(dataset_name, df, processed):
+    """Date Series a processed dataset is partitioned on, or None if it is not partitioned"""
+
+    config = partitioning_config()
+    date_column = config.get('datasets', {}).get(dataset_name)
+
+    if not config.get('by_date') or not date_column:
+        return None
+
+    if date_column in df.columns:
+        return pd.to_datetime(df[date_column])
+
+    # order_items has no date of its own, so it inherits the date of its order
+    if 'order_id' in df.columns and 'orders_clean' in processed:
+        orders = resolve_dataset(processed['orders_clean'])
+        order_dates = orders.set_index('order_id')[date_column]
+        return pd.to_datetime(df['order_id'].map(order_dates))
+
+    return None
+
+
+def partition_path(day, path_format):
+    """Partition directory for a day, e.g. year=2025/month=08/day=02"""
+
+    if pd.isna(day):
+        return re.sub(r'%[a-zA-Z]', '__HIVE_DEFAULT_PARTITION__', path_format)
+    return day.strftime(path_format)
+
+
+def partition_file(path, file_format):
+    """Partition file under a dataset's prefix, e.g. year=2025/month=08/day=02/part-00000.parquet"""
+
+    return f"{path}/part-00000.{file_format}"
+
+
+def load_partition_index(s3, bucket_name, prefix):
+    """Read the partition index of a dataset, empty if the dataset was never written"""
+
+    try:
+        body = s3.get_object(Bucket=bucket_name, Key=f"{prefix}/{INDEX_FILE}")['Body']
+        return json.loads(body.read())
+    except s3.exceptions.NoSuchKey:
+        return {}
+
+
+def partition_format():
+    """Partition directory format, e.g. year=%Y/month=%m/day=%d"""
+
+    return partitioning_config().get('date_format', "year=%Y/month=%m/day=%d")
+
+
+def split_partitions(df, dates):
+    """Yield (partition path, rows) for every day in a DataFrame"""
+
+    for day, part in df.groupby(dates.dt.normalize(), sort=True, dropna=False):
+        yield partition_path(day, partition_format()), part
+
+
+def upload_partitions(s3, partitions, bucket_name, prefix, file_format="csv", log=print):
+    """Upload (partition path, rows) pairs, skipping partitions whose content is unchanged; returns the files written"""
+
+    previous_index = load_partition_index(s3, bucket_name, prefix)
+
+    index = {}
+    changed = []
+    in_flight = []
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        for path, part in partitions:
+            key = partition_file(path, file_format)
+            index[key] = frame_fingerprint(part)
+            if previous_index.get(key) == index[key]:
+                continue
+
+            # The partition index already says this partition changed, so no HEAD check is needed
+            in_flight.append(pool.submit(upload_dataframe, s3, part, bucket_name, f"{prefix}/{key}", file_format,
+                                         skip_unchanged=False))
+            changed.append(key)
+
+            # Bound how many partitions are held in memory waiting to upload
+            if len(in_flight) >= 2 * UPLOAD_WORKERS:
+                in_flight.pop(0).result()
+
+        for future in in_flight:
+            future.result()
+
+    # Drop partitions that no longer have any rows, and files written in another format
+    removed = [key for key in previous_index if key not in index]
+    for key in removed:
+        s3.delete_object(Bucket=bucket_name, Key=f"{prefix}/{key}")
+
+    s3.put_object(Bucket=bucket_name, Key=f"{prefix}/{INDEX_FILE}",
+                  Body=json.dumps(index, indent=2).encode("utf-8"))
+
+    log(f"Partitions under {prefix}: {len(changed)} written, "
+        f"{len(index) - len(changed)} unchanged, {len(removed)} removed")
+
+    return changed
+
+
+def upload_partitioned(s3, df, dates, bucket_name, prefix, file_format="csv", log=print):
+    """Write a DataFrame as one file per day partition, uploading only partitions that changed"""
+
+    return upload_partitions(s3, split_partitions(df, dates), bucket_name, prefix, file_format, log)
+
+
+def read_partitioned(s3, bucket_name, prefix, start_date=None, end_date=None):
+    """Read the partitions of a dataset whose day falls within [start_date, end_date], in the format they were written"""
+
+    start_date = pd.Timestamp(start_date) if start_date is not None else None
+    end_date = pd.Timestamp(end_date) if end_date is not None else None
+
+    selected = []
+    for key in load_partition_index(s3, bucket_name, prefix):
+        try:
+            day = datetime.strptime(key.rsplit("/", 1)[0], partition_format())
+        except ValueError:
+            # Rows without a date only come back when no range is given
+            if start_date is None and end_date is None:
+                selected.append(key)
+            continue
+
+        if start_date is not None and day < start_date:
+            continue
+        if end_date is not None and day > end_date:
+            continue
+        selected.append(key)
+
+    def read(key):
+        with open_s3_object(s3, bucket_name, f"{prefix}/{key}") as stream:
+            return read_frame(stream, key.rsplit(".", 1)[1])
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        frames = list(pool.map(read, selected))
+
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
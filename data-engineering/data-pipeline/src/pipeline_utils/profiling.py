@@ -0,0 +1,248 @@
+"""
+Opt-in profiling of pipeline steps.
+
+PIPELINE_PROFILE names the steps to profile, as a comma-separated list of
+function or Prefect task run names (e.g. "clean_orders,upload_processed_data"),
+or "all". Every matching call runs under a sampling profiler and tracemalloc,
+and writes to PIPELINE_PROFILE_DIR/<run id>/:
+
+    <n>-<call>.html      pyinstrument's interactive flame graph (pip install -r requirements-dev.txt)
+    <n>-<call>.folded    without pyinstrument, the built-in sampler's stacks, for speedscope or flamegraph.pl
+    <n>-<call>.txt       hottest functions and the top allocations
+
+The sampler only follows the thread the step runs in. tracemalloc traces the
+whole process, so the allocations of steps that run at the same time are
+mixed, and tracing slows every allocation down: only profile runs you are
+investigating. Arrow buffers come from Arrow's own allocator and are not
+traced; the peak RSS in the step metrics covers them.
+"""
+
+import os
+import sys
+import time
+import linecache
+import threading
+import functools
+import itertools
+import tracemalloc
+from pathlib import Path
+from collections import Counter
+
+from pipeline_utils.instrumentation import METRICS_DIR, call_name
+
+
+PROFILE_STEPS = {name.strip() for name in os.getenv('PIPELINE_PROFILE', "").split(",") if name.strip()}
+PROFILE_DIR = Path(os.getenv('PIPELINE_PROFILE_DIR', METRICS_DIR / "profiles"))
+PROFILE_INTERVAL = float(os.getenv('PIPELINE_PROFILE_INTERVAL', 0.005))
+TOP_ALLOCATIONS = int(os.getenv('PIPELINE_PROFILE_TOP_ALLOCATIONS', 25))
+TOP_FUNCTIONS = 25
+
+MB = 1024 * 1024
+
+_run_dir = None
+_reports = []
+_call_numbers = itertools.count(1)
+_state_lock = threading.Lock()
+_tracing_calls = 0
+_started_tracing = False
+
+
+def profiling_requested(*names):
+    """Whether PIPELINE_PROFILE selects a step under any of these names"""
+
+    return bool(PROFILE_STEPS) and ('all' in PROFILE_STEPS or any(name in PROFILE_STEPS for name in names))
+
+
+class StackSampler(threading.Thread):
+    """Sample one thread's Python stack at a fixed interval and count identical stacks"""
+
+    def __init__(self, thread_id, root_frame, interval=PROFILE_INTERVAL):
+        super().__init__(daemon=True, name="stack-sampler")
+        self.thread_id = thread_id
+        self.root_frame = root_frame
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+
+            # Walk up to the profiled call; the frames above it are the same for every sample
+            while frame is not None and frame is not self.root_frame:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def folded_stacks(stacks):
+    """Stacks in the folded format read by speedscope and flamegraph.pl"""
+
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def hottest_functions(stacks, limit=TOP_FUNCTIONS):
+    """Functions by the share of samples spent in them (self) and under them (total)"""
+
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for frame in set(frames):
+            total[frame] += count
+
+    samples = sum(stacks.values()) or 1
+    lines = [f"{'self %':>7}{'total %':>9}  function"]
+    for frame, count in own.most_common(limit):
+        lines.append(f"{100 * count / samples:>7.1f}{100 * total[frame] / samples:>9.1f}  {frame}")
+    return "\n".join(lines)
+
+
+def top_allocations(snapshot, started, limit=TOP_ALLOCATIONS):
+    """Source lines holding the most memory allocated since the call started"""
+
+    # Leave out the profiler's own bookkeeping
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, __file__),
+              tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+              tracemalloc.Filter(False, "<unknown>")]
+    differences = snapshot.filter_traces(ignore).compare_to(started.filter_traces(ignore), 'lineno')
+    grown = sorted((stat for stat in differences if stat.size_diff > 0), key=lambda stat: stat.size_diff, reverse=True)
+
+    lines = [f"{'MB':>10}{'blocks':>10}  line"]
+    for stat in grown[:limit]:
+        frame = stat.traceback[0]
+        source = linecache.getline(frame.filename, frame.lineno).strip()
+        lines.append(f"{stat.size_diff / MB:>10.1f}{stat.count_diff:>10}  "
+                     f"{Path(frame.filename).name}:{frame.lineno}  {source}")
+    return "\n".join(lines)
+
+
+def start_tracing():
+    """Start tracemalloc for the first profiled call in flight"""
+
+    global _tracing_calls, _started_tracing
+    with _state_lock:
+        if _tracing_calls == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        tracemalloc.reset_peak()
+        _tracing_calls += 1
+
+
+def stop_tracing():
+    """Stop tracemalloc once no profiled call is left, unless something else started it"""
+
+    global _tracing_calls, _started_tracing
+    with _state_lock:
+        _tracing_calls -= 1
+        if _tracing_calls == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+def start_profiler(root_frame):
+    """pyinstrument when installed, else the built-in stack sampler"""
+
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        sampler = StackSampler(threading.get_ident(), root_frame)
+        sampler.start()
+        return sampler
+
+    profiler = Profiler(interval=PROFILE_INTERVAL, async_mode='disabled')
+    profiler.start()
+    return profiler
+
+
+def write_profile(profiler, name, call_report):
+    """Write a stopped profiler's flame graph (or folded stacks) and report; returns the files and its hot functions"""
+
+    # Calls outside a pipeline run go straight into PIPELINE_PROFILE_DIR
+    run_dir = Path(_run_dir or PROFILE_DIR)
+    run_dir.mkdir(parents=True, exist_ok=True)
+
+    if isinstance(profiler, StackSampler):
+        # Rendered by speedscope or flamegraph.pl
+        flame_graph = run_dir / f"{name}.folded"
+        flame_graph.write_text(folded_stacks(profiler.stacks))
+        functions = hottest_functions(profiler.stacks)
+    else:
+        flame_graph = run_dir / f"{name}.html"
+        flame_graph.write_text(profiler.output_html())
+        functions = profiler.output_text(unicode=False, color=False)
+
+    report = run_dir / f"{name}.txt"
+    report.write_text(f"{call_report}\n\nHottest functions\n\n{functions}\n")
+
+    return flame_graph, report, functions
+
+
+def profile_call(fn, args, kwargs):
+    """Run fn, profiling it if PIPELINE_PROFILE selects it"""
+
+    call = call_name(fn)
+    if not profiling_requested(fn.__name__, call):
+        return fn(*args, **kwargs)
+
+    name = f"{next(_call_numbers):03d}-{call}"
+    start_tracing()
+    started_snapshot = tracemalloc.take_snapshot()
+    profiler = start_profiler(sys._getframe())
+    started = time.perf_counter()
+
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - started
+        # Stop sampling first so building the reports does not show up in the flame graph
+        profiler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        stop_tracing()
+
+        allocations = top_allocations(snapshot, started_snapshot)
+        call_report = (f"{call}: {seconds:.2f}s, peak traced memory {peak / MB:.1f} MB\n\n"
+                       f"Top allocations made during the call and still held when it returned\n\n{allocations}")
+        flame_graph, report, functions = write_profile(profiler, name, call_report)
+
+        with _state_lock:
+            _reports.append({'call': call, 'seconds': round(seconds, 3), 'peak_traced_mb': round(peak / MB, 1),
+                             'flame_graph': str(flame_graph), 'report': str(report),
+                             'functions': functions, 'allocations': allocations})
+
+
+def profiled(fn):
+    """Profile calls of fn selected by PIPELINE_PROFILE; other calls run untouched"""
+
+    # The wrapper only refers to profile_call, so the process task runner can pickle it without the locks
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return profile_call(fn, args, kwargs)
+
+    return wrapper
+
+
+def reset_profiles(run_id):
+    """Write this run's profiles to PIPELINE_PROFILE_DIR/<run_id>/ and forget earlier ones"""
+
+    global _run_dir
+    with _state_lock:
+        _run_dir = PROFILE_DIR / str(run_id)
+        _reports.clear()
+
+
+def profile_reports():
+    """Profiles written since the last reset, in completion order"""
+
+    with _state_lock:
+        return list(_reports)
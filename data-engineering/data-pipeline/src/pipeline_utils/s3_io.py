@@ -0,0 +1,286 @@
+"""
+S3 read/write helpers shared by the data processing scripts and Prefect flows.
+"""
+
+import io
+import os
+import time
+import queue
+import threading
+import pandas as pd
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from pipeline_utils.formats import upload_fingerprint, write_frame
+from pipeline_utils.schemas import read_csv_typed
+
+
+RAW_DATA_FILES = ['customers.csv', 'products.csv', 'orders.csv', 'order_items.csv', 'reviews.csv']
+
+# Objects larger than this are streamed in byte ranges instead of a single GET
+STREAM_THRESHOLD_BYTES = int(os.getenv('S3_STREAM_THRESHOLD_BYTES', 64 * 1024 * 1024))
+RANGE_BYTES = int(os.getenv('S3_RANGE_BYTES', 8 * 1024 * 1024))
+
+# Frames with more rows than this are encoded and uploaded at the same time
+UPLOAD_STREAM_ROWS = int(os.getenv('S3_UPLOAD_STREAM_ROWS', 500_000))
+
+# Skip uploads whose content matches the checksum stored on the existing object
+SKIP_UNCHANGED = os.getenv('S3_SKIP_UNCHANGED', 'true').lower() not in ('0', 'false', 'no')
+
+
+class S3RangeReader(io.RawIOBase):
+    """Read-only, seekable file object that fetches an S3 object in fixed-size byte ranges
+
+    Seeking lets Parquet readers jump to the footer and column chunks, fetching only those ranges.
+    """
+
+    def __init__(self, s3, bucket_name, s3_key, size, range_bytes=RANGE_BYTES):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.s3_key = s3_key
+        self.size = size
+        self.range_bytes = range_bytes
+        self.position = 0
+        self.buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        start = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(0, start + offset)
+        self.buffer = memoryview(b"")
+        return self.position
+
+    def fetch_next_range(self):
+        end = min(self.position + self.range_bytes, self.size) - 1
+        response = self.s3.get_object(Bucket=self.bucket_name, Key=self.s3_key,
+                                      Range=f"bytes={self.position}-{end}")
+        self.buffer = memoryview(response['Body'].read())
+
+    def readinto(self, target):
+        if not self.buffer:
+            if self.position >= self.size:
+                return 0
+            self.fetch_next_range()
+
+        count = min(len(target), len(self.buffer))
+        target[:count] = self.buffer[:count]
+        self.buffer = self.buffer[count:]
+        self.position += count
+        return count
+
+
+class ChunkQueueReader(io.RawIOBase):
+    """Read-only file object fed with byte chunks by a producer thread"""
+
+    def __init__(self, max_chunks=4):
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.buffer = memoryview(b"")
+        self.finished = False
+        self.cancelled = threading.Event()
+
+    def readable(self):
+        return True
+
+    def put(self, chunk):
+        """Queue a chunk for the reader, giving up if the reader was closed"""
+
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(chunk, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def readinto(self, target):
+        while not self.buffer:
+            if self.finished:
+                return 0
+
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.finished = True
+            elif isinstance(chunk, Exception):
+                raise chunk
+            else:
+                self.buffer = memoryview(chunk)
+
+        count = min(len(target), len(self.buffer))
+        target[:count] = self.buffer[:count]
+        self.buffer = self.buffer[count:]
+        return count
+
+    def close(self):
+        self.cancelled.set()
+        super().close()
+
+
+class ChunkQueueWriter(io.RawIOBase):
+    """Writable sink that hands everything written to it to a ChunkQueueReader"""
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if not self.reader.put(bytes(data)):
+            raise IOError("Upload stream was closed before encoding finished")
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+
+def download_worker_count(file_count):
+    """Number of download threads, bounded by S3_DOWNLOAD_WORKERS and the file count"""
+
+    workers = int(os.getenv('S3_DOWNLOAD_WORKERS', file_count))
+    return max(1, min(workers, file_count))
+
+
+def open_s3_object(s3, bucket_name, s3_key):
+    """Open an S3 object as a seekable in-memory binary stream, never touching local disk"""
+
+    size = s3.head_object(Bucket=bucket_name, Key=s3_key)['ContentLength']
+
+    if size <= STREAM_THRESHOLD_BYTES:
+        body = s3.get_object(Bucket=bucket_name, Key=s3_key)['Body']
+        return io.BytesIO(body.read())
+
+    # Large objects are read range by range so only one range is held in memory
+    return io.BufferedReader(S3RangeReader(s3, bucket_name, s3_key, size), buffer_size=RANGE_BYTES)
+
+
+def read_csv_from_s3(s3, bucket_name, s3_key, **read_csv_kwargs):
+    """Parse a CSV object straight from S3 into pandas"""
+
+    stream = open_s3_object(s3, bucket_name, s3_key)
+
+    if read_csv_kwargs.get('chunksize'):
+        # The caller owns the stream while iterating over chunks
+        return pd.read_csv(stream, **read_csv_kwargs)
+
+    with stream:
+        return pd.read_csv(stream, **read_csv_kwargs)
+
+
+def download_csv(s3, bucket_name, file_name, log=print):
+    """Download one raw CSV file and parse it into a DataFrame typed by its schema"""
+
+    s3_key = f"raw-data/{file_name}"
+    return read_csv_typed(lambda: open_s3_object(s3, bucket_name, s3_key), file_name.replace(".csv", ""), log)
+
+
+def download_datasets(s3, bucket_name, data_files=RAW_DATA_FILES, max_workers=None, log=print, log_error=None):
+    """Download and parse raw CSV files concurrently, reporting time per file and overall
+
+    Failed files are reported through log_error when given (e.g. a logger's error method).
+    """
+
+    datasets = {}
+    timings = {}
+    max_workers = max_workers or download_worker_count(len(data_files))
+
+    def fetch(file_name):
+        started = time.perf_counter()
+        df = download_csv(s3, bucket_name, file_name, log)
+        return df, time.perf_counter() - started
+
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(fetch, file_name): file_name for file_name in data_files}
+
+        for future in as_completed(futures):
+            file_name = futures[future]
+            dataset_name = file_name.replace(".csv", "")
+
+            try:
+                df, elapsed = future.result()
+                datasets[dataset_name] = df
+                timings[dataset_name] = elapsed
+                log(f'Loaded {dataset_name}: {len(df)} records in {elapsed:.2f}s')
+
+            except Exception as e:
+                (log_error or log)(f"Failed to download {file_name}: {e}")
+
+    # Keep the original file order regardless of which download finished first
+    dataset_names = [file_name.replace(".csv", "") for file_name in data_files]
+    datasets = {name: datasets[name] for name in dataset_names if name in datasets}
+
+    timings['total'] = time.perf_counter() - started
+    log(f"Downloaded {len(datasets)}/{len(data_files)} files in {timings['total']:.2f}s "
+        f"using {max_workers} workers")
+
+    return datasets, timings
+
+
+def encode_frame(df, reader, file_format):
+    """Producer: encode a DataFrame into a ChunkQueueReader from a background thread"""
+
+    try:
+        write_frame(df, ChunkQueueWriter(reader), file_format)
+        reader.put(None)
+
+    except Exception as e:
+        reader.put(e)
+
+
+def remote_metadata(s3, bucket_name, s3_key):
+    """User metadata of an existing object, or None if there is no object"""
+
+    try:
+        return s3.head_object(Bucket=bucket_name, Key=s3_key).get('Metadata', {})
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def upload_dataframe(s3, df, bucket_name, s3_key, file_format="csv", skip_unchanged=SKIP_UNCHANGED):
+    """Serialize a DataFrame in memory (CSV or Parquet) and upload it without a temp file
+
+    Returns False when the object already holds the same content and the upload was skipped.
+    """
+
+    # The fingerprint is stored with the object so the next upload can be skipped when nothing changed
+    fingerprint = upload_fingerprint(df, file_format)
+    if skip_unchanged and (remote_metadata(s3, bucket_name, s3_key) or {}).get('fingerprint') == fingerprint:
+        return False
+
+    extra_args = {'Metadata': {'fingerprint': fingerprint}}
+
+    if len(df) <= UPLOAD_STREAM_ROWS:
+        buffer = io.BytesIO()
+        write_frame(df, buffer, file_format)
+        buffer.seek(0)
+        s3.upload_fileobj(buffer, bucket_name, s3_key, ExtraArgs=extra_args)
+        return True
+
+    # Large frames: encode in a background thread while multipart parts are sent
+    reader = ChunkQueueReader()
+    encoder = threading.Thread(target=encode_frame, args=(df, reader, file_format), daemon=True)
+    encoder.start()
+
+    # Buffered, so read(n) fills n bytes from the queued chunks: a short read would make
+    # s3transfer take the body for a small object and send it as a single PutObject
+    stream = io.BufferedReader(reader, buffer_size=RANGE_BYTES)
+    try:
+        s3.upload_fileobj(stream, bucket_name, s3_key, ExtraArgs=extra_args)
+    finally:
+        stream.close()
+        encoder.join()
+
+    return True
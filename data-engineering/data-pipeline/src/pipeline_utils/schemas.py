@@ -0,0 +1,189 @@
+"""
+Typed reads of the raw CSV files, driven by config/data_schemas.yaml.
+
+Each dataset schema lists the columns to read with their type, date format and
+whether they are required. Files are parsed by the pyarrow CSV reader straight
+into those types, so pandas never infers types or date formats row by row and
+unlisted columns are never materialized. If a value does not fit its type, the
+file is read again as text and coerced column by column, turning bad values
+into nulls and reporting how many there were.
+"""
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import csv
+
+from pipeline_utils.config import load_config
+from pipeline_utils.dates import parse_dates
+
+
+ARROW_TYPES = {
+    'string': pa.string(),
+    'category': pa.dictionary(pa.int32(), pa.string()),
+    'int64': pa.int64(),
+    'float64': pa.float64(),
+    'bool': pa.bool_(),
+    'date': pa.timestamp('ns'),
+    'datetime': pa.timestamp('ns'),
+}
+
+BOOL_VALUES = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def load_schema(dataset_name):
+    """Schema of a raw dataset, or None if data_schemas.yaml does not describe it"""
+
+    try:
+        schemas = load_config("data_schemas.yaml")
+    except FileNotFoundError:
+        return None
+    return schemas.get('datasets', {}).get(dataset_name)
+
+
+def convert_options(schema, typed=True):
+    """pyarrow conversion options for a schema; typed=False reads everything but categories as text"""
+
+    columns = schema['columns']
+    column_types = {name: ARROW_TYPES[spec['type']] if typed or spec['type'] == 'category' else pa.string()
+                    for name, spec in columns.items()}
+    formats = sorted({spec['format'] for spec in columns.values() if 'format' in spec})
+
+    return csv.ConvertOptions(column_types=column_types, include_columns=list(columns),
+                              include_missing_columns=True, strings_can_be_null=True,
+                              timestamp_parsers=formats)
+
+
+def read_arrow_csv(stream, schema, typed=True):
+    """Parse a CSV stream with pyarrow into a DataFrame"""
+
+    parse_options = csv.ParseOptions(newlines_in_values=schema.get('newlines_in_values', False))
+    table = csv.read_csv(stream, parse_options=parse_options, convert_options=convert_options(schema, typed))
+    return table.to_pandas()
+
+
+def coerce_column(values, spec):
+    """Convert one text column to its schema type, invalid values become nulls"""
+
+    kind = spec['type']
+
+    if kind in ('int64', 'float64'):
+        return pd.to_numeric(values, errors='coerce')
+    if kind in ('date', 'datetime'):
+        return parse_dates(values, spec['format'], errors='coerce')
+    if kind == 'bool':
+        return values.str.strip().str.lower().map(BOOL_VALUES)
+    if kind == 'category':
+        return values.astype('category')
+    return values
+
+
+def coerce_columns(df, schema, dataset_name, failures=None, log=print):
+    """Apply the schema types to a text DataFrame, counting values that could not be converted"""
+
+    report = failures is None
+    failures = {} if failures is None else failures
+
+    for name, spec in schema['columns'].items():
+        if name not in df.columns:
+            df[name] = None
+        elif df[name].dtype == object:
+            converted = coerce_column(df[name], spec)
+            failed = int((df[name].notna() & converted.isna()).sum())
+            if failed:
+                failures[name] = failures.get(name, 0) + failed
+            df[name] = converted
+
+    if report:
+        report_coercion_failures(dataset_name, schema, failures, log)
+
+    return df
+
+
+def report_coercion_failures(dataset_name, schema, failures, log=print):
+    """Log the number of values per column that did not fit the schema type"""
+
+    for name, failed in failures.items():
+        log(f"Schema {dataset_name}: {failed} values in {name} are not a valid "
+            f"{schema['columns'][name]['type']} and were set to null")
+
+
+def check_required(df, schema, dataset_name, missing=None, log=print):
+    """Count nulls in required columns; on its own, also fail if a required column has no values at all"""
+
+    report = missing is None
+    missing = {} if missing is None else missing
+
+    for name, spec in schema['columns'].items():
+        if not spec.get('required'):
+            continue
+
+        nulls = int(df[name].isna().sum())
+        if nulls:
+            missing[name] = missing.get(name, 0) + nulls
+
+    if report:
+        require_values(dataset_name, missing, len(df))
+        report_missing_values(dataset_name, missing, log)
+
+
+def require_values(dataset_name, missing, rows):
+    """Fail if a required column is null in every one of a dataset's rows"""
+
+    for name, nulls in missing.items():
+        if rows and nulls == rows:
+            raise ValueError(f"{dataset_name}: required column {name} is missing or empty")
+
+
+def report_missing_values(dataset_name, missing, log=print):
+    """Log the number of rows without a value per required column"""
+
+    for name, nulls in missing.items():
+        log(f"Schema {dataset_name}: {nulls} rows have no {name}")
+
+
+def read_csv_typed(open_stream, dataset_name, log=print):
+    """Read a raw CSV with its schema; open_stream() returns a fresh binary stream of the file"""
+
+    schema = load_schema(dataset_name)
+    if schema is None:
+        with open_stream() as stream:
+            return pd.read_csv(stream)
+
+    try:
+        with open_stream() as stream:
+            df = read_arrow_csv(stream, schema)
+
+    except pa.ArrowInvalid as e:
+        # A value did not fit its type: read the file as text and coerce column by column
+        log(f"Schema {dataset_name}: typed read failed ({e}), coercing column by column")
+        with open_stream() as stream:
+            df = coerce_columns(read_arrow_csv(stream, schema, typed=False), schema, dataset_name, log=log)
+
+    check_required(df, schema, dataset_name, log=log)
+    return df
+
+
+def iter_csv_typed(stream, dataset_name, chunk_rows, log=print):
+    """Yield typed chunks of a raw CSV stream, checking required columns and reporting failures once at the end"""
+
+    schema = load_schema(dataset_name)
+    if schema is None:
+        with pd.read_csv(stream, chunksize=chunk_rows) as reader:
+            yield from reader
+        return
+
+    failures = {}
+    missing = {}
+    rows = 0
+    with pd.read_csv(stream, chunksize=chunk_rows, usecols=lambda name: name in schema['columns'],
+                     dtype=object) as reader:
+        for chunk in reader:
+            chunk = coerce_columns(chunk, schema, dataset_name, failures, log)
+            check_required(chunk, schema, dataset_name, missing, log)
+            rows += len(chunk)
+            yield chunk
+
+    # A required column only fails the dataset when it is empty in every chunk, not in one of them
+    require_values(dataset_name, missing, rows)
+    report_coercion_failures(dataset_name, schema, failures, log)
+    report_missing_values(dataset_name, missing, log)
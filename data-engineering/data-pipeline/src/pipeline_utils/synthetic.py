@@ -0,0 +1,457 @@
+"""
+Synthetic raw datasets shaped like the files in data/raw.
+
+Every column in data_schemas.yaml is generated with numpy, so a million orders
+take seconds rather than the hours a row-by-row faker would need. Rows refer to
+each other the way the real exports do: orders belong to customers, order items
+to orders and products, and reviews to an order item's order, product and
+customer. Order amounts add up from their items.
+
+Product popularity follows a Zipf law and order dates follow the season (a
+November/December peak, busier weekends, year-on-year growth), so groupbys and
+partitions see the skew real traffic has.
+
+Strings are never formatted per row: each distinct date or label is formatted
+once and taken by index, the same trick the date parser uses the other way.
+Text columns are Arrow-backed and the CSV files are written by pyarrow, so
+neither step creates a Python object per value.
+
+Large runs are generated in chunks of orders by a process pool. Every chunk
+writes its own CSV parts, and the parts are joined into one file per dataset.
+"""
+
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pa_csv
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+
+# Rows of the other datasets per order
+CUSTOMERS_PER_ORDER = 0.5
+PRODUCTS_PER_ORDER = 0.05
+MAX_PRODUCTS = 200_000
+REVIEWS_PER_ORDER = 0.75
+MAX_ITEMS_PER_ORDER = 5
+
+ORDER_START = "2024-01-01"
+ORDER_END = "2025-12-31"
+
+# Orders per generated chunk, and generator processes (all cores by default)
+CHUNK_ORDERS = int(os.getenv('SYNTHETIC_CHUNK_ORDERS', 250_000))
+GENERATOR_WORKERS = int(os.getenv('SYNTHETIC_WORKERS', 0)) or os.cpu_count()
+
+# Product popularity: the product at rank r sells in proportion to 1 / r ** ZIPF_EXPONENT
+ZIPF_EXPONENT = float(os.getenv('SYNTHETIC_ZIPF_EXPONENT', 1.0))
+
+# Relative order volume by month (January first), by weekday (Monday first), and growth per year
+MONTH_WEIGHTS = np.array([0.80, 0.75, 0.90, 0.95, 1.00, 0.95, 0.90, 0.95, 1.00, 1.10, 1.50, 1.80])
+WEEKDAY_WEIGHTS = np.array([0.95, 0.95, 0.95, 1.00, 1.10, 1.20, 1.15])
+YEARLY_GROWTH = 0.3
+
+FIRST_NAMES = np.array(['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda',
+                        'David', 'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica'])
+LAST_NAMES = np.array(['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+                       'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Thomas', 'Taylor'])
+STREETS = np.array(['Main St', 'Oak Ave', 'Pine Rd', 'Maple Dr', 'Cedar Ln', 'Elm St', 'Lake Blvd', 'Hill Way'])
+CITIES = np.array(['Springfield', 'Riverside', 'Franklin', 'Greenville', 'Bristol', 'Clinton', 'Fairview',
+                   'Salem', 'Madison', 'Georgetown'])
+STATES = np.array(['California', 'Texas', 'Florida', 'New York', 'Ohio', 'Georgia', 'Michigan', 'Wyoming',
+                   'Minnesota', 'Missouri'])
+COUNTRIES = np.array(['United States', 'Canada', 'United Kingdom', 'Germany', 'France', 'Denmark', 'Iceland'])
+LANGUAGES = np.array(['English', 'Spanish', 'French', 'German'])
+GENDERS = np.array(['Male', 'Female', 'Other'])
+
+CATEGORIES = {
+    'Electronics': ['Phones', 'Laptops', 'Headphones', 'Cameras'],
+    'Clothing': ['Jeans', 'Shirts', 'Jackets', 'Shoes'],
+    'Home': ['Kitchen', 'Furniture', 'Lighting', 'Bedding'],
+    'Sports': ['Fitness', 'Cycling', 'Camping', 'Running'],
+    'Books': ['Fiction', 'Science', 'History', 'Children'],
+}
+ADJECTIVES = np.array(['Classic', 'Premium', 'Compact', 'Deluxe', 'Essential', 'Smart', 'Ultra', 'Eco'])
+BRANDS = np.array(['Acme', 'Globex', 'Initech', 'Umbrella', 'Stark', 'Wayne', 'Hooli', 'Vandelay'])
+COLORS = np.array(['Black', 'White', 'Red', 'Blue', 'Green', 'Grey'])
+MATERIALS = np.array(['Plastic', 'Metal', 'Wood', 'Fabric', 'Glass', 'Leather'])
+DESCRIPTIONS = np.array(['Built to last.\nEasy to clean and maintain.',
+                         'Our best seller in this range.',
+                         'Lightweight and durable.\nShips in recyclable packaging.',
+                         'A customer favourite, now with an improved design.'])
+
+ORDER_STATUSES = np.array(['delivered', 'shipped', 'processing', 'pending', 'cancelled', 'returned'])
+PAYMENT_METHODS = np.array(['credit_card', 'debit_card', 'paypal', 'bank_transfer', 'apple_pay'])
+SHIPPING_METHODS = np.array(['standard', 'express', 'overnight', 'pickup'])
+SHIPPING_COSTS = np.array([0.0, 4.99, 9.99, 14.5, 22.06])
+
+REVIEW_TITLES = np.array(['Great value', 'Not as described', 'Works as expected', 'Would buy again',
+                          'Disappointed', 'Excellent quality'])
+REVIEW_TEXTS = np.array(['Arrived on time and works well.',
+                         'Quality could be better.\nPackaging was damaged.',
+                         'Exactly what I needed.',
+                         'Stopped working after a month.\nSupport was helpful though.'])
+
+# Ratings skew positive, like most review data
+RATING_WEIGHTS = [0.06, 0.08, 0.16, 0.30, 0.40]
+
+
+def take(values, codes):
+    """values[codes] for a small array of distinct strings, as an Arrow-backed column"""
+
+    return pd.arrays.ArrowExtensionArray(pa.array(values, type=pa.string()).take(codes))
+
+
+def digits(numbers, width=1):
+    """Integers as zero-padded decimal strings, as an Arrow-backed column"""
+
+    return pd.arrays.ArrowExtensionArray(pc.utf8_lpad(pc.cast(pa.array(numbers), pa.string()), width, "0"))
+
+
+def format_ids(prefix, numbers):
+    """Zero-padded identifiers like ORD-000000001"""
+
+    return prefix + digits(numbers, 9)
+
+
+def numbered_ids(prefix, count, start=0):
+    """Identifiers for the rows start .. start + count - 1"""
+
+    return format_ids(prefix, np.arange(start, start + count))
+
+
+def day_strings(start, end):
+    """Every day between start and end formatted once as YYYY-MM-DD"""
+
+    return pd.date_range(start, end, freq="D").strftime("%Y-%m-%d").to_numpy()
+
+
+@lru_cache(maxsize=None)
+def clock_strings():
+    """All 86,400 HH:MM:SS times of a day"""
+
+    seconds = np.arange(24 * 60 * 60)
+    return (digits(seconds // 3600, 2) + ":" + digits(seconds // 60 % 60, 2) + ":" + digits(seconds % 60, 2))
+
+
+def time_strings(rng, count):
+    """Random HH:MM:SS strings"""
+
+    clock = clock_strings()
+    return clock[rng.integers(0, len(clock), count)]
+
+
+def bool_strings(mask):
+    """Booleans written the way the raw exports write them"""
+
+    return take(['FALSE', 'TRUE'], mask.astype(np.int8))
+
+
+def sample_index(rng, cumulative, count):
+    """Draw count indexes from a cumulative distribution"""
+
+    return np.minimum(np.searchsorted(cumulative, rng.random(count), side='right'), len(cumulative) - 1)
+
+
+@lru_cache(maxsize=None)
+def order_day_distribution():
+    """Cumulative share of orders up to each day of the order date range"""
+
+    days = pd.date_range(ORDER_START, ORDER_END, freq="D")
+    weights = (MONTH_WEIGHTS[days.month - 1] * WEEKDAY_WEIGHTS[days.weekday] *
+               (1 + YEARLY_GROWTH * np.arange(len(days)) / 365))
+
+    return np.cumsum(weights / weights.sum())
+
+
+def product_popularity(product_count, seed=0):
+    """Cumulative Zipf distribution over products, with the popularity ranks shuffled"""
+
+    ranks = np.random.default_rng([seed, 3]).permutation(product_count) + 1
+    weights = 1 / ranks ** ZIPF_EXPONENT
+
+    return np.cumsum(weights / weights.sum())
+
+
+def generate_customers(rng, count, start=0):
+    """Customers with contact details, birth and registration dates"""
+
+    birth_days = day_strings("1950-01-01", "2005-12-31")
+    registration_days = day_strings("2020-01-01", ORDER_END)
+    ids = np.arange(start, start + count)
+
+    return pd.DataFrame({
+        'customer_id': numbered_ids("CUS-", count, start),
+        'first_name': take(FIRST_NAMES, rng.integers(0, len(FIRST_NAMES), count)),
+        'last_name': take(LAST_NAMES, rng.integers(0, len(LAST_NAMES), count)),
+        'email': "user" + digits(ids) + "@example.com",
+        'phone': "555-" + digits(rng.integers(0, 10_000_000, count), 7),
+        'date_of_birth': take(birth_days, rng.integers(0, len(birth_days), count)),
+        'gender': take(GENDERS, rng.integers(0, len(GENDERS), count)),
+        'address_line1': digits(rng.integers(1, 9999, count)) + " " + take(STREETS, rng.integers(0, len(STREETS), count)),
+        'address_line2': take([None, 'Apt. 1'], (rng.random(count) < 0.3).astype(np.int8)),
+        'city': take(CITIES, rng.integers(0, len(CITIES), count)),
+        'state': take(STATES, rng.integers(0, len(STATES), count)),
+        'postal_code': digits(rng.integers(0, 100_000, count), 5),
+        'country': take(COUNTRIES, rng.integers(0, len(COUNTRIES), count)),
+        'registration_date': take(registration_days, rng.integers(0, len(registration_days), count)),
+        'is_premium': bool_strings(rng.random(count) < 0.2),
+        'preferred_language': take(LANGUAGES, rng.integers(0, len(LANGUAGES), count)),
+        'marketing_consent': bool_strings(rng.random(count) < 0.6),
+    })
+
+
+def generate_products(rng, count):
+    """Products with prices, costs and catalogue attributes"""
+
+    categories = list(CATEGORIES)
+    category_codes = rng.integers(0, len(categories), count)
+
+    # Subcategories are listed category by category, four per category
+    subcategories = [name for category in categories for name in CATEGORIES[category]]
+    subcategory_names = take(subcategories, category_codes * 4 + rng.integers(0, 4, count))
+
+    price = np.round(rng.lognormal(mean=4.0, sigma=1.0, size=count), 2)
+    catalogue_days = day_strings("2022-01-01", ORDER_END)
+    created = rng.integers(0, len(catalogue_days), count)
+
+    return pd.DataFrame({
+        'product_id': numbered_ids("PRD-", count),
+        'product_name': (take(ADJECTIVES, rng.integers(0, len(ADJECTIVES), count)) + " " + subcategory_names),
+        'description': take(DESCRIPTIONS, rng.integers(0, len(DESCRIPTIONS), count)),
+        'category': take(categories, category_codes),
+        'subcategory': subcategory_names,
+        'brand': take(BRANDS, rng.integers(0, len(BRANDS), count)),
+        'price': price,
+        'cost': np.round(price * rng.uniform(0.4, 0.8, count), 2),
+        'weight_kg': np.round(rng.uniform(0.1, 20, count), 2),
+        'dimensions_cm': (digits(rng.integers(5, 100, count)) + "x" + digits(rng.integers(5, 100, count)) + "x" +
+                          digits(rng.integers(5, 100, count))),
+        'color': take(COLORS, rng.integers(0, len(COLORS), count)),
+        'material': take(MATERIALS, rng.integers(0, len(MATERIALS), count)),
+        'stock_quantity': rng.integers(0, 1000, count),
+        'is_active': bool_strings(rng.random(count) < 0.9),
+        'created_date': take(catalogue_days, created),
+        'last_updated': take(catalogue_days, np.minimum(created + rng.integers(0, 180, count), len(catalogue_days) - 1)),
+        'supplier_id': numbered_ids("SUP-", 500)[rng.integers(0, 500, count)],
+        'rating_avg': np.round(rng.uniform(1, 5, count), 2),
+        'review_count': rng.integers(0, 1000, count),
+    })
+
+
+def generate_orders(rng, start, count, customer_count, prices, popularity):
+    """Orders start .. start + count - 1 with their items and reviews
+
+    Identifiers only depend on the order numbers, so chunks generated
+    separately never collide and always refer to existing customers and products.
+    """
+
+    days = day_strings(ORDER_START, ORDER_END)
+    day_index = sample_index(rng, order_day_distribution(), count)
+    order_ids = numbered_ids("ORD-", count, start)
+
+    # Items are laid out order by order, so each order's items are a contiguous run
+    item_counts = rng.integers(1, MAX_ITEMS_PER_ORDER + 1, count)
+    item_order = np.repeat(np.arange(count), item_counts)
+    item_count = len(item_order)
+    item_position = np.arange(item_count) - np.repeat(np.cumsum(item_counts) - item_counts, item_counts)
+
+    product_index = sample_index(rng, popularity, item_count)
+    quantity = rng.integers(1, 6, item_count)
+    unit_price = prices[product_index]
+    discount_applied = rng.random(item_count) < 0.1
+    discount = np.where(discount_applied, np.round(unit_price * quantity * 0.1, 2), 0.0)
+
+    order_items = pd.DataFrame({
+        'order_item_id': format_ids("ITM-", (start + item_order) * MAX_ITEMS_PER_ORDER + item_position),
+        'order_id': order_ids[item_order],
+        'product_id': format_ids("PRD-", product_index),
+        'quantity': quantity,
+        'unit_price': unit_price,
+        'discount_applied': bool_strings(discount_applied),
+        'discount_amount': discount,
+    })
+
+    subtotal = np.round(np.bincount(item_order, weights=unit_price * quantity, minlength=count), 2)
+    discount_total = np.round(np.bincount(item_order, weights=discount, minlength=count), 2)
+    tax = np.round((subtotal - discount_total) * 0.08, 2)
+    shipping_cost = SHIPPING_COSTS[rng.integers(0, len(SHIPPING_COSTS), count)]
+
+    customer_ids = format_ids("CUS-", rng.integers(0, customer_count, count))
+    updated_day = np.minimum(day_index + rng.integers(0, 10, count), len(days) - 1)
+
+    orders = pd.DataFrame({
+        'order_id': order_ids,
+        'customer_id': customer_ids,
+        'order_date': take(days, day_index),
+        'order_status': take(ORDER_STATUSES, rng.integers(0, len(ORDER_STATUSES), count)),
+        'payment_method': take(PAYMENT_METHODS, rng.integers(0, len(PAYMENT_METHODS), count)),
+        'shipping_method': take(SHIPPING_METHODS, rng.integers(0, len(SHIPPING_METHODS), count)),
+        'shipping_address_line1': (digits(rng.integers(1, 9999, count)) + " " +
+                                   take(STREETS, rng.integers(0, len(STREETS), count))),
+        'shipping_address_line2': None,
+        'shipping_city': take(CITIES, rng.integers(0, len(CITIES), count)),
+        'shipping_state': take(STATES, rng.integers(0, len(STATES), count)),
+        'shipping_postal_code': digits(rng.integers(0, 100_000, count), 5),
+        'shipping_country': take(COUNTRIES, rng.integers(0, len(COUNTRIES), count)),
+        'billing_same_as_shipping': take(['False', 'True'], (rng.random(count) < 0.8).astype(np.int8)),
+        'discount_amount': discount_total,
+        'tax_amount': tax,
+        'shipping_cost': shipping_cost,
+        'total_amount': np.round(subtotal - discount_total + tax + shipping_cost, 2),
+        'notes': None,
+        'created_at': take(days, day_index) + " " + time_strings(rng, count),
+        'updated_at': take(days, updated_day) + " " + time_strings(rng, count),
+        'subtotal': subtotal,
+    })
+
+    # Reviews of ordered items, written up to a month after the order
+    review_start = round(start * REVIEWS_PER_ORDER)
+    review_count = round((start + count) * REVIEWS_PER_ORDER) - review_start
+    review_days = day_strings(ORDER_START, pd.Timestamp(ORDER_END) + pd.Timedelta(days=31))
+    reviewed = rng.integers(0, item_count, review_count)
+    reviewed_order = item_order[reviewed]
+    helpful = rng.integers(0, 50, review_count)
+
+    reviews = pd.DataFrame({
+        'review_id': numbered_ids("REV-", review_count, review_start),
+        'product_id': order_items['product_id'].array[reviewed],
+        'customer_id': customer_ids[reviewed_order],
+        'order_id': order_ids[reviewed_order],
+        'rating': rng.choice(np.arange(1, 6), size=review_count, p=RATING_WEIGHTS),
+        'title': take(REVIEW_TITLES, rng.integers(0, len(REVIEW_TITLES), review_count)),
+        'review_text': take(REVIEW_TEXTS, rng.integers(0, len(REVIEW_TEXTS), review_count)),
+        'is_verified_purchase': bool_strings(rng.random(review_count) < 0.85),
+        'helpful_votes': helpful,
+        'total_votes': helpful + rng.integers(0, 20, review_count),
+        'review_date': take(review_days, day_index[reviewed_order] + rng.integers(1, 31, review_count)),
+        'is_deleted': bool_strings(rng.random(review_count) < 0.02),
+    })
+
+    return {'orders': orders, 'order_items': order_items, 'reviews': reviews}
+
+
+def dataset_sizes(order_count):
+    """Customers and products generated for a given number of orders"""
+
+    return (max(1, int(order_count * CUSTOMERS_PER_ORDER)),
+            max(1, min(int(order_count * PRODUCTS_PER_ORDER), MAX_PRODUCTS)))
+
+
+# Set once per generator process so the product arrays are not pickled with every chunk
+_products = {}
+
+
+def init_worker(prices, popularity):
+    _products.update(prices=prices, popularity=popularity)
+
+
+def write_csv(df, path, header=True):
+    """Write a frame as CSV with pyarrow, several times faster than DataFrame.to_csv"""
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pa_csv.write_csv(table, path, pa_csv.WriteOptions(include_header=header))
+
+    return {'rows': len(df), 'bytes': path.stat().st_size}
+
+
+def write_part(df, parts_dir, dataset_name, chunk_index):
+    """Write one chunk of a dataset; only the first chunk carries the header"""
+
+    return write_csv(df, parts_dir / dataset_name / f"{chunk_index:06d}.csv", header=chunk_index == 0)
+
+
+def write_customer_chunk(parts_dir, seed, chunk_index, start, count):
+    """Generate and write customers start .. start + count - 1"""
+
+    rng = np.random.default_rng([seed, 0, chunk_index])
+
+    return {'customers': write_part(generate_customers(rng, count, start), parts_dir, 'customers', chunk_index)}
+
+
+def write_order_chunk(parts_dir, seed, chunk_index, start, count, customer_count):
+    """Generate and write one chunk of orders, order items and reviews"""
+
+    rng = np.random.default_rng([seed, 1, chunk_index])
+    datasets = generate_orders(rng, start, count, customer_count, _products['prices'], _products['popularity'])
+
+    return {name: write_part(df, parts_dir, name, chunk_index) for name, df in datasets.items()}
+
+
+def join_parts(parts_dir, folder, dataset_name):
+    """Concatenate a dataset's parts, in chunk order, into <folder>/<dataset>.csv"""
+
+    path = folder / f"{dataset_name}.csv"
+    partial = path.with_suffix(".csv.partial")
+
+    with open(partial, "wb") as out:
+        for part in sorted((parts_dir / dataset_name).iterdir()):
+            with open(part, "rb") as f:
+                shutil.copyfileobj(f, out, 16 * 1024 * 1024)
+
+    os.replace(partial, path)
+
+    return path
+
+
+def write_raw_datasets(order_count, folder, chunk_orders=None, max_workers=None, seed=0, log=print):
+    """Generate the five raw datasets for order_count orders as CSV files in folder
+
+    Returns dataset name -> rows and bytes written.
+    """
+
+    chunk_orders = chunk_orders or CHUNK_ORDERS
+    max_workers = max_workers or GENERATOR_WORKERS
+    customer_count, product_count = dataset_sizes(order_count)
+
+    folder.mkdir(parents=True, exist_ok=True)
+    parts_dir = folder / ".parts"
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    for dataset_name in ['customers', 'orders', 'order_items', 'reviews']:
+        (parts_dir / dataset_name).mkdir(parents=True)
+
+    # Products are small (at most MAX_PRODUCTS) and every chunk needs their prices
+    products = generate_products(np.random.default_rng([seed, 2]), product_count)
+    totals = {'products': write_csv(products, folder / "products.csv")}
+
+    prices = products['price'].to_numpy()
+    popularity = product_popularity(product_count, seed)
+    del products
+
+    chunks = [('customers', start, min(chunk_orders, customer_count - start))
+              for start in range(0, customer_count, chunk_orders)]
+    chunks += [('orders', start, min(chunk_orders, order_count - start))
+               for start in range(0, order_count, chunk_orders)]
+
+    log(f"Generating {order_count:,} orders in {len(chunks)} chunks with {max_workers} processes...")
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                             initargs=(prices, popularity)) as pool:
+        futures = []
+        for kind, start, count in chunks:
+            chunk_index = start // chunk_orders
+            if kind == 'customers':
+                futures.append(pool.submit(write_customer_chunk, parts_dir, seed, chunk_index, start, count))
+            else:
+                futures.append(pool.submit(write_order_chunk, parts_dir, seed, chunk_index, start, count,
+                                           customer_count))
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            for dataset_name, written in future.result().items():
+                total = totals.setdefault(dataset_name, {'rows': 0, 'bytes': 0})
+                total['rows'] += written['rows']
+                total['bytes'] += written['bytes']
+            log(f"Chunk {done}/{len(chunks)} written")
+
+    # Each dataset's parts are joined by its own thread; the copies are plain file I/O
+    with ThreadPoolExecutor(max_workers=4) as joiners:
+        list(joiners.map(lambda name: join_parts(parts_dir, folder, name),
+                         ['customers', 'orders', 'order_items', 'reviews']))
+    shutil.rmtree(parts_dir)
+
+    for dataset_name, total in totals.items():
+        log(f"Wrote {dataset_name}.csv: {total['rows']:,} rows, {total['bytes'] / 1024 ** 2:.1f} MB")
+
+    return totals
@@ -0,0 +1,259 @@
+"""
+Concurrent multipart uploads of local files to S3, and their verification.
+
+All files go through one shared transfer manager, so S3_UPLOAD_WORKERS bounds
+the parts in flight across every file and S3_MAX_BANDWIDTH_MB caps the
+combined rate rather than each file on its own.
+
+Each file is hashed just before it is handed to the transfer manager (the next
+file is hashed while the previous ones upload). The SHA-256 goes into the
+object metadata, S3 is asked to store its own SHA-256 checksum, and both end up
+in a local upload manifest. Files whose SHA-256 matches the metadata of the
+object already in S3 are not uploaded again. Verification lists the prefix and
+compares sizes and checksums against that manifest with HEAD requests only.
+
+The manifest is run state, kept per bucket under PIPELINE_UPLOAD_MANIFEST_DIR
+(prefect-storage/uploads), never in the source data folder.
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from s3transfer.subscribers import BaseSubscriber
+from s3transfer.utils import ChunksizeAdjuster
+
+from pipeline_utils.s3_io import SKIP_UNCHANGED, remote_metadata
+
+
+MB = 1024 * 1024
+
+UPLOAD_WORKERS = int(os.getenv('S3_UPLOAD_WORKERS', 8))
+MULTIPART_THRESHOLD_BYTES = int(float(os.getenv('S3_MULTIPART_THRESHOLD_MB', 8)) * MB)
+MULTIPART_CHUNK_BYTES = int(float(os.getenv('S3_MULTIPART_CHUNK_MB', 8)) * MB)
+
+# Combined upload rate in MB/s, unlimited when unset
+MAX_BANDWIDTH_BYTES = int(float(os.getenv('S3_MAX_BANDWIDTH_MB', 0)) * MB) or None
+
+UPLOAD_MANIFEST_DIR = Path(os.getenv('PIPELINE_UPLOAD_MANIFEST_DIR', "prefect-storage/uploads"))
+
+
+def transfer_config(max_workers=None):
+    """Transfer settings for uploads: worker threads, multipart threshold and part size, bandwidth cap"""
+
+    return TransferConfig(multipart_threshold=MULTIPART_THRESHOLD_BYTES,
+                          multipart_chunksize=MULTIPART_CHUNK_BYTES,
+                          max_concurrency=max_workers or UPLOAD_WORKERS,
+                          max_bandwidth=MAX_BANDWIDTH_BYTES,
+                          use_threads=True)
+
+
+class UploadTimer(BaseSubscriber):
+    """Record when a transfer started moving bytes and when it finished"""
+
+    def __init__(self):
+        self.started = None
+        self.finished = None
+
+    def on_progress(self, future, bytes_transferred, **kwargs):
+        if self.started is None:
+            self.started = time.perf_counter()
+
+    def on_done(self, future, **kwargs):
+        self.finished = time.perf_counter()
+
+    def seconds(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+def throughput(size_bytes, seconds):
+    """MB/s, guarding against transfers too quick to time"""
+
+    return size_bytes / MB / seconds if seconds > 0 else float('inf')
+
+
+def file_checksums(path):
+    """Size, SHA-256 and the SHA-256 checksum S3 will report for a file, in one read
+
+    Multipart objects get a checksum of the part checksums, so the parts are
+    hashed with the same part size the transfer manager will use.
+    """
+
+    size_bytes = path.stat().st_size
+    part_size = ChunksizeAdjuster().adjust_chunksize(MULTIPART_CHUNK_BYTES, size_bytes)
+
+    whole = hashlib.sha256()
+    part_digests = []
+    with open(path, "rb") as f:
+        while block := f.read(part_size):
+            whole.update(block)
+            part_digests.append(hashlib.sha256(block).digest())
+
+    if size_bytes >= MULTIPART_THRESHOLD_BYTES:
+        combined = base64.b64encode(hashlib.sha256(b"".join(part_digests)).digest()).decode()
+        s3_checksum = f"{combined}-{len(part_digests)}"
+    else:
+        s3_checksum = base64.b64encode(whole.digest()).decode()
+
+    return {'size': size_bytes, 'sha256': whole.hexdigest(), 'checksum_sha256': s3_checksum}
+
+
+def upload_files(s3, files, bucket_name, prefix, max_workers=None, skip_unchanged=SKIP_UNCHANGED, log=print):
+    """Upload local files concurrently, logging per-file and overall throughput
+
+    Returns the upload manifest of the files now in S3: S3 key -> size and checksums.
+    """
+
+    manifest = {}
+    total_bytes = 0
+    skipped = 0
+    started = time.perf_counter()
+    max_workers = max_workers or UPLOAD_WORKERS
+
+    def prepare(path):
+        checksums = file_checksums(path)
+        remote = remote_metadata(s3, bucket_name, f"{prefix}{path.name}") if skip_unchanged else None
+        return checksums, (remote or {}).get('sha256') == checksums['sha256']
+
+    with create_transfer_manager(s3, transfer_config(max_workers)) as manager, \
+            ThreadPoolExecutor(max_workers=max_workers) as hashers:
+
+        # Hand each file to the transfer manager as soon as its checksums are ready
+        hashing = {hashers.submit(prepare, path): path for path in files}
+        transfers = []
+        for future in as_completed(hashing):
+            path = hashing[future]
+            checksums, unchanged = future.result()
+
+            if unchanged:
+                manifest[f"{prefix}{path.name}"] = checksums
+                skipped += 1
+                log(f"Skipped {path.name}: unchanged since the last upload")
+                continue
+
+            timer = UploadTimer()
+            extra_args = {'ChecksumAlgorithm': 'SHA256', 'Metadata': {'sha256': checksums['sha256']}}
+            upload = manager.upload(str(path), bucket_name, f"{prefix}{path.name}",
+                                    extra_args=extra_args, subscribers=[timer])
+            transfers.append((path, checksums, upload, timer))
+
+        for path, checksums, upload, timer in transfers:
+            s3_key = f"{prefix}{path.name}"
+            try:
+                upload.result()
+            except Exception as upload_error:
+                log(f"ERROR: Failed to upload {path.name}: {upload_error}")
+                continue
+
+            total_bytes += checksums['size']
+            manifest[s3_key] = checksums
+            log(f"SUCCESS: Uploaded to s3://{bucket_name}/{s3_key} "
+                f"({checksums['size'] / MB:.2f} MB in {timer.seconds():.2f}s, "
+                f"{throughput(checksums['size'], timer.seconds()):.2f} MB/s)")
+
+    elapsed = time.perf_counter() - started
+    log(f"Uploaded {len(manifest) - skipped}/{len(files)} files ({skipped} unchanged), "
+        f"{total_bytes / MB:.2f} MB in {elapsed:.2f}s "
+        f"({throughput(total_bytes, elapsed):.2f} MB/s with {max_workers} workers)")
+
+    return manifest
+
+
+def upload_manifest_path(bucket_name):
+    """Where the upload manifest of a bucket is kept"""
+
+    return UPLOAD_MANIFEST_DIR / f"{bucket_name}.json"
+
+
+def save_upload_manifest(bucket_name, manifest):
+    """Merge newly uploaded files into the bucket's upload manifest"""
+
+    path = upload_manifest_path(bucket_name)
+    stored = load_upload_manifest(bucket_name)
+    stored.update(manifest)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(stored, indent=2, sort_keys=True))
+
+
+def load_upload_manifest(bucket_name):
+    """Manifest of files previously uploaded to a bucket, empty if there is none"""
+
+    path = upload_manifest_path(bucket_name)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def list_objects(s3, bucket_name, prefix, max_workers=None):
+    """Every object under a prefix, listing its sub-prefixes at the same time
+
+    Returns S3 key -> object summary (Size, ETag, ...).
+    """
+
+    paginator = s3.get_paginator('list_objects_v2')
+
+    def list_pages(list_prefix, delimiter=None):
+        kwargs = {'Bucket': bucket_name, 'Prefix': list_prefix}
+        if delimiter:
+            kwargs['Delimiter'] = delimiter
+
+        objects, sub_prefixes = {}, []
+        for page in paginator.paginate(**kwargs):
+            objects.update({obj['Key']: obj for obj in page.get('Contents', [])})
+            sub_prefixes.extend(common['Prefix'] for common in page.get('CommonPrefixes', []))
+        return objects, sub_prefixes
+
+    # One delimited listing finds the sub-prefixes, which are then listed in parallel
+    objects, sub_prefixes = list_pages(prefix, delimiter="/")
+    if sub_prefixes:
+        with ThreadPoolExecutor(max_workers=max_workers or UPLOAD_WORKERS) as pool:
+            for listed, _ in pool.map(list_pages, sub_prefixes):
+                objects.update(listed)
+
+    return objects
+
+
+def checksum_matches(s3, bucket_name, s3_key, expected):
+    """Compare an object's stored checksums with the manifest entry using a HEAD request"""
+
+    head = s3.head_object(Bucket=bucket_name, Key=s3_key, ChecksumMode='ENABLED')
+
+    if head.get('ChecksumSHA256'):
+        # Some endpoints drop the "-<parts>" suffix of multipart checksums
+        return head['ChecksumSHA256'].split("-")[0] == expected['checksum_sha256'].split("-")[0]
+
+    return head.get('Metadata', {}).get('sha256') == expected['sha256']
+
+
+def verify_objects(s3, bucket_name, manifest, prefix, max_workers=None, log=print):
+    """Check that every object in the manifest exists with the recorded size and checksum
+
+    Returns a dict of problems: S3 key -> description. Empty means all verified.
+    """
+
+    listed = list_objects(s3, bucket_name, prefix, max_workers)
+    problems = {}
+
+    for s3_key, expected in manifest.items():
+        if s3_key not in listed:
+            problems[s3_key] = "missing"
+        elif listed[s3_key]['Size'] != expected['size']:
+            problems[s3_key] = f"size {listed[s3_key]['Size']} != {expected['size']}"
+
+    to_check = [s3_key for s3_key in manifest if s3_key not in problems]
+    with ThreadPoolExecutor(max_workers=max_workers or UPLOAD_WORKERS) as pool:
+        results = pool.map(lambda s3_key: checksum_matches(s3, bucket_name, s3_key, manifest[s3_key]), to_check)
+        for s3_key, matches in zip(to_check, results):
+            if not matches:
+                problems[s3_key] = "checksum mismatch"
+
+    for s3_key, problem in problems.items():
+        log(f"ERROR: s3://{bucket_name}/{s3_key}: {problem}")
+
+    log(f"Verified {len(manifest) - len(problems)}/{len(manifest)} objects against the upload manifest")
+
+    return problems
@@ -0,0 +1,167 @@
+"""
+Benchmark process_ecommerce_data against an in-memory S3 (moto).
+
+Synthetic raw files with 10K, 1M or 10M orders are uploaded to a mocked bucket
+and the processing script runs on them end to end. Its instrumented steps
+report their wall and CPU time, rows per second, peak RSS and the bytes they
+read from and wrote to S3.
+
+Run it from data-pipeline/ with the dev requirements, which add moto:
+
+    pip install -r requirements-dev.txt
+    python tests/benchmark_pipeline.py --scale 10k 1m --output reports/benchmark.json
+
+The steps run one after another so every number belongs to a single step.
+--staged benchmarks the overlapping asyncio runner instead: total time, peak
+RSS and the run's S3 bytes are then what matters, since the steps share the
+wall clock and their own byte counts are left blank.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+from moto import mock_aws
+
+# Make the shared helpers in src/ importable when this file is run directly
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from data_processing import data_processing
+from pipeline_utils.clients import s3_client
+from pipeline_utils.instrumentation import (instrumented, rss_sampler, s3_bytes, step_metrics,
+                                            summarize_step_metrics)
+from pipeline_utils.profiling import profiled
+from pipeline_utils.synthetic import write_raw_datasets
+
+
+SCALES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+
+# Helpers the script calls between its instrumented steps, measured here as well
+EXTRA_STEPS = ['clean_in_chunks', 'fold_order_aggregates']
+
+MB = 1024 * 1024
+REGION = "us-east-1"
+
+
+def empty_bucket(s3, bucket_name):
+    """Delete every object so the next scale starts from a clean, small mock"""
+
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name):
+        keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if keys:
+            s3.delete_objects(Bucket=bucket_name, Delete={'Objects': keys})
+    s3.delete_bucket(Bucket=bucket_name)
+
+
+def run_scale(scale, order_count, s3, seed=0, verbose=False):
+    """Generate, upload and process one scale; returns its measurements"""
+
+    bucket_name = f"benchmark-{scale}"
+    os.environ['AWS_S3_BUCKET_NAME'] = bucket_name
+    s3.create_bucket(Bucket=bucket_name)
+
+    print(f"\nScale {scale}: generating {order_count:,} orders...")
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as folder:
+        totals = write_raw_datasets(order_count, Path(folder), seed=seed, log=lambda message: None)
+        for dataset_name in totals:
+            s3.upload_file(f"{folder}/{dataset_name}.csv", bucket_name, f"raw-data/{dataset_name}.csv")
+
+    rows = {name: written['rows'] for name, written in totals.items()}
+    raw_bytes = sum(written['bytes'] for written in totals.values())
+    print(f"Generated and uploaded {raw_bytes / MB:.1f} MB of raw CSV in {time.perf_counter() - started:.1f}s")
+
+    sampler = rss_sampler()
+    window = sampler.open()
+    read_before, written_before = s3_bytes.snapshot()
+    started = time.perf_counter()
+
+    with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+        success = data_processing.process_ecommerce_data()
+
+    seconds = time.perf_counter() - started
+    peak = sampler.close(window)
+    read_after, written_after = s3_bytes.snapshot()
+    steps = summarize_step_metrics(step_metrics())
+
+    empty_bucket(s3, bucket_name)
+
+    return {
+        'scale': scale,
+        'orders': order_count,
+        'rows': rows,
+        'raw_bytes': raw_bytes,
+        'success': success,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(sum(rows.values()) / seconds) if seconds else None,
+        'peak_rss_mb': round(peak / MB, 1),
+        'bytes_read': read_after - read_before,
+        'bytes_written': written_after - written_before,
+        'steps': steps,
+    }
+
+
+def megabytes(size):
+    """Bytes as MB for the step table; '-' where overlapping steps shared them"""
+
+    return "-" if size is None else f"{size / MB:.1f}"
+
+
+def print_result(result):
+    """One summary line per scale and one row per step"""
+
+    status = "ok" if result['success'] else "FAILED"
+    print(f"Scale {result['scale']} ({status}): {result['seconds']:.2f}s, "
+          f"{result['rows_per_second'] or 0:,} rows/s, peak RSS {result['peak_rss_mb']:.0f} MB, "
+          f"read {result['bytes_read'] / MB:.1f} MB, wrote {result['bytes_written'] / MB:.1f} MB")
+
+    print(f"  {'step':<26}{'calls':>6}{'seconds':>10}{'cpu s':>8}{'rows/s':>14}{'peak MB':>10}"
+          f"{'read MB':>10}{'wrote MB':>10}")
+    for name, step in result['steps'].items():
+        # A step's work is whichever side holds the data: what it is given or what it returns
+        rows = max(step['rows_in'], step['rows_out'])
+        rows_per_second = round(rows / step['wall_seconds']) if step['wall_seconds'] else 0
+        print(f"  {name:<26}{step['calls']:>6}{step['wall_seconds']:>10.2f}{step['cpu_seconds']:>8.2f}"
+              f"{rows_per_second:>14,}{step['peak_rss_mb']:>10.0f}"
+              f"{megabytes(step['s3_bytes_read']):>10}{megabytes(step['s3_bytes_written']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data processing pipeline on synthetic data")
+    parser.add_argument("--scale", nargs="+", choices=SCALES, default=['10k'], help="Order counts to run")
+    parser.add_argument("--output", type=Path, help="Write the measurements to this JSON file")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic data")
+    parser.add_argument("--staged", action="store_true", help="Benchmark the overlapping asyncio runner")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own log")
+    args = parser.parse_args()
+
+    os.environ.update(AWS_ACCESS_KEY_ID="benchmark", AWS_SECRET_ACCESS_KEY="benchmark",
+                      AWS_DEFAULT_REGION=REGION, PIPELINE_STAGED=str(args.staged).lower())
+
+    for name in EXTRA_STEPS:
+        setattr(data_processing, name, instrumented(profiled(getattr(data_processing, name))))
+
+    results = []
+    with mock_aws():
+        s3 = s3_client(REGION)
+        for scale in args.scale:
+            result = run_scale(scale, SCALES[scale], s3, args.seed, args.verbose)
+            print_result(result)
+            results.append(result)
+
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps({'staged': args.staged, 'results': results}, indent=2))
+        print(f"\nWrote {args.output}")
+
+    return all(result['success'] for result in results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
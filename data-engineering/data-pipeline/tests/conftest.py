@@ -0,0 +1,52 @@
+"""
+Shared pytest fixtures: the helpers in src/ on the path, an in-memory S3
+bucket (moto) and small synthetic raw datasets uploaded to it.
+"""
+
+import sys
+from pathlib import Path
+
+import boto3
+import pytest
+from moto import mock_aws
+
+# Make the shared helpers in src/ importable, as the scripts do when run directly
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from pipeline_utils.synthetic import write_raw_datasets
+
+
+BUCKET = "pipeline-test"
+REGION = "us-east-1"
+
+# The AWS connection check runs against real credentials and is run directly (README, Step 2)
+collect_ignore = ["test_aws_connection.py"]
+
+
+@pytest.fixture
+def s3(monkeypatch, tmp_path):
+    """A mocked S3 client with an empty bucket; the test runs in its own directory"""
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', "test")
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', "test")
+    monkeypatch.setenv('AWS_DEFAULT_REGION', REGION)
+    monkeypatch.setenv('AWS_S3_BUCKET_NAME', BUCKET)
+    monkeypatch.setenv('PIPELINE_CACHE', "false")
+    # Local artifacts, checkpoints and reports land under tmp_path
+    monkeypatch.chdir(tmp_path)
+
+    with mock_aws():
+        client = boto3.client("s3", region_name=REGION)
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def raw_data(s3, tmp_path):
+    """A few hundred synthetic orders and their related datasets under raw-data/"""
+
+    folder = tmp_path / "raw"
+    write_raw_datasets(300, folder, max_workers=1, seed=1, log=lambda message: None)
+    for path in folder.glob("*.csv"):
+        s3.upload_file(str(path), BUCKET, f"raw-data/{path.name}")
+    return folder
@@ -0,0 +1,152 @@
+"""Partial aggregates and folding orders into the stored state incrementally"""
+
+import pandas as pd
+import pytest
+
+from conftest import BUCKET
+from pipeline_utils.aggregates import (CUSTOMER_AGGREGATES, MONTHLY_AGGREGATES, SpillingAggregator,
+                                       fold_order_aggregates, merge_partials, partial_aggregate)
+
+
+def make_orders(rows):
+    """Cleaned orders from (order_id, customer_id, total_amount, created_at) tuples"""
+
+    orders = pd.DataFrame(rows, columns=['order_id', 'customer_id', 'total_amount', 'created_at'])
+    orders['order_date'] = pd.to_datetime(orders['created_at']).dt.normalize()
+    orders['order_year'] = orders['order_date'].dt.year
+    orders['order_month'] = orders['order_date'].dt.month
+    return orders
+
+
+ORDERS = make_orders([
+    ("o1", "c1", 10.0, "2025-01-05 10:00:00"),
+    ("o2", "c2", 20.0, "2025-01-20 11:00:00"),
+    ("o3", "c1", 30.0, "2025-02-03 09:00:00"),
+    ("o4", "c3", 40.0, "2025-02-10 12:00:00"),
+])
+
+
+def sort(frame, keys):
+    return frame.sort_values(keys).reset_index(drop=True)
+
+
+def assert_matches_full_fold(folded, orders):
+    """An incremental fold gives the same partials as folding every order from scratch"""
+
+    expected = {'customer': partial_aggregate(orders, 'customer_id', CUSTOMER_AGGREGATES),
+                'monthly': partial_aggregate(orders, ['order_year', 'order_month'], MONTHLY_AGGREGATES)}
+
+    pd.testing.assert_frame_equal(sort(folded['customer'], 'customer_id'),
+                                  sort(expected['customer'], 'customer_id'), check_dtype=False)
+    pd.testing.assert_frame_equal(sort(folded['monthly'], ['order_year', 'order_month']),
+                                  sort(expected['monthly'], ['order_year', 'order_month']), check_dtype=False)
+
+
+def fold(s3, orders, messages=None, **kwargs):
+    log = messages.append if messages is not None else (lambda message: None)
+    return fold_order_aggregates(s3, BUCKET, orders, log=log, **kwargs)
+
+
+def test_merge_partials_combines_batches():
+    first, second = ORDERS.iloc[:2], ORDERS.iloc[2:]
+    merged = merge_partials([partial_aggregate(first, 'customer_id', CUSTOMER_AGGREGATES),
+                             partial_aggregate(second, 'customer_id', CUSTOMER_AGGREGATES)],
+                            ['customer_id'], CUSTOMER_AGGREGATES)
+
+    c1 = merged.set_index('customer_id').loc["c1"]
+    assert c1['total_spent'] == 40.0
+    assert c1['order_count'] == 2
+    assert c1['first_order'] == pd.Timestamp("2025-01-05")
+    assert c1['last_order'] == pd.Timestamp("2025-02-03")
+
+
+def test_spilling_aggregator_matches_in_memory_fold(tmp_path, monkeypatch):
+    monkeypatch.setattr('pipeline_utils.aggregates.SPILL_DIR', str(tmp_path))
+    spilling = SpillingAggregator('customer_id', CUSTOMER_AGGREGATES, max_keys=1)
+    in_memory = SpillingAggregator('customer_id', CUSTOMER_AGGREGATES)
+
+    for _, row in ORDERS.iterrows():
+        partial = partial_aggregate(row.to_frame().T.infer_objects(), 'customer_id', CUSTOMER_AGGREGATES)
+        spilling.add(partial)
+        in_memory.add(partial)
+
+    pd.testing.assert_frame_equal(sort(spilling.result(), 'customer_id'), sort(in_memory.result(), 'customer_id'),
+                                  check_dtype=False)
+    assert not list(tmp_path.iterdir())
+
+
+def test_appended_orders_are_folded_incrementally(s3):
+    fold(s3, ORDERS.iloc[:3])
+
+    messages = []
+    folded = fold(s3, ORDERS, messages)
+
+    assert "Folding 1 new orders into stored aggregates" in messages
+    assert_matches_full_fold(folded, ORDERS)
+
+
+def test_unchanged_orders_fold_nothing(s3):
+    fold(s3, ORDERS)
+
+    messages = []
+    folded = fold(s3, ORDERS, messages)
+
+    assert messages == ["Folding 0 new orders into stored aggregates"]
+    assert_matches_full_fold(folded, ORDERS)
+
+
+def test_deleted_orders_trigger_a_full_refold(s3):
+    fold(s3, ORDERS)
+    remaining = ORDERS[ORDERS['order_id'] != "o2"]
+
+    messages = []
+    folded = fold(s3, remaining, messages)
+
+    assert any("folding every order again" in message for message in messages)
+    assert_matches_full_fold(folded, remaining)
+    # The refolded state is stored, so the next run is incremental again
+    messages.clear()
+    fold(s3, remaining, messages)
+    assert messages == ["Folding 0 new orders into stored aggregates"]
+
+
+def test_amended_order_triggers_a_full_refold(s3):
+    fold(s3, ORDERS)
+    amended = ORDERS.copy()
+    amended.loc[amended['order_id'] == "o1", 'total_amount'] = 15.0
+
+    assert_matches_full_fold(fold(s3, amended), amended)
+
+
+def test_order_created_at_the_watermark_is_not_dropped(s3):
+    fold(s3, ORDERS)
+    # Arrives late with the same created_at as the newest order already folded
+    tie = pd.concat([ORDERS, make_orders([("o5", "c2", 50.0, "2025-02-10 12:00:00")])], ignore_index=True)
+
+    assert_matches_full_fold(fold(s3, tie), tie)
+
+
+def test_backfilled_order_is_not_dropped(s3):
+    fold(s3, ORDERS)
+    backfilled = pd.concat([ORDERS, make_orders([("o0", "c3", 5.0, "2024-12-31 08:00:00")])], ignore_index=True)
+
+    assert_matches_full_fold(fold(s3, backfilled), backfilled)
+
+
+def test_replayed_order_is_counted_once(s3):
+    fold(s3, ORDERS.iloc[:3])
+    replayed = pd.concat([ORDERS, ORDERS.iloc[[3]]], ignore_index=True)
+
+    assert_matches_full_fold(fold(s3, replayed), ORDERS)
+
+
+def test_chunks_are_read_again_for_a_refold(s3):
+    fold(s3, ORDERS)
+    remaining = ORDERS.iloc[1:]
+    chunks = [remaining.iloc[:2], remaining.iloc[2:]]
+
+    with pytest.raises(ValueError):
+        fold(s3, iter(chunks))
+
+    folded = fold(s3, iter(chunks), reread=lambda: iter(chunks))
+    assert_matches_full_fold(folded, remaining)
@@ -0,0 +1,106 @@
+"""The content cache policy and least-recently-used eviction of the local artifact cache"""
+
+import os
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from prefect.filesystems import LocalFileSystem
+from prefect.results import ResultStore
+
+from pipeline_utils import cache
+from pipeline_utils.artifacts import save_dataset
+
+
+def clean(dataset_name, dataset):
+    return dataset
+
+
+@pytest.fixture
+def task_ctx(tmp_path, monkeypatch):
+    """What the policy reads from Prefect's task run context: the task and a result store under CACHE_DIR"""
+
+    monkeypatch.setenv('PIPELINE_CACHE', "true")
+    monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path / "cache")
+    store = ResultStore(result_storage=LocalFileSystem(basepath=str(tmp_path / "cache")))
+    return SimpleNamespace(task=SimpleNamespace(fn=clean, name="clean_dataset"), result_store=store)
+
+
+def compute_key(task_ctx, **inputs):
+    return cache.CONTENT_CACHE.compute_key(task_ctx=task_ctx, inputs=inputs, flow_parameters={})
+
+
+def test_cache_key_follows_the_content_of_the_inputs(task_ctx, tmp_path):
+    handle = save_dataset("orders", pd.DataFrame({'order_id': ["o1"]}), str(tmp_path / "artifacts"))
+    changed = save_dataset("orders", pd.DataFrame({'order_id': ["o2"]}), str(tmp_path / "artifacts"))
+
+    key = compute_key(task_ctx, dataset_name="orders", dataset=handle)
+
+    assert compute_key(task_ctx, dataset_name="orders", dataset=handle) == key
+    assert compute_key(task_ctx, dataset_name="orders", dataset=changed) != key
+
+
+def test_cache_can_be_turned_off(task_ctx, monkeypatch):
+    monkeypatch.setenv('PIPELINE_CACHE', "false")
+
+    assert compute_key(task_ctx, dataset_name="orders", dataset=None) is None
+
+
+def test_results_whose_artifacts_were_evicted_are_dropped(task_ctx, tmp_path):
+    handle = save_dataset("orders_clean", pd.DataFrame({'order_id': ["o1"]}), str(tmp_path / "artifacts"))
+    key = compute_key(task_ctx, dataset_name="orders", dataset=None)
+    task_ctx.result_store.write(obj=handle, key=key)
+
+    assert compute_key(task_ctx, dataset_name="orders", dataset=None) == key
+    assert task_ctx.result_store.exists(key)
+
+    os.remove(handle.uri)
+    compute_key(task_ctx, dataset_name="orders", dataset=None)
+    assert not task_ctx.result_store.exists(key)
+
+
+@pytest.fixture
+def artifacts(tmp_path, monkeypatch):
+    """Three 1 KB artifacts, used an hour, a minute and a second ago"""
+
+    monkeypatch.setattr(cache, 'CACHE_DIR', tmp_path / "cache")
+    artifact_dir = tmp_path / "artifacts"
+    artifact_dir.mkdir()
+
+    paths = []
+    for name, age in [("old", 3600), ("recent", 60), ("newest", 1)]:
+        path = artifact_dir / f"{name}.parquet"
+        path.write_bytes(b"x" * 1024)
+        os.utime(path, (time.time() - age, time.time() - age))
+        paths.append(path)
+
+    return artifact_dir, paths
+
+
+def test_least_recently_used_artifacts_are_evicted_first(artifacts):
+    artifact_dir, (old, recent, newest) = artifacts
+
+    assert cache.evict_lru(max_bytes=2048, artifact_dir=str(artifact_dir)) == 1
+    assert not old.exists() and recent.exists() and newest.exists()
+
+
+def test_artifacts_used_by_the_current_run_are_kept(artifacts):
+    artifact_dir, (old, recent, newest) = artifacts
+
+    assert cache.evict_lru(max_bytes=0, artifact_dir=str(artifact_dir), used_since=time.time() - 120) == 1
+    assert not old.exists() and recent.exists() and newest.exists()
+
+
+@pytest.mark.skipif(cache.fcntl is None, reason="file locks are not available")
+def test_nothing_is_evicted_while_another_run_holds_a_lease(artifacts):
+    artifact_dir, paths = artifacts
+
+    other_run = cache.lease_cache()
+    try:
+        assert cache.evict_lru(max_bytes=0, artifact_dir=str(artifact_dir)) == 0
+        assert all(path.exists() for path in paths)
+    finally:
+        cache.release_cache(other_run)
+
+    assert cache.evict_lru(max_bytes=0, artifact_dir=str(artifact_dir)) == 3
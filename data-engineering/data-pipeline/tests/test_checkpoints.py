@@ -0,0 +1,97 @@
+"""Stage checkpoints and resuming a failed run from the last stage it completed"""
+
+import os
+import re
+
+import pandas as pd
+import pytest
+
+from conftest import BUCKET
+from data_processing import data_processing
+from pipeline_utils import s3_io
+from pipeline_utils.artifacts import DatasetHandle, load_dataset, save_dataset
+from pipeline_utils.checkpoints import checkpoint_dataset, checkpoint_uri, load_checkpoint, save_checkpoint, start_run
+
+
+FRAME = pd.DataFrame({'order_id': ["o1", "o2"], 'total_amount': [10.0, 20.0]})
+
+
+def checkpoint_keys(s3):
+    return [obj['Key'] for obj in s3.list_objects_v2(Bucket=BUCKET, Prefix="checkpoints/").get('Contents', [])]
+
+
+def test_checkpoints_default_to_the_pipeline_bucket(s3, monkeypatch):
+    assert checkpoint_uri() == f"s3://{BUCKET}/checkpoints"
+
+    monkeypatch.setenv('PIPELINE_CHECKPOINT_URI', "scratch/checkpoints")
+    assert checkpoint_uri() == "scratch/checkpoints"
+
+
+def test_artifacts_in_s3_are_recorded_not_copied(s3):
+    handle = save_dataset('orders_clean', FRAME, f"s3://{BUCKET}/artifacts")
+
+    assert checkpoint_dataset('orders_clean', handle, f"s3://{BUCKET}/checkpoints/run/clean") == handle
+    assert checkpoint_keys(s3) == []
+
+
+def test_local_artifacts_are_linked_into_a_local_checkpoint(tmp_path):
+    handle = save_dataset('orders_clean', FRAME, str(tmp_path / "artifacts"))
+
+    checkpointed = checkpoint_dataset('orders_clean', handle, str(tmp_path / "checkpoints" / "run" / "clean"))
+
+    assert os.path.samefile(checkpointed.uri, handle.uri)
+    # Evicting the artifact does not lose the checkpoint
+    os.remove(handle.uri)
+    pd.testing.assert_frame_equal(pd.read_parquet(checkpointed.uri), FRAME)
+
+
+def test_stage_datasets_round_trip_through_s3(s3, tmp_path):
+    start_run("run-1", {'changed': [], 'outputs': {'orders_clean'}, 'inputs': ['orders']}, {})
+    save_checkpoint("run-1", 'clean', {'orders_clean': FRAME})
+
+    handles = load_checkpoint("run-1", 'clean', tmp_path / "chunks")
+
+    assert isinstance(handles['orders_clean'], DatasetHandle)
+    assert handles['orders_clean'].uri.startswith(f"s3://{BUCKET}/checkpoints/run-1/clean/")
+
+
+def test_large_checkpoints_are_read_in_ranges(s3, tmp_path, monkeypatch):
+    start_run("run-1", {'changed': [], 'outputs': {'orders_clean'}, 'inputs': ['orders']}, {})
+    save_checkpoint("run-1", 'clean', {'orders_clean': FRAME})
+
+    # Every object is over the threshold, so it is read through the ranged reader
+    monkeypatch.setattr(s3_io, 'STREAM_THRESHOLD_BYTES', 0)
+    handles = load_checkpoint("run-1", 'clean', tmp_path / "chunks")
+
+    pd.testing.assert_frame_equal(load_dataset(handles['orders_clean']), FRAME)
+
+
+@pytest.mark.parametrize("staged", ["true", "false"])
+def test_failed_upload_resumes_without_downloading_again(s3, raw_data, monkeypatch, capsys, staged):
+    monkeypatch.setenv('PIPELINE_STAGED', staged)
+
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("S3 unavailable")
+
+    uploads = {name: getattr(data_processing, name) for name in ['upload_dataframe', 'upload_partitioned']}
+    for name in uploads:
+        monkeypatch.setattr(data_processing, name, unavailable)
+    assert not data_processing.process_ecommerce_data()
+
+    run_id = re.search(r"PIPELINE_RESUME_RUN_ID=(\S+)", capsys.readouterr().out).group(1)
+    assert checkpoint_keys(s3)
+
+    # S3 is back: the resumed run only uploads what the failed run built
+    for name, upload in uploads.items():
+        monkeypatch.setattr(data_processing, name, upload)
+
+    calls = []
+    for name in ['download_data_from_s3', 'transform_data']:
+        step = getattr(data_processing, name)
+        monkeypatch.setattr(data_processing, name, lambda *args, _step=step, _name=name, **kwargs:
+                            (calls.append(_name), _step(*args, **kwargs))[1])
+
+    assert data_processing.process_ecommerce_data(run_id)
+    assert calls == []
+    assert checkpoint_keys(s3) == []
+    assert s3.head_object(Bucket=BUCKET, Key="processed/_manifest.json")
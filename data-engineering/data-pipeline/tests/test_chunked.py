@@ -0,0 +1,24 @@
+"""Chunked runs write their cleaned chunks to a directory of their own"""
+
+from conftest import BUCKET
+from data_processing import data_processing
+from pipeline_utils import chunked
+
+
+def test_runs_get_their_own_chunk_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunked, 'CHUNK_DIR', tmp_path / "chunks")
+
+    first, second = chunked.make_chunk_dir("run-1"), chunked.make_chunk_dir("run-1")
+
+    assert first != second and first.parent == second.parent == tmp_path / "chunks"
+
+
+def test_chunked_run_removes_its_chunks(s3, raw_data, monkeypatch, tmp_path):
+    monkeypatch.setattr(chunked, 'CHUNK_ROWS', 100)
+    monkeypatch.setattr(chunked, 'CHUNK_DIR', tmp_path / "chunks")
+
+    assert data_processing.process_ecommerce_data()
+
+    processed = s3.list_objects_v2(Bucket=BUCKET, Prefix="processed/orders_clean/")
+    assert processed.get('Contents')
+    assert list((tmp_path / "chunks").iterdir()) == []
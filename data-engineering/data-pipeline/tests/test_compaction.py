@@ -0,0 +1,61 @@
+"""Compacted dtypes stay in memory: cleaned datasets are written with their schema types"""
+
+import io
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from pipeline_utils.compaction import compact_frame, persisted_frame
+from pipeline_utils.formats import parquet_options, write_parquet
+
+
+def written_schema(df):
+    buffer = io.BytesIO()
+    write_parquet(df, buffer, parquet_options())
+    buffer.seek(0)
+    return pq.read_schema(buffer).remove_metadata()
+
+
+def orders(count, notes=None):
+    return pd.DataFrame({
+        'order_id': [f"o{i}" for i in range(count)],
+        'customer_id': [f"c{i % 3}" for i in range(count)],
+        'order_status': pd.Categorical(["shipped"] * count),
+        'total_amount': [10.0] * count,
+        'billing_same_as_shipping': [True] * count,
+        'notes': [notes] * count,
+        'order_month': pd.Series([1] * count, dtype='int32'),
+        'order_year': pd.Series([2025] * count, dtype='int32'),
+    })
+
+
+def test_compacted_and_plain_frames_are_written_alike():
+    plain = orders(10, notes="leave at door")
+    compacted = compact_frame(plain)
+    assert compacted['order_year'].dtype != plain['order_year'].dtype
+
+    assert written_schema(persisted_frame('orders_clean', compacted)) == \
+        written_schema(persisted_frame('orders_clean', plain))
+
+
+def test_partitions_with_all_nulls_or_many_categories_share_a_schema():
+    sparse = orders(2)
+    sparse['billing_same_as_shipping'] = None
+    wide = orders(300, notes="gift")
+    wide['order_status'] = pd.Categorical([f"status-{i}" for i in range(300)])
+
+    assert written_schema(persisted_frame('orders_clean', compact_frame(sparse))) == \
+        written_schema(persisted_frame('orders_clean', compact_frame(wide)))
+
+
+def test_metrics_are_written_with_their_declared_types():
+    plain = pd.DataFrame({'order_year': pd.Series([2025, 2025], dtype='int32'),
+                          'order_month': pd.Series([1, 2], dtype='int32'),
+                          'total_revenue': [100.0, 200.0],
+                          'order_count': [3, 4]})
+    compacted = compact_frame(plain)
+    assert compacted['order_month'].dtype == 'int8'
+
+    assert written_schema(persisted_frame('monthly_sales', compacted)) == \
+        written_schema(persisted_frame('monthly_sales', plain))
+    assert written_schema(persisted_frame('monthly_sales', plain)).field('order_month').type == 'int32'
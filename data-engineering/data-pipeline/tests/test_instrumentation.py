@@ -0,0 +1,64 @@
+"""Step records: picklable wrappers and S3 bytes only for calls nothing overlapped"""
+
+import threading
+
+import cloudpickle
+
+from pipeline_utils.instrumentation import instrumented, reset_step_metrics, step_metrics, summarize_step_metrics
+
+
+def records_by_step():
+    return {record['step']: record for record in step_metrics()}
+
+
+def test_instrumented_steps_can_be_sent_to_a_worker_process():
+    namespace = {}
+    exec("def double(x):\n    return 2 * x", namespace)
+    # Functions of a script are pickled by value, as the process task runner does for the flow's tasks
+    namespace['double'].__module__ = "__main__"
+
+    step = cloudpickle.loads(cloudpickle.dumps(instrumented(namespace['double'])))
+
+    assert step(2) == 4
+
+
+def test_nested_calls_keep_their_s3_bytes():
+    reset_step_metrics()
+
+    @instrumented
+    def inner():
+        return None
+
+    @instrumented
+    def outer():
+        inner()
+
+    outer()
+
+    records = records_by_step()
+    assert records['outer']['s3_bytes_read'] == 0
+    assert records['inner']['s3_bytes_read'] == 0
+
+
+def test_overlapping_calls_do_not_claim_s3_bytes():
+    reset_step_metrics()
+    started = threading.Barrier(2)
+
+    @instrumented
+    def download():
+        started.wait()
+
+    @instrumented
+    def upload():
+        started.wait()
+
+    threads = [threading.Thread(target=download), threading.Thread(target=upload)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    records = records_by_step()
+    assert records['download']['s3_bytes_read'] is None
+    assert records['upload']['s3_bytes_written'] is None
+    assert summarize_step_metrics(step_metrics())['download']['s3_bytes_read'] is None
@@ -0,0 +1,84 @@
+"""Incremental planning and when a run may record its raw snapshot in the manifest"""
+
+import json
+
+import pandas as pd
+import pytest
+
+from conftest import BUCKET
+from data_processing import data_processing
+from pipeline_utils.manifest import MANIFEST_KEY, missing_datasets, plan_incremental_run
+
+
+def snapshot(**etags):
+    return {name: {'etag': etag, 'size': 1, 'last_modified': "2025-01-01T00:00:00"} for name, etag in etags.items()}
+
+
+def read_manifest(s3):
+    return json.loads(s3.get_object(Bucket=BUCKET, Key=MANIFEST_KEY)['Body'].read())
+
+
+def test_plan_rebuilds_only_outputs_of_changed_inputs():
+    previous = {'raw_objects': snapshot(customers="a", products="b", orders="c", order_items="d", reviews="e")}
+    current = snapshot(customers="a", products="b", orders="changed", order_items="d", reviews="e")
+
+    plan = plan_incremental_run(previous, current)
+
+    assert plan['changed'] == ['orders']
+    assert plan['outputs'] == {'orders_clean', 'order_items_clean', 'customer_metrics', 'monthly_sales'}
+    assert plan['inputs'] == ['customers', 'order_items', 'orders']
+
+
+def test_plan_skips_outputs_with_an_input_missing_from_the_bucket():
+    plan = plan_incremental_run({}, snapshot(orders="c"))
+
+    assert plan['outputs'] == {'orders_clean', 'monthly_sales'}
+    assert plan['inputs'] == ['orders']
+
+
+def test_full_refresh_ignores_the_manifest(monkeypatch):
+    monkeypatch.setenv('PIPELINE_FULL_REFRESH', "true")
+    current = snapshot(orders="c")
+
+    assert plan_incremental_run({'raw_objects': current}, current)['changed'] == ['orders']
+
+
+def test_missing_datasets():
+    assert missing_datasets({'a', 'b', 'c'}, {'a': 1}, {'c': 2}) == ['b']
+    assert missing_datasets({'a'}, {'a': 1}) == []
+
+
+def test_upload_fails_when_a_planned_output_was_not_built(s3):
+    customers = pd.DataFrame({'customer_id': ["c1"], 'age_group': ["18-25"]})
+    outputs = {'customers_clean', 'customer_metrics'}
+
+    assert not data_processing.upload_processed_data(s3, BUCKET, {'customers_clean': customers}, {}, outputs)
+    assert data_processing.upload_processed_data(s3, BUCKET, {'customers_clean': customers},
+                                                 {'customer_metrics': customers}, outputs)
+
+
+@pytest.mark.parametrize("staged", ["true", "false"])
+def test_download_failure_keeps_the_previous_manifest(s3, raw_data, monkeypatch, staged):
+    monkeypatch.setenv('PIPELINE_STAGED', staged)
+    assert data_processing.process_ecommerce_data()
+    previous = read_manifest(s3)
+
+    # Change orders, then lose it on the way down
+    orders = pd.read_csv(raw_data / "orders.csv").iloc[:-3]
+    s3.put_object(Bucket=BUCKET, Key="raw-data/orders.csv", Body=orders.to_csv(index=False).encode("utf-8"))
+
+    download_datasets = data_processing.download_datasets
+
+    def without_orders(*args, **kwargs):
+        datasets, failed = download_datasets(*args, **kwargs)
+        datasets.pop('orders', None)
+        return datasets, failed
+
+    monkeypatch.setattr(data_processing, 'download_datasets', without_orders)
+    assert not data_processing.process_ecommerce_data()
+    assert read_manifest(s3) == previous
+
+    # The next run still sees orders as changed and rebuilds what depends on it
+    monkeypatch.setattr(data_processing, 'download_datasets', download_datasets)
+    assert data_processing.process_ecommerce_data()
+    assert read_manifest(s3)['raw_objects']['orders'] != previous['raw_objects']['orders']
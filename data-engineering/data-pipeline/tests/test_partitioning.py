@@ -0,0 +1,42 @@
+"""Date partitions: only changed partitions are written, in the configured format"""
+
+import pandas as pd
+
+from conftest import BUCKET
+from pipeline_utils.partitioning import read_partitioned, upload_partitioned
+
+
+ORDERS = pd.DataFrame({'order_id': ["o1", "o2", "o3"],
+                       'order_date': pd.to_datetime(["2025-01-05", "2025-01-05", "2025-02-03"]),
+                       'total_amount': [10.0, 20.0, 30.0]})
+
+
+def upload(s3, orders, file_format):
+    return upload_partitioned(s3, orders, orders['order_date'], BUCKET, "processed/orders_clean", file_format,
+                              log=lambda message: None)
+
+
+def stored_files(s3):
+    listing = s3.list_objects_v2(Bucket=BUCKET, Prefix="processed/orders_clean/")
+    return sorted(obj['Key'].removeprefix("processed/orders_clean/") for obj in listing.get('Contents', []))
+
+
+def test_unchanged_partitions_are_skipped(s3):
+    upload(s3, ORDERS, "csv")
+
+    changed = ORDERS.copy()
+    changed.loc[2, 'total_amount'] = 35.0
+
+    assert upload(s3, changed, "csv") == ["year=2025/month=02/day=03/part-00000.csv"]
+
+
+def test_changing_the_format_rewrites_every_partition(s3):
+    upload(s3, ORDERS, "csv")
+
+    assert len(upload(s3, ORDERS, "parquet")) == 2
+    assert stored_files(s3) == ["_partitions.json",
+                                "year=2025/month=01/day=05/part-00000.parquet",
+                                "year=2025/month=02/day=03/part-00000.parquet"]
+
+    orders = read_partitioned(s3, BUCKET, "processed/orders_clean").sort_values('order_id', ignore_index=True)
+    pd.testing.assert_frame_equal(orders, ORDERS, check_dtype=False)
@@ -0,0 +1,35 @@
+"""Profiled steps: picklable wrappers, and folded stacks when pyinstrument is missing"""
+
+import sys
+
+import cloudpickle
+
+from pipeline_utils import profiling
+from pipeline_utils.instrumentation import instrumented
+
+
+def test_profiled_steps_can_be_sent_to_a_worker_process():
+    namespace = {}
+    exec("def double(x):\n    return 2 * x", namespace)
+    namespace['double'].__module__ = "__main__"
+
+    step = cloudpickle.loads(cloudpickle.dumps(instrumented(profiling.profiled(namespace['double']))))
+
+    assert step(2) == 4
+
+
+def test_without_pyinstrument_the_sampled_stacks_are_folded(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_STEPS', {'busy'})
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', tmp_path)
+    monkeypatch.setitem(sys.modules, 'pyinstrument', None)
+    profiling.reset_profiles("run-1")
+
+    @profiling.profiled
+    def busy():
+        return sum(i * i for i in range(2_000_000))
+
+    busy()
+
+    [folded] = (tmp_path / "run-1").glob("*-busy.folded")
+    assert profiling.profile_reports()[0]['flame_graph'] == str(folded)
+    assert "busy" in folded.read_text()
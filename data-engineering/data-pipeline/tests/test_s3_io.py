@@ -0,0 +1,21 @@
+"""Large frames are encoded and uploaded at the same time, in multipart parts"""
+
+import pandas as pd
+
+from conftest import BUCKET
+from pipeline_utils import s3_io
+
+
+def test_frames_above_the_stream_threshold_are_sent_in_parts(s3, monkeypatch):
+    monkeypatch.setattr(s3_io, 'UPLOAD_STREAM_ROWS', 1_000)
+    calls = []
+    s3.meta.events.register('before-call.s3', lambda model, **kwargs: calls.append(model.name))
+
+    # About 20 MB of CSV: above the 8 MB multipart threshold
+    df = pd.DataFrame({'order_id': [f"order-{i:010d}" for i in range(400_000)], 'notes': "x" * 32})
+    assert s3_io.upload_dataframe(s3, df, BUCKET, "processed/orders.csv", skip_unchanged=False)
+
+    assert 'PutObject' not in calls
+    assert calls.count('UploadPart') > 1
+    body = s3.get_object(Bucket=BUCKET, Key="processed/orders.csv")['Body']
+    assert len(pd.read_csv(body)) == len(df)
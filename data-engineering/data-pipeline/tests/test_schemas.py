@@ -0,0 +1,27 @@
+"""Required columns are checked across every chunk of a raw CSV, not chunk by chunk"""
+
+import io
+
+import pytest
+
+from pipeline_utils.schemas import iter_csv_typed
+
+
+def customers_csv(emails):
+    rows = [f"c{i},{email}" for i, email in enumerate(emails)]
+    return io.BytesIO("\n".join(["customer_id,email", *rows]).encode("utf-8"))
+
+
+def test_a_chunk_without_a_required_value_does_not_fail_the_dataset():
+    logged = []
+
+    chunks = list(iter_csv_typed(customers_csv(["a@example.com", "b@example.com", "", ""]),
+                                 'customers', 2, logged.append))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2]
+    assert "Schema customers: 2 rows have no email" in logged
+
+
+def test_a_required_column_empty_in_every_chunk_fails_the_dataset():
+    with pytest.raises(ValueError, match="required column email"):
+        list(iter_csv_typed(customers_csv(["", "", "", ""]), 'customers', 2, print))
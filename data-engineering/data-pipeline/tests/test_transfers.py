@@ -0,0 +1,15 @@
+"""Uploads and their manifest: run state stays out of the data folder"""
+
+from conftest import BUCKET
+from pipeline_utils.transfers import load_upload_manifest, save_upload_manifest, upload_files, verify_objects
+
+
+def test_upload_manifest_is_kept_outside_the_data_folder(s3, raw_data):
+    files = sorted(raw_data.glob("*.csv"))
+
+    uploaded = upload_files(s3, files, BUCKET, "raw-data/", log=lambda message: None)
+    save_upload_manifest(BUCKET, uploaded)
+
+    assert sorted(path.name for path in raw_data.iterdir()) == [path.name for path in files]
+    assert load_upload_manifest(BUCKET) == uploaded
+    assert not verify_objects(s3, BUCKET, load_upload_manifest(BUCKET), "raw-data/", log=lambda message: None)